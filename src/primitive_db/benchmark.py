@@ -0,0 +1,418 @@
+"""
+Набор тестов производительности основных операций базы данных.
+
+Для каждого размера таблицы генерируются синтетические данные заданной
+схемы (детерминированно, по seed) во временном каталоге, затем каждая
+операция выполняется warmup раз без замера и repeat раз с замером
+(сборщик мусора на время замера отключается). Результаты записываются
+в JSON и могут сравниваться с результатами предыдущего запуска:
+
+    python -m src.primitive_db.benchmark --rows 10000,100000 --output new.json
+    python -m src.primitive_db.benchmark --compare old.json --output new.json
+
+При сравнении медианы времени, выросшие больше чем на threshold,
+считаются регрессиями, и программа завершается с кодом 1.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+from .chunked import ChunkedTable
+from .columnar import ColumnarTable
+from .constants import ALLOWED_TYPES, STORAGE_BACKEND
+from .core import create_table, delete, evict_table_cache, insert, select, update
+from .decorators import set_confirm_policy
+from .index import build_index
+from .table import TableData
+from .utils import load_table_data, save_table_data
+
+# Размеры таблиц и схема по умолчанию
+DEFAULT_ROWS = (10000, 100000, 1000000)
+DEFAULT_SCHEMA = 'name:str,age:int,active:bool'
+
+# Имя таблицы, на которой выполняются замеры
+_TABLE = 'bench'
+
+# Количество операций в одном замере для точечных операций
+_BATCH = 100
+
+# Число различных значений целочисленных столбцов (условие col = v выбирает ~0.1% записей)
+_INT_VALUES = 1000
+
+
+def parse_schema(schema):
+    """
+    Разбирает схему вида 'name:str,age:int'.
+
+    Returns:
+        Список столбцов [(имя, тип), ...] без ID
+
+    Raises:
+        ValueError: Если схема некорректна или в ней нет целочисленного столбца
+    """
+    columns = []
+    for item in schema.split(','):
+        name, _, column_type = item.strip().partition(':')
+        if not name or column_type not in ALLOWED_TYPES:
+            raise ValueError(f"Некорректный столбец '{item}': используйте формат name:type ({', '.join(sorted(ALLOWED_TYPES))})")
+        columns.append((name, column_type))
+    if not any(column_type == 'int' for _, column_type in columns):
+        raise ValueError("В схеме нужен хотя бы один столбец int (для условий WHERE)")
+    return columns
+
+
+def _random_value(rng, column_type, rows):
+    """Возвращает случайное значение столбца указанного типа."""
+    if column_type == 'int':
+        return rng.randrange(_INT_VALUES)
+    if column_type == 'bool':
+        return rng.random() < 0.5
+    return f"v{rng.randrange(rows)}"
+
+
+def generate_rows(columns, count, seed=0):
+    """
+    Генерирует записи таблицы со схемой columns (ID от 1 до count).
+
+    Args:
+        columns: Список столбцов [(имя, тип), ...] без ID
+        count: Количество записей
+        seed: Начальное значение генератора случайных чисел
+
+    Returns:
+        Список словарей
+    """
+    rng = random.Random(seed)
+    return [
+        {'ID': row_id, **{name: _random_value(rng, column_type, count) for name, column_type in columns}}
+        for row_id in range(1, count + 1)
+    ]
+
+
+class _Fixture:
+    """Таблица с синтетическими данными, на которой выполняются замеры."""
+
+    def __init__(self, columns, rows, layout, seed):
+        self.columns = columns
+        self.rows = rows
+        self.rng = random.Random(seed)
+        self.metadata = {}
+        create_table(self.metadata, _TABLE, columns)
+        self.metadata[_TABLE]['sequence'] = rows
+        data = generate_rows(columns, rows, seed)
+        if layout == 'columnar':
+            self.table_data = ColumnarTable.from_rows(self.metadata[_TABLE]['columns'], data)
+        else:
+            self.table_data = TableData(data)
+        save_table_data(_TABLE, self.table_data)
+        self.int_column = next(name for name, column_type in columns if column_type == 'int')
+        self.next_delete = 1
+
+    def values(self):
+        """Возвращает значения новой записи в виде строк команды insert."""
+        return [str(_random_value(self.rng, column_type, self.rows)).lower() for _, column_type in self.columns]
+
+    def random_id(self):
+        """Возвращает ID существующей записи."""
+        return self.rng.randint(self.next_delete, self.rows)
+
+
+def _bench_create_table(fixture):
+    metadata = {}
+    for i in range(_BATCH):
+        create_table(metadata, f"t{i}", fixture.columns)
+    return _BATCH
+
+
+def _bench_insert(fixture):
+    for _ in range(_BATCH):
+        insert(fixture.metadata, _TABLE, fixture.values(), [], fixture.table_data)
+    return _BATCH
+
+
+def _bench_select_all(fixture):
+    select(fixture.table_data)
+    return 1
+
+
+def _bench_select_where_miss(fixture):
+    evict_table_cache(_TABLE)
+    select(fixture.table_data, {fixture.int_column: fixture.rng.randrange(_INT_VALUES)}, None,
+           fixture.metadata, _TABLE)
+    return 1
+
+
+def _bench_select_where_hit(fixture):
+    # Кэш заполняется при прогреве (или первым запросом замера), остальные запросы - попадания
+    where_clause = {fixture.int_column: 1}
+    for _ in range(_BATCH):
+        select(fixture.table_data, where_clause, None, fixture.metadata, _TABLE)
+    return _BATCH
+
+
+def _bench_select_where_indexed(fixture):
+    evict_table_cache(_TABLE)
+    select(fixture.table_data, {fixture.int_column: fixture.rng.randrange(_INT_VALUES)}, fixture.indexes,
+           fixture.metadata, _TABLE)
+    return 1
+
+
+def _bench_update_by_id(fixture):
+    for _ in range(_BATCH):
+        update(fixture.table_data, {fixture.int_column: fixture.rng.randrange(_INT_VALUES)},
+               {'ID': fixture.random_id()}, [], None, fixture.metadata, _TABLE)
+    return _BATCH
+
+
+def _bench_update_where(fixture):
+    update(fixture.table_data, {fixture.int_column: fixture.rng.randrange(_INT_VALUES)},
+           {fixture.int_column: fixture.rng.randrange(_INT_VALUES)}, [], None, fixture.metadata, _TABLE)
+    return 1
+
+
+def _bench_delete_by_id(fixture):
+    for _ in range(_BATCH):
+        delete(fixture.table_data, {'ID': fixture.next_delete}, [], None, fixture.metadata, _TABLE)
+        fixture.next_delete += 1
+    return _BATCH
+
+
+def _bench_load_table_data(fixture):
+    load_table_data(_TABLE)
+    return 1
+
+
+def _bench_save_table_data(fixture):
+    save_table_data(_TABLE, fixture.table_data)
+    return 1
+
+
+def _bench_chunked_bulk_insert(fixture):
+    # Вставка всех записей в таблицу из фрагментов (в памяти): время должно расти линейно с числом записей
+    table = ChunkedTable(f"{_TABLE}_chunked")
+    for row in fixture.table_data.to_rows():
+        table.append_row(row)
+    return fixture.rows
+
+
+# Операции в порядке выполнения: сначала читающие, затем изменяющие таблицу
+OPERATIONS = {
+    'create_table': _bench_create_table,
+    'select_all': _bench_select_all,
+    'select_where_miss': _bench_select_where_miss,
+    'select_where_hit': _bench_select_where_hit,
+    'select_where_indexed': _bench_select_where_indexed,
+    'load_table_data': _bench_load_table_data,
+    'save_table_data': _bench_save_table_data,
+    'chunked_bulk_insert': _bench_chunked_bulk_insert,
+    'insert': _bench_insert,
+    'update_by_id': _bench_update_by_id,
+    'update_where': _bench_update_where,
+    'delete_by_id': _bench_delete_by_id,
+}
+
+
+def _measure(operation, fixture, warmup, repeat):
+    """
+    Замеряет операцию.
+
+    Returns:
+        Кортеж (количество операций в одном замере, список времен замеров в секундах)
+    """
+    for _ in range(warmup):
+        operation(fixture)
+    timings = []
+    ops = 1
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            ops = operation(fixture)
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return ops, timings
+
+
+def _summary(timings, ops):
+    """Возвращает статистику замеров (в секундах на один замер и микросекундах на операцию)."""
+    median = statistics.median(timings)
+    return {
+        'min': min(timings),
+        'median': median,
+        'mean': statistics.fmean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'max': max(timings),
+        'per_op_us': median / ops * 1e6,
+    }
+
+
+def run_benchmarks(rows_list, schema=DEFAULT_SCHEMA, operations=None, warmup=1, repeat=5, layout='rows', seed=0,
+                   progress=None):
+    """
+    Выполняет замеры во временном каталоге и возвращает отчет.
+
+    Args:
+        rows_list: Размеры таблиц
+        schema: Схема таблицы (см. parse_schema)
+        operations: Имена операций из OPERATIONS (None - все)
+        warmup: Число запусков без замера перед замерами
+        repeat: Число замеров каждой операции
+        layout: Представление таблицы в памяти: 'rows' или 'columnar'
+        seed: Начальное значение генератора данных
+        progress: Функция progress(сообщение) для вывода хода выполнения
+
+    Returns:
+        Словарь отчета {'environment': {...}, 'config': {...}, 'results': [...]}
+    """
+    columns = parse_schema(schema)
+    names = list(OPERATIONS) if operations is None else operations
+    unknown = [name for name in names if name not in OPERATIONS]
+    if unknown:
+        raise ValueError(f"Неизвестные операции: {', '.join(unknown)}. Доступны: {', '.join(OPERATIONS)}")
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='primitive_db_bench_')
+    cwd = os.getcwd()
+    set_confirm_policy('yes')
+    try:
+        os.chdir(workdir)
+        # Сообщения операций (print) не должны влиять на результаты и засорять вывод
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            for rows in rows_list:
+                start = time.perf_counter()
+                fixture = _Fixture(columns, rows, layout, seed)
+                fixture.indexes = {fixture.int_column: build_index(_TABLE, fixture.int_column, fixture.table_data,
+                                                                   save=False)}
+                if progress:
+                    progress(f"{rows} записей: данные подготовлены за {time.perf_counter() - start:.2f} с")
+                for name in names:
+                    ops, timings = _measure(OPERATIONS[name], fixture, warmup, repeat)
+                    result = {'rows': rows, 'operation': name, 'ops': ops, 'seconds': _summary(timings, ops)}
+                    results.append(result)
+                    if progress:
+                        progress(f"  {name}: {result['seconds']['per_op_us']:.1f} мкс/операция")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        set_confirm_policy('ask')
+
+    return {
+        'environment': {
+            'timestamp': datetime.now(UTC).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'rows': list(rows_list),
+            'schema': schema,
+            'layout': layout,
+            'storage': STORAGE_BACKEND,
+            'warmup': warmup,
+            'repeat': repeat,
+            'seed': seed,
+            'batch': _BATCH,
+        },
+        'results': results,
+    }
+
+
+def compare_reports(baseline, current, threshold=0.1):
+    """
+    Сравнивает медианы времени операций двух отчетов.
+
+    Args:
+        baseline: Отчет предыдущего запуска
+        current: Отчет текущего запуска
+        threshold: Допустимый относительный рост медианы (0.1 - 10%)
+
+    Returns:
+        Список кортежей (размер, операция, медиана до, медиана после, отношение, регрессия)
+        для операций, замеренных в обоих отчетах
+    """
+    previous = {(item['rows'], item['operation']): item['seconds']['per_op_us'] for item in baseline['results']}
+    comparison = []
+    for item in current['results']:
+        key = (item['rows'], item['operation'])
+        if key not in previous:
+            continue
+        before, after = previous[key], item['seconds']['per_op_us']
+        ratio = after / before if before else float('inf')
+        comparison.append((key[0], key[1], before, after, ratio, ratio > 1 + threshold))
+    return comparison
+
+
+def main(argv=None):
+    """Точка входа: выполняет замеры, сохраняет отчет и сравнивает его с предыдущим."""
+    parser = argparse.ArgumentParser(prog='python -m src.primitive_db.benchmark',
+                                     description='Замеры производительности основных операций')
+    parser.add_argument('--rows', default=','.join(map(str, DEFAULT_ROWS)),
+                        help='размеры таблиц через запятую (по умолчанию %(default)s)')
+    parser.add_argument('--schema', default=DEFAULT_SCHEMA, help='схема таблицы (по умолчанию %(default)s)')
+    parser.add_argument('--operations', help=f"операции через запятую: {', '.join(OPERATIONS)}")
+    parser.add_argument('--layout', choices=['rows', 'columnar'], default='rows', help='представление таблицы в памяти')
+    parser.add_argument('--warmup', type=int, default=1, help='запусков без замера (по умолчанию %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='замеров каждой операции (по умолчанию %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора данных')
+    parser.add_argument('--output', metavar='FILE', help='сохранить отчет в JSON (по умолчанию - в stdout)')
+    parser.add_argument('--compare', metavar='FILE', help='сравнить с отчетом предыдущего запуска')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='допустимый рост медианы при сравнении (по умолчанию %(default)s = 10%%)')
+    args = parser.parse_args(argv)
+
+    try:
+        rows_list = [int(value) for value in args.rows.split(',')]
+    except ValueError:
+        parser.error('--rows: укажите целые числа через запятую')
+    if args.repeat < 1 or args.warmup < 0 or any(rows < 1 for rows in rows_list):
+        parser.error('размеры таблиц и --repeat должны быть положительными, --warmup - неотрицательным')
+    operations = args.operations.split(',') if args.operations else None
+
+    def progress(message):
+        print(message, file=sys.stderr)
+
+    try:
+        report = run_benchmarks(rows_list, args.schema, operations, args.warmup, args.repeat, args.layout, args.seed,
+                                progress)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = 0
+        print(f"\nСравнение с '{args.compare}' (мкс/операция):", file=sys.stderr)
+        for key in ('schema', 'layout', 'storage'):
+            if baseline.get('config', {}).get(key) != report['config'][key]:
+                print(f"  Внимание: отчеты различаются параметром {key}.", file=sys.stderr)
+        for rows, name, before, after, ratio, regression in compare_reports(baseline, report, args.threshold):
+            mark = '  РЕГРЕССИЯ' if regression else ''
+            print(f"  {rows:>8} {name:<22} {before:>12.1f} -> {after:>12.1f} ({ratio:.2f}x){mark}", file=sys.stderr)
+            regressions += regression
+        if regressions:
+            print(f"Найдено регрессий: {regressions}.", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,662 @@
+"""
+Двоичный формат таблиц с доступом через mmap.
+
+Таблица хранится в двух файлах:
+- data/<table>.bin - заголовок и записи фиксированной длины, упорядоченные по ID;
+- data/<table>.<версия>.heap - куча строк в UTF-8, на которые ссылаются записи.
+  Имя файла кучи записано в заголовке, поэтому при перезаписи таблицы новая
+  куча создается рядом со старой, и таблица переключается на неё атомарной
+  заменой файла записей.
+
+Поля записи: int - 8 байт, bool - 1 байт, str - смещение (8 байт) и длина
+(4 байта) строки в куче. Файлы отображаются в память (mmap), поэтому открытие
+таблицы читает только заголовок, а поиск по ID (двоичный поиск по упорядоченным
+записям) или по индексу затрагивает лишь нужные страницы. Страницы файлов
+находятся в кэше ОС и общие для всех процессов, открывших таблицу.
+
+Изменения записываются прямо в отображенный файл. При обновлении строки новое
+значение дописывается в кучу, а старое остается в ней до уплотнения (compact).
+
+Перед первым изменением записи после контрольной точки её прежнее содержимое
+дописывается в журнал отката data/<table>.bin.undo (вместе с исходным числом
+записей). Контрольная точка (flush) сбрасывает файл на диск и удаляет журнал.
+Если процесс прервется между контрольными точками, при запуске (check_binary)
+записи восстанавливаются из журнала: таблица возвращается к состоянию
+последней контрольной точки, а не остается с частично примененными изменениями.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+from collections.abc import Mapping
+
+from .constants import DATA_DIR
+from .durability import created, durability, removed, replace_file, sync_file
+from .metrics import increment
+from .table import apply_changes, encode_column
+
+# Сигнатура и версия формата
+_MAGIC = b'PDBT'
+_VERSION = 1
+
+# Начало файла: сигнатура, версия, резерв, число записей, длина заголовка со схемой
+_PREFIX = struct.Struct('<4sHHQI')
+
+# Формат поля записи для каждого типа столбца
+_FIELD_FORMATS = {
+    'int': 'q',
+    'bool': '?',
+    'str': 'QI',
+}
+
+# Минимальное число мест для записей при расширении файла
+_MIN_CAPACITY = 64
+
+# Журнал отката: исходное число записей, затем записи (смещение, длина, прежние байты)
+_UNDO_COUNT = struct.Struct('<Q')
+_UNDO_RECORD = struct.Struct('<QI')
+
+
+def binary_path(table_name):
+    """Возвращает путь к файлу записей таблицы."""
+    return f'{DATA_DIR}/{table_name}.bin'
+
+
+def undo_path(path):
+    """Возвращает путь к журналу отката файла записей."""
+    return path + '.undo'
+
+
+def _read_header(path):
+    """
+    Читает заголовок файла записей.
+
+    Returns:
+        Кортеж (число записей, длина заголовка, заголовок {'columns', 'heap'})
+
+    Raises:
+        ValueError: Если файл не является таблицей в двоичном формате
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"Файл '{path}' не является таблицей в двоичном формате")
+        magic, version, _, count, header_length = _PREFIX.unpack(prefix)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Файл '{path}' не является таблицей в двоичном формате")
+        return count, header_length, json.loads(f.read(header_length))
+
+
+def _heap_path(path, header):
+    """Возвращает путь к куче строк, указанной в заголовке."""
+    return os.path.join(os.path.dirname(path), header['heap'])
+
+
+def _data_offset(header_length):
+    """Возвращает смещение первой записи (выровненное на 8 байт)."""
+    return (_PREFIX.size + header_length + 7) // 8 * 8
+
+
+class _IdPositions(Mapping):
+    """Отображение ID -> позиция записи с двоичным поиском по файлу таблицы."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, row_id):
+        position = self._table.position_of(row_id)
+        if position is None:
+            raise KeyError(row_id)
+        return position
+
+    def __iter__(self):
+        get = self._table.getter('ID')
+        return (get(i) for i in range(len(self._table)))
+
+    def __len__(self):
+        return len(self._table)
+
+
+class MmapTable:
+    """
+    Таблица в двоичном файле, отображенном в память.
+
+    Поддерживает тот же набор операций, что и TableData, поэтому select,
+    update и delete работают с ней без изменений. Записи выдаются наружу
+    как новые словари.
+    """
+
+    def __init__(self, table_name):
+        self.path = binary_path(table_name)
+        self._heap_file = None
+        self._heap = None
+        self._file = open(self.path, 'r+b')  # noqa: SIM115 - файл открыт, пока открыта таблица
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, _, self._count, header_length = _PREFIX.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f"Файл '{self.path}' не является таблицей в двоичном формате")
+        header = json.loads(self._map[_PREFIX.size:_PREFIX.size + header_length])
+        self.heap_path = _heap_path(self.path, header)
+        self.columns = [tuple(column) for column in header['columns']]
+        self._offset = _data_offset(header_length)
+
+        self._row = struct.Struct('<' + ''.join(_FIELD_FORMATS[col_type] for _, col_type in self.columns))
+        self._fields = {}  # столбец -> (тип, Struct поля, смещение в записи)
+        field_offset = 0
+        for name, col_type in self.columns:
+            field = struct.Struct('<' + _FIELD_FORMATS[col_type])
+            self._fields[name] = (col_type, field, field_offset)
+            field_offset += field.size
+
+        # Куча открывается без буферизации: дописанные строки сразу видны через mmap
+        self._heap_file = open(self.heap_path, 'r+b', buffering=0)  # noqa: SIM115
+        self._heap_size = os.fstat(self._heap_file.fileno()).st_size
+
+        self.version = 0  # увеличивается при каждом изменении записей
+        # Журнал отката открывается при первом изменении после контрольной точки
+        self._undo = None
+        self._base_count = self._count  # число записей на момент контрольной точки
+        self._saved_from = self._count  # записи с этой позиции уже сохранены в журнале
+        self._saved = set()  # отдельные сохраненные записи (до _saved_from)
+
+    @classmethod
+    def create(cls, table_name, columns, rows):
+        """
+        Записывает таблицу в двоичном формате (с заменой существующих файлов) и открывает её.
+
+        Args:
+            table_name: Имя таблицы
+            columns: Схема таблицы [('ID', 'int'), ('name', 'str'), ...]
+            rows: Записи таблицы
+
+        Raises:
+            ValueError: Если в записи нет значения для столбца или оно не соответствует типу
+        """
+        path = binary_path(table_name)
+        try:
+            old_heap = _heap_path(path, _read_header(path)[2])
+        except (FileNotFoundError, ValueError):
+            old_heap = None
+        heap_name = f'{table_name}.{time.time_ns():x}.heap'
+        heap_path = _heap_path(path, {'heap': heap_name})
+        header = json.dumps({'columns': [list(column) for column in columns], 'heap': heap_name}).encode('utf-8')
+        row_struct = struct.Struct('<' + ''.join(_FIELD_FORMATS[col_type] for _, col_type in columns))
+        offset = _data_offset(len(header))
+
+        rows = sorted(rows, key=lambda row: row['ID'])
+        try:
+            with open(path + '.tmp', 'wb') as f, open(heap_path, 'wb') as heap:
+                f.write(_PREFIX.pack(_MAGIC, _VERSION, 0, len(rows), len(header)))
+                f.write(header)
+                f.write(bytes(offset - f.tell()))
+                heap_size = 0
+                for row in rows:
+                    fields = []
+                    try:
+                        for name, col_type in columns:
+                            value = row[name]
+                            if col_type == 'str':
+                                data = value.encode('utf-8')
+                                heap.write(data)
+                                fields.extend((heap_size, len(data)))
+                                heap_size += len(data)
+                            else:
+                                fields.append(value)
+                        f.write(row_struct.pack(*fields))
+                    except (KeyError, AttributeError, struct.error) as e:
+                        raise ValueError(f"запись с ID {row.get('ID')} не соответствует схеме таблицы ({e})") from e
+                increment('bytes_written', f.tell() + heap_size)
+            if durability() != 'none':
+                with open(heap_path, 'rb') as heap:
+                    os.fsync(heap.fileno())
+        except BaseException:
+            for tmp_path in (path + '.tmp', heap_path):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+        # Журнал отката относится к прежнему файлу и к новому неприменим
+        if os.path.exists(undo_path(path)):
+            os.remove(undo_path(path))
+            removed(undo_path(path))
+        # Замена файла записей переключает таблицу на новую кучу
+        replace_file(path + '.tmp', path)
+        if old_heap is not None and os.path.exists(old_heap):
+            os.remove(old_heap)
+            removed(old_heap)
+        return cls(table_name)
+
+    def close(self):
+        """
+        Закрывает отображение и файлы таблицы.
+
+        Журнал отката остается: изменения, не сохраненные через flush,
+        будут отменены при следующем запуске.
+        """
+        for resource in (self._heap, self._map, self._heap_file, self._file, getattr(self, '_undo', None)):
+            if resource is not None:
+                resource.close()
+
+    def flush(self):
+        """
+        Сохраняет изменения (контрольная точка).
+
+        Измененные страницы отображения и кучу строк сбрасываются на диск (кроме
+        уровня надежности 'none'), после чего журнал отката удаляется.
+        """
+        if durability() != 'none':
+            self._map.flush()
+            os.fsync(self._heap_file.fileno())
+        if self._undo is not None:
+            self._undo.close()
+            self._undo = None
+            os.remove(undo_path(self.path))
+            removed(undo_path(self.path))
+        self._base_count = self._saved_from = self._count
+        self._saved.clear()
+
+    def _save_rows(self, first, last):
+        """
+        Сохраняет в журнал отката прежнее содержимое записей [first, last) перед их изменением.
+
+        Сохраняются только записи, существовавшие на момент контрольной точки
+        (остальные после отката не видны), и каждая - один раз.
+        """
+        if self._undo is None:
+            self._undo = open(undo_path(self.path), 'wb', buffering=0)  # noqa: SIM115 - до контрольной точки
+            self._undo.write(_UNDO_COUNT.pack(self._base_count))
+            created(undo_path(self.path))
+        last = min(last, self._base_count, self._saved_from)
+        if last - first == 1 and first in self._saved:
+            return
+        if first >= last:
+            return
+        size = self._row.size
+        start = self._offset + first * size
+        length = (last - first) * size
+        self._undo.write(_UNDO_RECORD.pack(start, length) + self._map[start:start + length])
+        sync_file(self._undo)
+        if last == self._saved_from:
+            self._saved_from = first
+        else:
+            self._saved.add(first)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return (self.row(i) for i in range(self._count))
+
+    def __getitem__(self, position):
+        return self.row(position)
+
+    def _slot(self, position):
+        """Возвращает смещение записи в файле."""
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        return self._offset + position * self._row.size
+
+    def _read_str(self, offset, length):
+        """Читает строку из кучи."""
+        if not length:
+            return ''
+        if self._heap is None or offset + length > len(self._heap):
+            # Куча выросла после отображения - отображаем заново
+            if self._heap is not None:
+                self._heap.close()
+            self._heap = mmap.mmap(self._heap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._heap[offset:offset + length].decode('utf-8')
+
+    def _write_str(self, value):
+        """Дописывает строку в кучу и возвращает (смещение, длина)."""
+        if not isinstance(value, str):
+            raise TypeError(f"ожидалась строка, получено '{value}'")
+        data = value.encode('utf-8')
+        offset = self._heap_size
+        self._heap_file.seek(offset)
+        self._heap_file.write(data)
+        self._heap_size += len(data)
+        return offset, len(data)
+
+    def row(self, position):
+        """Собирает запись в указанной позиции в словарь."""
+        values = iter(self._row.unpack_from(self._map, self._slot(position)))
+        row = {}
+        for name, col_type in self.columns:
+            row[name] = self._read_str(next(values), next(values)) if col_type == 'str' else next(values)
+        return row
+
+    def value(self, position, column, default=None):
+        """Возвращает значение столбца записи в указанной позиции."""
+        return self.getter(column, default)(position)
+
+    def getter(self, column, default=None):
+        """Возвращает функцию position -> значение столбца (читает только поле записи)."""
+        if column not in self._fields:
+            return lambda position: default
+        col_type, field, field_offset = self._fields[column]
+        slot = self._slot
+        if col_type == 'str':
+            return lambda position: self._read_str(*field.unpack_from(self._map, slot(position) + field_offset))
+        return lambda position: field.unpack_from(self._map, slot(position) + field_offset)[0]
+
+    @property
+    def positions(self):
+        """Отображение ID -> позиция записи (без загрузки всех ID в память)."""
+        return _IdPositions(self)
+
+    def _bisect(self, row_id):
+        """Возвращает позицию первой записи с ID не меньше row_id."""
+        get = self.getter('ID')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if get(middle) < row_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def position_of(self, row_id):
+        """Возвращает позицию записи с указанным ID или None (двоичный поиск)."""
+        if not isinstance(row_id, int):
+            return None
+        position = self._bisect(row_id)
+        if position < self._count and self.value(position, 'ID') == row_id:
+            return position
+        return None
+
+    def row_positions(self):
+        """Возвращает позиции всех записей по порядку."""
+        return range(self._count)
+
+    def export_column(self, column):
+        """Кодирует столбец для копирования в разделяемую память (см. table.encode_column)."""
+        if column not in self._fields:
+            return None
+        get = self.getter(column)
+        return encode_column([get(i) for i in range(self._count)])
+
+    def _pack_field(self, column, value):
+        """Кодирует значение поля в байты."""
+        col_type, field, _ = self._fields[column]
+        if col_type == 'str':
+            return field.pack(*self._write_str(value))
+        if col_type == 'int' and not isinstance(value, int) or col_type == 'bool' and not isinstance(value, bool):
+            raise TypeError(f"значение '{value}' не соответствует типу {col_type}")
+        try:
+            return field.pack(value)
+        except struct.error as e:
+            raise OverflowError(str(e)) from e
+
+    def _set_count(self, count):
+        """Записывает число записей в заголовок."""
+        self._count = count
+        struct.pack_into('<Q', self._map, 8, count)
+
+    def _reserve(self, count):
+        """Расширяет файл так, чтобы в нем помещалось count записей."""
+        capacity = (len(self._map) - self._offset) // self._row.size
+        if count <= capacity:
+            return
+        capacity = max(count, capacity * 2, _MIN_CAPACITY)
+        self._map.close()
+        self._file.truncate(self._offset + capacity * self._row.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def append_row(self, row):
+        """Добавляет запись, сохраняя порядок записей по ID."""
+        self.version += 1
+        data = b''.join(self._pack_field(name, row[name]) for name, _ in self.columns)
+        position = self._count
+        if position and self.value(position - 1, 'ID') > row['ID']:
+            position = self._bisect(row['ID'])
+        self._save_rows(position, self._count)
+        self._reserve(self._count + 1)
+        start = self._offset + position * self._row.size
+        end = self._offset + self._count * self._row.size
+        if position < self._count:
+            # Сдвигаем следующие записи на одно место
+            self._map.move(start + self._row.size, start, end - start)
+        self._map[start:start + self._row.size] = data
+        self._set_count(self._count + 1)
+
+    def update_row(self, position, values):
+        """Обновляет поля записи в указанной позиции."""
+        self.version += 1
+        slot = self._slot(position)
+        if position < 0:
+            position += self._count
+        self._save_rows(position, position + 1)
+        for name, value in values.items():
+            if name not in self._fields:
+                raise KeyError(name)
+            if name == 'ID':
+                raise ValueError("ID записи не изменяется")
+            data = self._pack_field(name, value)
+            field_offset = self._fields[name][2]
+            self._map[slot + field_offset:slot + field_offset + len(data)] = data
+
+    def remove_positions(self, positions):
+        """Удаляет записи по позициям, сдвигая следующие записи (порядок по ID сохраняется)."""
+        removed = sorted(set(positions))
+        if not removed:
+            return
+        self.version += 1
+        self._save_rows(removed[0], self._count)
+        size = self._row.size
+        target = removed[0]
+        for n, position in enumerate(removed):
+            # Переносим записи между удаляемыми одним перемещением
+            following = removed[n + 1] if n + 1 < len(removed) else self._count
+            count = following - position - 1
+            if count:
+                self._map.move(self._offset + target * size, self._offset + (position + 1) * size, count * size)
+                target += count
+        self._set_count(self._count - len(removed))
+
+    def apply_change(self, record):
+        """Применяет запись журнала изменений (insert/update/delete)."""
+        op = record['op']
+        if op == 'insert':
+            position = self.position_of(record['row']['ID'])
+            if position is None:
+                self.append_row(record['row'])
+            else:
+                # Повторное применение журнала (например, после сбоя при уплотнении)
+                self.update_row(position, {name: value for name, value in record['row'].items() if name != 'ID'})
+        elif op == 'update':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.update_row(position, record['set'])
+        elif op == 'delete':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.remove_positions([position])
+
+    def to_rows(self):
+        """Возвращает записи таблицы в виде списка словарей."""
+        return [self.row(i) for i in range(self._count)]
+
+
+class BinaryStorage:
+    """Движок хранения таблиц в двоичном формате (см. MmapTable)."""
+
+    name = 'binary'
+
+    def exists(self, table_name):
+        """Проверяет, хранится ли таблица в двоичном формате."""
+        return os.path.exists(binary_path(table_name))
+
+    def load(self, table_name):
+        """Открывает таблицу (читается только заголовок)."""
+        return MmapTable(table_name)
+
+    def save(self, table_name, data):
+        """Записывает таблицу заново (строки, на которые больше нет ссылок, удаляются из кучи)."""
+        columns = getattr(data, 'columns', None)
+        if columns is None:
+            table = self.load(table_name)
+            columns = table.columns
+            table.close()
+        MmapTable.create(table_name, columns, data).close()
+
+    def append(self, table_name, data, changes):
+        """
+        Сохраняет изменения таблицы.
+
+        Изменения MmapTable уже записаны в отображенный файл - остается сбросить
+        страницы на диск. Изменения таблицы в другом представлении применяются к файлу.
+        """
+        if isinstance(data, MmapTable) and data.path == binary_path(table_name):
+            data.flush()
+            return
+        table = self.load(table_name)
+        try:
+            apply_changes(table, changes)
+            table.flush()
+        finally:
+            table.close()
+
+    def compact(self, table_name):
+        """Переписывает таблицу, освобождая место в куче строк, и возвращает её."""
+        table = self.load(table_name)
+        try:
+            self.save(table_name, table)
+        finally:
+            table.close()
+        return self.load(table_name)
+
+    def remove(self, table_name):
+        """Удаляет файлы таблицы."""
+        path = binary_path(table_name)
+        try:
+            paths = [_heap_path(path, _read_header(path)[2]), path, undo_path(path)]
+        except FileNotFoundError:
+            return
+        except ValueError:
+            paths = [path, undo_path(path)]
+        for file_path in paths:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                continue
+            removed(file_path)
+
+    def signature(self, table_name):
+        """Возвращает отпечаток файла записей [размер, время изменения, inode] или None."""
+        try:
+            stat = os.stat(binary_path(table_name))
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def stamp(self, table_name):
+        """
+        Возвращает отпечаток файла записей, числа записей и кучи строк.
+
+        Изменения записей на месте другие процессы видят через общее отображение
+        файла, а число записей хранится в заголовке и входит в отпечаток.
+        """
+        path = binary_path(table_name)
+        try:
+            count, _, header = _read_header(path)
+            stat = os.stat(_heap_path(path, header))
+            heap_signature = [stat.st_size, stat.st_mtime_ns]
+        except (FileNotFoundError, ValueError):
+            count, heap_signature = None, None
+        return (self.signature(table_name), count, heap_signature)
+
+    def read_changes(self, table_name, offset=0):
+        """Журнала у двоичного формата нет: изменения записываются в файл таблицы."""
+        return [], 0
+
+
+def _roll_back(path):
+    """
+    Возвращает файл записей к состоянию последней контрольной точки по журналу отката.
+
+    Журнал дописывается перед каждым изменением файла, поэтому оборванная
+    последняя запись журнала означает, что соответствующее изменение не выполнялось.
+
+    Returns:
+        Число восстановленных участков файла или None, если журнала нет
+    """
+    journal = undo_path(path)
+    try:
+        with open(journal, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    records = []
+    if len(data) >= _UNDO_COUNT.size:
+        count = _UNDO_COUNT.unpack_from(data)[0]
+        offset = _UNDO_COUNT.size
+        while offset + _UNDO_RECORD.size <= len(data):
+            start, length = _UNDO_RECORD.unpack_from(data, offset)
+            offset += _UNDO_RECORD.size
+            if offset + length > len(data):
+                break
+            records.append((start, data[offset:offset + length]))
+            offset += length
+        with open(path, 'r+b') as f:
+            # Участок может быть сохранен несколько раз: первое сохранение - состояние контрольной точки
+            for start, content in reversed(records):
+                f.seek(start)
+                f.write(content)
+            f.seek(8)
+            f.write(_UNDO_COUNT.pack(count))
+            f.flush()
+            os.fsync(f.fileno())
+    os.remove(journal)
+    removed(journal)
+    return len(records)
+
+
+def check_binary(table_name):
+    """
+    Проверяет файл таблицы в двоичном формате после сбоя.
+
+    Изменения, не сохраненные до сбоя, отменяются по журналу отката.
+    Если число записей в заголовке больше, чем помещается в файле (запись
+    была прервана при расширении), оно уменьшается до числа целых записей.
+    Файлы куч, на которые не ссылается заголовок (остались от прерванной
+    перезаписи таблицы), удаляются.
+
+    Returns:
+        Список сообщений о найденных проблемах
+    """
+    path = binary_path(table_name)
+    try:
+        count, header_length, header = _read_header(path)
+    except ValueError as e:
+        return [f"{e}: файл поврежден."]
+    messages = []
+    restored = _roll_back(path)
+    if restored is not None:
+        count = _read_header(path)[0]
+        messages.append(f"Таблица '{table_name}': отменены изменения, не сохраненные до сбоя "
+                        f"(восстановлено участков файла: {restored}).")
+    row_size = struct.calcsize('<' + ''.join(_FIELD_FORMATS[col_type] for _, col_type in header['columns']))
+    capacity = max((os.path.getsize(path) - _data_offset(header_length)) // row_size, 0)
+    if count > capacity:
+        with open(path, 'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('<Q', capacity))
+        messages.append(f"Таблица '{table_name}': число записей исправлено с {count} на {capacity}.")
+
+    heap_path = _heap_path(path, header)
+    if not os.path.exists(heap_path):
+        open(heap_path, 'wb').close()
+        messages.append(f"Таблица '{table_name}': отсутствовала куча строк, создан пустой файл.")
+    directory = os.path.dirname(path)
+    for name in os.listdir(directory):
+        prefix, _, rest = name.partition(f'{table_name}.')
+        if not prefix and rest.endswith('.heap') and '.' not in rest[:-len('.heap')] and name != header['heap']:
+            os.remove(os.path.join(directory, name))
+            messages.append(f"Таблица '{table_name}': удалена неиспользуемая куча строк '{name}'.")
+    return messages
@@ -0,0 +1,99 @@
+"""
+Потоковая загрузка и выгрузка данных таблиц в форматах CSV и JSON Lines.
+
+Файлы читаются и записываются построчно, поэтому объем памяти на разбор
+не зависит от размера файла.
+"""
+import csv
+import json
+import os
+
+from .constants import BULK_CHUNK_SIZE
+
+# Расширение файла -> формат
+FILE_FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+
+def detect_format(filepath):
+    """
+    Определяет формат файла по расширению.
+
+    Raises:
+        ValueError: Если формат не поддерживается
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension not in FILE_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат файла '{filepath}'. Используйте: {', '.join(FILE_FORMATS)}")
+    return FILE_FORMATS[extension]
+
+
+def _read_records(filepath, file_format):
+    """Построчно читает файл и возвращает пары (номер строки, словарь значений)."""
+    with open(filepath, 'r', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+
+
+def read_chunks(filepath, column_names, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Читает записи из файла частями.
+
+    Значения упорядочиваются по схеме таблицы; отсутствующий столбец
+    дает значение None. Столбец ID из файла игнорируется.
+
+    Args:
+        filepath: Путь к файлу .csv или .jsonl
+        column_names: Имена столбцов таблицы без ID
+        chunk_size: Количество записей в одной части
+
+    Returns:
+        Генератор списков пар (номер строки, список значений)
+    """
+    chunk = []
+    for line_number, record in _read_records(filepath, detect_format(filepath)):
+        chunk.append((line_number, [record.get(name) for name in column_names]))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_rows(filepath, column_names, rows):
+    """
+    Записывает записи таблицы в файл построчно.
+
+    Args:
+        filepath: Путь к файлу .csv или .jsonl
+        column_names: Имена столбцов таблицы, включая ID
+        rows: Итерируемый объект с записями таблицы
+
+    Returns:
+        Количество записанных записей
+    """
+    file_format = detect_format(filepath)
+    count = 0
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(column_names)
+            for row in rows:
+                writer.writerow([row.get(name, '') for name in column_names])
+                count += 1
+        else:
+            for row in rows:
+                record = {name: row.get(name) for name in column_names}
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+                f.write('\n')
+                count += 1
+    return count
@@ -0,0 +1,597 @@
+"""
+Хранение таблиц фрагментами по диапазонам ID.
+
+Таблица хранится в нескольких файлах:
+- data/<table>.<номер>.<версия>.chunk - записи одного фрагмента (JSON):
+  фрагмент с номером N содержит записи с ID от N * CHUNK_ROWS + 1
+  до (N + 1) * CHUNK_ROWS;
+- data/<table>.chunks - оглавление: для каждого фрагмента имя файла, число
+  записей и карта зон - минимум, максимум и число пустых значений каждого
+  столбца.
+
+При открытии таблицы читается только оглавление, файл фрагмента читается
+при первом обращении к его записям. Изменения перезаписывают только
+затронутые фрагменты: новые версии файлов записываются рядом со старыми,
+таблица переключается на них атомарной заменой оглавления, после чего старые
+файлы удаляются. Прерванная запись оставляет прежнее оглавление и прежние файлы.
+
+По картам зон планировщик исключает из полного просмотра фрагменты, в которых
+нет записей, удовлетворяющих условию WHERE (см. ChunkedTable.prune).
+"""
+import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Mapping
+from itertools import chain
+
+from .constants import CHUNK_ROWS, DATA_DIR
+from .durability import atomic_write, removed
+from .metrics import increment
+from .table import TableData, apply_changes, encode_column
+
+
+def manifest_path(table_name):
+    """Возвращает путь к оглавлению таблицы."""
+    return f'{DATA_DIR}/{table_name}.chunks'
+
+
+def _chunk_file(table_name, number, version):
+    """Возвращает имя файла фрагмента (в каталоге DATA_DIR)."""
+    return f'{table_name}.{number}.{version}.chunk'
+
+
+def _read_manifest(table_name):
+    """
+    Читает оглавление таблицы.
+
+    Returns:
+        Словарь {'chunk_rows', 'version', 'chunks': {номер: {'file', 'rows', 'zones'}}}
+
+    Raises:
+        FileNotFoundError: Если таблица не хранится фрагментами
+        ValueError: Если оглавление повреждено
+    """
+    with open(manifest_path(table_name), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+        increment('bytes_read', os.fstat(f.fileno()).st_size)
+    manifest['chunks'] = {int(number): entry for number, entry in manifest['chunks'].items()}
+    return manifest
+
+
+def zone_map(rows):
+    """
+    Строит карту зон записей фрагмента.
+
+    Returns:
+        Словарь {столбец: [минимум, максимум, число пустых значений]}; минимум
+        и максимум - None, если непустых значений нет. Для столбца со
+        значениями несравнимых типов вместо списка хранится None
+    """
+    columns = set().union(*(row.keys() for row in rows))
+    zones = {}
+    for column in sorted(columns):
+        values = [row.get(column) for row in rows]
+        present = [value for value in values if value is not None]
+        try:
+            bounds = [min(present), max(present)] if present else [None, None]
+        except TypeError:
+            zones[column] = None
+            continue
+        zones[column] = bounds + [len(values) - len(present)]
+    return zones
+
+
+def _widen(zones, values):
+    """
+    Расширяет карту зон значениями новой или измененной записи.
+
+    Границы остаются верными, но могут быть шире фактических, а число пустых
+    значений - больше фактического; точная карта строится при записи фрагмента.
+    """
+    for column, value in values.items():
+        if column not in zones:
+            zones[column] = [value, value, 0] if value is not None else [None, None, 1]
+            continue
+        zone = zones[column]
+        if zone is None:
+            continue
+        if value is None:
+            zone[2] += 1
+            continue
+        try:
+            if zone[0] is None or value < zone[0]:
+                zone[0] = value
+            if zone[1] is None or value > zone[1]:
+                zone[1] = value
+        except TypeError:
+            zones[column] = None
+
+
+def _compare_zone(zone, op, value):
+    """Может ли во фрагменте с зоной столбца zone быть значение, для которого верно 'значение op value'."""
+    low, high, nulls = zone
+    if op == '!=':
+        # Пустые значения не равны value
+        return bool(nulls) or low is None or not low == high == value
+    if low is None:
+        return False
+    if op == '=':
+        return low <= value <= high
+    if op == '<':
+        return low < value
+    if op == '<=':
+        return low <= value
+    if op == '>':
+        return high > value
+    return high >= value
+
+
+def may_match(zones, expression):
+    """
+    Проверяет по карте зон, могут ли во фрагменте быть записи, удовлетворяющие условию.
+
+    Ответ осторожный: False - только если таких записей во фрагменте точно нет.
+
+    Args:
+        zones: Карта зон фрагмента (см. zone_map)
+        expression: Дерево выражения (см. predicate.bind_where)
+    """
+    kind = expression[0]
+    if kind == 'and':
+        return all(may_match(zones, operand) for operand in expression[1])
+    if kind == 'or':
+        return any(may_match(zones, operand) for operand in expression[1])
+    if kind == 'not':
+        return True
+    zone = zones.get(expression[1])
+    if zone is None:
+        return True
+    try:
+        if kind == 'cmp':
+            return expression[3] is None or _compare_zone(zone, expression[2], expression[3])
+        if kind == 'in':
+            return any(value is None or _compare_zone(zone, '=', value) for value in expression[2])
+        # between
+        return zone[0] is not None and expression[2] <= zone[1] and expression[3] >= zone[0]
+    except TypeError:
+        # Значения несравнимых типов: предикат проверит записи сам
+        return True
+
+
+class _ChunkPositions(Mapping):
+    """Отображение ID -> позиция записи (фрагмент находится по ID без загрузки остальных)."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, row_id):
+        position = self._table.position_of(row_id)
+        if position is None:
+            raise KeyError(row_id)
+        return position
+
+    def __iter__(self):
+        get = self._table.getter('ID')
+        return (get(i) for i in range(len(self._table)))
+
+    def __len__(self):
+        return len(self._table)
+
+
+class ChunkedTable:
+    """
+    Таблица, разбитая на фрагменты по диапазонам ID.
+
+    Поддерживает тот же набор операций, что и TableData, поэтому select,
+    update и delete работают с ней без изменений. Позиции записей сквозные:
+    фрагменты идут по возрастанию номеров, внутри фрагмента - в порядке
+    его записей. Файлы фрагментов загружаются при первом обращении,
+    измененные фрагменты записываются методом write.
+    """
+
+    def __init__(self, table_name, manifest=None):
+        manifest = manifest or {'chunk_rows': CHUNK_ROWS, 'version': 0, 'chunks': {}}
+        self.table_name = table_name
+        self.chunk_rows = manifest['chunk_rows']
+        self._version = manifest['version']
+        self._chunks = manifest['chunks']  # номер -> {'file', 'rows', 'zones'}
+        self._numbers = sorted(self._chunks)
+        self._loaded = {}  # номер -> TableData с записями фрагмента
+        self._dirty = set()  # номера измененных фрагментов
+        self._obsolete = []  # файлы, которые удаляются после записи оглавления
+        self._starts = None  # позиции первых записей фрагментов (строятся при обращении)
+        self._count = sum(entry['rows'] for entry in self._chunks.values())
+        self._layout = 0  # увеличивается при добавлении и удалении записей
+        self.version = 0  # увеличивается при каждом изменении записей
+        # Функция, применяемая к записям каждого загруженного фрагмента (см. Session._upgrade)
+        self.transform = None
+
+    @classmethod
+    def open(cls, table_name):
+        """Открывает таблицу (читается только оглавление)."""
+        return cls(table_name, _read_manifest(table_name))
+
+    @classmethod
+    def create(cls, table_name, rows):
+        """
+        Записывает таблицу заново из списка записей.
+
+        Файлы прежней версии таблицы (если она есть) удаляются после записи нового оглавления.
+        """
+        try:
+            previous = _read_manifest(table_name)
+        except (FileNotFoundError, ValueError):
+            previous = None
+        table = cls(table_name)
+        if previous is not None:
+            table._version = previous['version']
+            table._obsolete = [entry['file'] for entry in previous['chunks'].values()]
+        for row in rows:
+            table.append_row(row)
+        table.write(force=True)
+        return table
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return chain.from_iterable(self._chunk(number) for number in list(self._numbers))
+
+    def __getitem__(self, position):
+        number, local = self._locate(position)
+        return self._chunk(number)[local]
+
+    @property
+    def chunk_count(self):
+        """Число фрагментов таблицы."""
+        return len(self._numbers)
+
+    def _number(self, row_id):
+        """Возвращает номер фрагмента, в который попадает запись с указанным ID."""
+        return (row_id - 1) // self.chunk_rows
+
+    def _chunk(self, number):
+        """Возвращает записи фрагмента, загружая файл при первом обращении."""
+        chunk = self._loaded.get(number)
+        if chunk is None:
+            with open(f"{DATA_DIR}/{self._chunks[number]['file']}", 'r', encoding='utf-8') as f:
+                chunk = TableData(json.load(f))
+                increment('bytes_read', os.fstat(f.fileno()).st_size)
+            if self.transform is not None:
+                self.transform(chunk)
+            increment('chunks_read')
+            self._loaded[number] = chunk
+        return chunk
+
+    def _chunk_starts(self):
+        """Возвращает список позиций первых записей фрагментов (в порядке номеров)."""
+        if self._starts is None:
+            starts, position = [], 0
+            for number in self._numbers:
+                starts.append(position)
+                position += self._chunks[number]['rows']
+            self._starts = starts
+        return self._starts
+
+    def _locate(self, position):
+        """Возвращает (номер фрагмента, позиция записи внутри фрагмента)."""
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        starts = self._chunk_starts()
+        i = bisect_right(starts, position) - 1
+        return self._numbers[i], position - starts[i]
+
+    def _resized(self, number):
+        """Учитывает изменение числа записей фрагмента (удаляет опустевший фрагмент)."""
+        chunk = self._loaded[number]
+        entry = self._chunks[number]
+        rows = len(chunk)
+        # Общее число записей меняется на разницу только этого фрагмента
+        self._count += rows - entry['rows']
+        if rows:
+            entry['rows'] = rows
+            self._dirty.add(number)
+        else:
+            del self._chunks[number]
+            del self._loaded[number]
+            self._numbers.remove(number)
+            self._dirty.discard(number)
+            if entry['file'] is not None:
+                self._obsolete.append(entry['file'])
+        self._starts = None
+        self._layout += 1
+
+    def value(self, position, column, default=None):
+        """Возвращает значение столбца записи в указанной позиции."""
+        return self[position].get(column, default)
+
+    def getter(self, column, default=None):
+        """
+        Возвращает функцию position -> значение столбца (для скомпилированных условий).
+
+        Фрагмент последней прочитанной позиции запоминается, поэтому при
+        просмотре подряд идущих позиций фрагмент не ищется заново.
+        """
+        current = [0, 0, None, None]  # начало, конец, записи фрагмента, _layout
+
+        def get(position):
+            if not (current[0] <= position < current[1] and current[3] == self._layout):
+                number, local = self._locate(position)
+                start = position - local
+                current[:] = start, start + self._chunks[number]['rows'], self._chunk(number), self._layout
+            return current[2][position - current[0]].get(column, default)
+        return get
+
+    @property
+    def positions(self):
+        """Отображение ID -> позиция записи (загружается только фрагмент искомого ID)."""
+        return _ChunkPositions(self)
+
+    def position_of(self, row_id):
+        """Возвращает позицию записи с указанным ID или None."""
+        if not isinstance(row_id, int) or isinstance(row_id, bool):
+            return None
+        number = self._number(row_id)
+        if number not in self._chunks:
+            return None
+        local = self._chunk(number).position_of(row_id)
+        if local is None:
+            return None
+        return self._chunk_starts()[bisect_left(self._numbers, number)] + local
+
+    def row_positions(self):
+        """Возвращает позиции всех записей по порядку."""
+        return range(self._count)
+
+    def export_column(self, column):
+        """Кодирует столбец для копирования в разделяемую память (см. table.encode_column)."""
+        return encode_column([row.get(column) for row in self])
+
+    def prune(self, expression):
+        """
+        Возвращает номера фрагментов, которые могут содержать записи, удовлетворяющие условию.
+
+        Фрагменты не загружаются: проверяются только их карты зон.
+        """
+        return [number for number in self._numbers if may_match(self._chunks[number]['zones'], expression)]
+
+    def chunk_rows_count(self, numbers):
+        """Возвращает суммарное число записей фрагментов."""
+        return sum(self._chunks[number]['rows'] for number in numbers)
+
+    def chunk_positions(self, numbers):
+        """Возвращает позиции записей фрагментов numbers (остальные фрагменты не загружаются)."""
+        increment('chunks_skipped', len(self._numbers) - len(numbers))
+        starts = self._chunk_starts()
+        ranges = []
+        for number in numbers:
+            start = starts[bisect_left(self._numbers, number)]
+            ranges.append(range(start, start + self._chunks[number]['rows']))
+        return chain.from_iterable(ranges)
+
+    def update_row(self, position, values):
+        """Обновляет поля записи в указанной позиции."""
+        self.version += 1
+        number, local = self._locate(position)
+        self._chunk(number).update_row(local, values)
+        _widen(self._chunks[number]['zones'], values)
+        self._dirty.add(number)
+
+    def to_rows(self):
+        """Возвращает записи таблицы в виде списка словарей."""
+        return list(self)
+
+    def append_row(self, row):
+        """Добавляет запись во фрагмент её диапазона ID."""
+        self.version += 1
+        number = self._number(row['ID'])
+        if number not in self._chunks:
+            self._chunks[number] = {'file': None, 'rows': 0, 'zones': {}}
+            self._loaded[number] = TableData()
+            insort(self._numbers, number)
+        zones = self._chunks[number]['zones']
+        self._chunk(number).append_row(row)
+        _widen(zones, {column: row.get(column) for column in zones.keys() | row.keys()})
+        self._resized(number)
+
+    def remove_positions(self, positions):
+        """
+        Удаляет записи по позициям.
+
+        Args:
+            positions: Итерируемый объект с позициями удаляемых записей
+        """
+        by_chunk = {}
+        for position in positions:
+            number, local = self._locate(position)
+            by_chunk.setdefault(number, []).append(local)
+        if not by_chunk:
+            return
+        self.version += 1
+        for number, local_positions in by_chunk.items():
+            chunk = self._chunk(number)
+            chunk.remove_positions(local_positions)
+            # Позиции записей сквозные, поэтому пустые места фрагмента вычищаются
+            # сразу (фрагмент не больше CHUNK_ROWS записей)
+            chunk.compact()
+            self._resized(number)
+
+    def apply_change(self, record):
+        """Применяет запись журнала изменений (insert/update/delete)."""
+        op = record['op']
+        if op == 'insert':
+            position = self.position_of(record['row']['ID'])
+            if position is None:
+                self.append_row(record['row'])
+            else:
+                # Повторное применение журнала (например, после сбоя при записи)
+                self.update_row(position, record['row'])
+        elif op == 'update':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.update_row(position, record['set'])
+        elif op == 'delete':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.remove_positions([position])
+
+    def write(self, force=False):
+        """
+        Записывает измененные фрагменты и оглавление.
+
+        Каждый измененный фрагмент записывается в файл новой версии, и для него
+        строится точная карта зон. Затем атомарно заменяется оглавление,
+        и файлы прежних версий удаляются.
+
+        Args:
+            force: Записать оглавление, даже если фрагменты не менялись
+        """
+        if not (self._dirty or self._obsolete or force):
+            return
+        os.makedirs(DATA_DIR, exist_ok=True)
+        self._version += 1
+        for number in sorted(self._dirty):
+            entry = self._chunks[number]
+            rows = self._loaded[number]
+            file_name = _chunk_file(self.table_name, number, self._version)
+            atomic_write(f'{DATA_DIR}/{file_name}',
+                         lambda f, rows=rows: json.dump(rows, f, ensure_ascii=False, separators=(',', ':')))
+            if entry['file'] is not None:
+                self._obsolete.append(entry['file'])
+            entry.update(file=file_name, rows=len(rows), zones=zone_map(rows))
+
+        manifest = {'chunk_rows': self.chunk_rows, 'version': self._version,
+                    'chunks': {str(number): self._chunks[number] for number in self._numbers}}
+        atomic_write(manifest_path(self.table_name),
+                     lambda f: json.dump(manifest, f, ensure_ascii=False, separators=(',', ':')))
+        for file_name in self._obsolete:
+            _remove_file(f'{DATA_DIR}/{file_name}')
+        self._dirty.clear()
+        self._obsolete = []
+
+    def describe(self):
+        """
+        Возвращает сведения о фрагментах для вывода.
+
+        Returns:
+            Список (номер, число записей, загружен ли фрагмент, карта зон)
+        """
+        return [(number, self._chunks[number]['rows'], number in self._loaded, self._chunks[number]['zones'])
+                for number in self._numbers]
+
+
+def _remove_file(path):
+    """Удаляет файл, если он существует."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    removed(path)
+
+
+def _table_chunk_files(table_name):
+    """Возвращает имена всех файлов фрагментов таблицы в каталоге DATA_DIR."""
+    prefix = f'{table_name}.'
+    names = []
+    for name in os.listdir(DATA_DIR):
+        if not (name.startswith(prefix) and name.endswith('.chunk')):
+            continue
+        number, _, version = name[len(prefix):-len('.chunk')].partition('.')
+        if number.isdigit() and version.isdigit():
+            names.append(name)
+    return names
+
+
+class ChunkedStorage:
+    """Движок хранения таблиц фрагментами по диапазонам ID (см. ChunkedTable)."""
+
+    name = 'chunked'
+
+    def exists(self, table_name):
+        """Проверяет, хранится ли таблица фрагментами."""
+        return os.path.exists(manifest_path(table_name))
+
+    def load(self, table_name):
+        """Открывает таблицу (читается только оглавление). Если таблицы нет, возвращает пустую."""
+        try:
+            return ChunkedTable.open(table_name)
+        except FileNotFoundError:
+            return ChunkedTable(table_name)
+
+    def save(self, table_name, data):
+        """Записывает таблицу заново."""
+        ChunkedTable.create(table_name, data.to_rows() if hasattr(data, 'to_rows') else data)
+
+    def append(self, table_name, data, changes):
+        """
+        Сохраняет изменения таблицы: перезаписываются только измененные фрагменты.
+
+        Изменения таблицы в другом представлении применяются к фрагментам на диске.
+        """
+        if isinstance(data, ChunkedTable) and data.table_name == table_name:
+            data.write()
+            return
+        table = self.load(table_name)
+        apply_changes(table, changes)
+        table.write()
+
+    def compact(self, table_name):
+        """Переписывает все фрагменты таблицы с точными картами зон и возвращает её."""
+        table = self.load(table_name)
+        return ChunkedTable.create(table_name, table.to_rows())
+
+    def remove(self, table_name):
+        """Удаляет оглавление и файлы фрагментов таблицы."""
+        if not os.path.isdir(DATA_DIR):
+            return
+        for name in _table_chunk_files(table_name):
+            _remove_file(f'{DATA_DIR}/{name}')
+        _remove_file(manifest_path(table_name))
+
+    def signature(self, table_name):
+        """
+        Возвращает отпечаток оглавления [размер, время изменения, inode] или None.
+
+        Любое изменение фрагментов заменяет оглавление, поэтому его отпечатка достаточно.
+        """
+        try:
+            stat = os.stat(manifest_path(table_name))
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def stamp(self, table_name):
+        """Возвращает отпечаток всех файлов таблицы (используется, чтобы заметить изменения другим процессом)."""
+        return (self.signature(table_name),)
+
+    def read_changes(self, table_name, offset=0):
+        """Журнала у фрагментов нет: изменения записываются в файлы фрагментов."""
+        return [], 0
+
+
+def check_chunked(table_name):
+    """
+    Проверяет файлы таблицы, хранящейся фрагментами, после сбоя.
+
+    Файлы фрагментов, на которые не ссылается оглавление (остались от
+    прерванной записи), удаляются. Сообщается об отсутствующих файлах.
+
+    Returns:
+        Список сообщений о найденных проблемах
+    """
+    try:
+        manifest = _read_manifest(table_name)
+    except (ValueError, KeyError) as e:
+        return [f"Оглавление фрагментов таблицы '{table_name}' повреждено: {e}."]
+    referenced = {entry['file'] for entry in manifest['chunks'].values()}
+    messages = []
+    for name in _table_chunk_files(table_name):
+        if name not in referenced:
+            os.remove(f'{DATA_DIR}/{name}')
+            messages.append(f"Таблица '{table_name}': удален неиспользуемый файл фрагмента '{name}'.")
+    for name in sorted(referenced):
+        if not os.path.exists(f'{DATA_DIR}/{name}'):
+            messages.append(f"Таблица '{table_name}': отсутствует файл фрагмента '{name}'.")
+    return messages
@@ -0,0 +1,217 @@
+"""
+Клиент сервера базы данных (см. server).
+
+Протокол: клиент отправляет команды на языке базы данных по одной
+в строке (UTF-8), сервер отвечает на каждую команду в том же порядке
+кадром '<статус> <длина>\\n<вывод команды>', где статус:
+- OK - команда выполнена, вывод - текст, который команда печатает в консоли;
+- BYE - команда exit, сервер закрывает соединение;
+- ERR - внутренняя ошибка сервера при выполнении команды.
+
+Клиент может отправить несколько команд, не дожидаясь ответов
+(конвейер, см. Connection.pipeline), а ConnectionPool переиспользует
+открытые соединения между запросами.
+
+Пример:
+    pool = ConnectionPool('unix:database.sock')
+    pool.execute("insert users John 28")
+    outputs = pool.pipeline(["select users where age > 20", "select count(*) from users"])
+    pool.execute("prepare by_age as select users where age = ?")
+    print(pool.execute_prepared("by_age", 28))
+"""
+import shlex
+import socket
+import threading
+from contextlib import contextmanager
+
+from .constants import SERVER_POOL_SIZE
+
+# Число команд конвейера, после отправки которых читаются ответы
+# (чтобы буферы сокета не переполнялись при больших конвейерах)
+_PIPELINE_BATCH = 64
+
+
+def parse_address(address):
+    """
+    Разбирает адрес сервера.
+
+    Args:
+        address: 'unix:<путь>' - Unix-сокет, '<хост>:<порт>' - TCP
+
+    Returns:
+        Кортеж ('unix', путь) или ('tcp', (хост, порт))
+
+    Raises:
+        ValueError: Если адрес некорректен
+    """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, separator, port = address.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError(f"Некорректный адрес сервера '{address}': используйте unix:<путь> или <хост>:<порт>")
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+def prepared_command(name, params):
+    """Формирует команду execute для подготовленной команды name со значениями params."""
+    return ' '.join(['execute', shlex.quote(name), *(shlex.quote(str(param)) for param in params)])
+
+
+class Connection:
+    """Соединение с сервером базы данных."""
+
+    def __init__(self, address, timeout=None):
+        kind, target = parse_address(address)
+        family = socket.AF_UNIX if kind == 'unix' else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(target)
+        except OSError:
+            self._socket.close()
+            raise
+        if kind == 'tcp':
+            # Короткие команды отправляются сразу, без ожидания алгоритма Нейгла
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile('rb')
+        self.closed = False
+
+    def execute(self, command):
+        """
+        Выполняет команду и возвращает её вывод.
+
+        Raises:
+            ConnectionError: Если сервер закрыл соединение
+            RuntimeError: Если при выполнении команды на сервере произошла ошибка
+        """
+        return self.pipeline([command])[0]
+
+    def execute_prepared(self, name, *params):
+        """
+        Выполняет команду, подготовленную командой prepare (подготовленные
+        команды хранятся в сессии сервера и доступны всем соединениям).
+
+        Args:
+            name: Имя подготовленной команды
+            *params: Значения параметров (экранируются, поэтому могут содержать пробелы и кавычки)
+
+        Returns:
+            Вывод команды
+        """
+        return self.execute(prepared_command(name, params))
+
+    def pipeline(self, commands):
+        """
+        Выполняет несколько команд, отправляя их без ожидания ответов.
+
+        Args:
+            commands: Список команд (каждая - одна строка)
+
+        Returns:
+            Список выводов команд в том же порядке
+
+        Raises:
+            ValueError: Если команда содержит перевод строки
+            ConnectionError: Если сервер закрыл соединение
+            RuntimeError: Если при выполнении команды на сервере произошла ошибка
+        """
+        outputs = []
+        errors = []
+        for start in range(0, len(commands), _PIPELINE_BATCH):
+            batch = commands[start:start + _PIPELINE_BATCH]
+            for command in batch:
+                if '\n' in command or '\r' in command:
+                    raise ValueError("Команда не должна содержать перевод строки")
+            self._socket.sendall(''.join(command + '\n' for command in batch).encode('utf-8'))
+            for _ in batch:
+                status, output = self._read_frame()
+                if status == 'ERR':
+                    errors.append(output)
+                outputs.append(output)
+        if errors:
+            raise RuntimeError(f"Ошибка сервера: {errors[0]}")
+        return outputs
+
+    def close(self):
+        """Закрывает соединение."""
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_frame(self):
+        """Читает кадр ответа и возвращает (статус, вывод команды)."""
+        header = self._file.readline()
+        if not header.endswith(b'\n'):
+            self.close()
+            raise ConnectionError("Сервер закрыл соединение")
+        status, length = header.decode('ascii').split()
+        payload = self._file.read(int(length))
+        if status == 'BYE':
+            self.close()
+        return status, payload.decode('utf-8')
+
+
+class ConnectionPool:
+    """
+    Пул соединений с сервером для использования из нескольких потоков.
+
+    Соединения открываются по мере необходимости (не больше size одновременно)
+    и возвращаются в пул после выполнения команд.
+    """
+
+    def __init__(self, address, size=SERVER_POOL_SIZE, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение из пула на время блока with."""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = Connection(self.address, self.timeout)
+            try:
+                yield connection
+            except BaseException:
+                # Состояние соединения неизвестно (например, ответы не дочитаны)
+                connection.close()
+                raise
+            if not connection.closed:
+                with self._lock:
+                    self._idle.append(connection)
+        finally:
+            self._slots.release()
+
+    def execute(self, command):
+        """Выполняет команду на одном из соединений пула и возвращает её вывод."""
+        with self.connection() as connection:
+            return connection.execute(command)
+
+    def pipeline(self, commands):
+        """Выполняет команды конвейером на одном соединении и возвращает их выводы."""
+        with self.connection() as connection:
+            return connection.pipeline(commands)
+
+    def execute_prepared(self, name, *params):
+        """Выполняет подготовленную команду на одном из соединений пула и возвращает её вывод."""
+        with self.connection() as connection:
+            return connection.execute_prepared(name, *params)
+
+    def close(self):
+        """Закрывает свободные соединения пула."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
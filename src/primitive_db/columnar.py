@@ -0,0 +1,361 @@
+"""
+Колоночное представление таблицы в памяти.
+
+Каждый столбец хранится отдельно в компактном виде:
+- int - массив array('q') 64-битных целых;
+- bool - битовая карта (1 бит на значение);
+- str - словарное кодирование: массив кодов и список различных строк.
+
+ColumnarTable поддерживает тот же набор операций, что и TableData,
+поэтому select, update и delete работают с ним без изменений. Как и в
+TableData, удаленные записи остаются пустыми местами до вычищения (compact),
+поэтому удаление не сдвигает значения столбцов.
+"""
+from array import array
+
+
+def _kept(data, removed, first):
+    """Возвращает массив значений data, начиная с first, без позиций removed."""
+    return array(data.typecode, (item for i, item in enumerate(data[first:], first) if i not in removed))
+
+
+class _IntColumn:
+    """Столбец целых чисел в массиве array('q')."""
+
+    def __init__(self):
+        self.data = array('q')
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        if not isinstance(value, int):
+            raise TypeError(f"ожидалось целое число, получено '{value}'")
+        self.data.append(value)
+
+    def get(self, position):
+        return self.data[position]
+
+    def set(self, position, value):
+        if not isinstance(value, int):
+            raise TypeError(f"ожидалось целое число, получено '{value}'")
+        self.data[position] = value
+
+    def pop(self):
+        return self.data.pop()
+
+    def remove(self, removed, first):
+        """Удаляет значения в позициях removed, сдвигая следующие (first - наименьшая позиция)."""
+        self.data[first:] = _kept(self.data, removed, first)
+
+    def scan(self, value):
+        """Возвращает позиции, где значение равно value."""
+        return (i for i, item in enumerate(self.data) if item == value)
+
+    def export(self):
+        """Возвращает (способ кодирования, буфер, список значений) для разделяемой памяти."""
+        return ('int', self.data, None)
+
+    def nbytes(self):
+        return self.data.itemsize * len(self.data)
+
+
+class _BoolColumn:
+    """Столбец логических значений в виде битовой карты."""
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, value):
+        if not isinstance(value, bool):
+            raise TypeError(f"ожидалось логическое значение, получено '{value}'")
+        if self.length % 8 == 0:
+            self.bits.append(0)
+        self.length += 1
+        self.set(self.length - 1, value)
+
+    def get(self, position):
+        if position < 0:
+            position += self.length
+        return bool(self.bits[position >> 3] >> (position & 7) & 1)
+
+    def set(self, position, value):
+        if not isinstance(value, bool):
+            raise TypeError(f"ожидалось логическое значение, получено '{value}'")
+        if value:
+            self.bits[position >> 3] |= 1 << (position & 7)
+        else:
+            self.bits[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+
+    def pop(self):
+        value = self.get(self.length - 1)
+        self.set(self.length - 1, False)
+        self.length -= 1
+        if self.length % 8 == 0:
+            self.bits.pop()
+        return value
+
+    def remove(self, removed, first):
+        """Удаляет значения в позициях removed, сдвигая следующие (first - наименьшая позиция)."""
+        start = first - first % 8  # начало байта с позицией first
+        tail = self.bits[start // 8:]
+        # Биты от start строкой '0'/'1' (от младшего бита к старшему)
+        bits = f'{int.from_bytes(tail, "little"):0{len(tail) * 8}b}'[::-1][:self.length - start]
+        kept, previous = [], 0
+        for position in sorted(removed):
+            kept.append(bits[previous:position - start])
+            previous = position - start + 1
+        kept.append(bits[previous:])
+        bits = ''.join(kept)
+        self.bits[start // 8:] = int(bits[::-1] or '0', 2).to_bytes((len(bits) + 7) // 8, 'little')
+        self.length = start + len(bits)
+
+    def scan(self, value):
+        """Возвращает позиции, где значение равно value."""
+        return (i for i in range(self.length) if self.get(i) == value)
+
+    def export(self):
+        """Возвращает (способ кодирования, буфер, список значений) для разделяемой памяти."""
+        return ('bits', self.bits, None)
+
+    def nbytes(self):
+        return len(self.bits)
+
+
+class _StrColumn:
+    """Столбец строк со словарным кодированием."""
+
+    def __init__(self):
+        self.codes = array('I')
+        self.values = []  # код -> строка
+        self.lookup = {}  # строка -> код
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _encode(self, value):
+        if not isinstance(value, str):
+            raise TypeError(f"ожидалась строка, получено '{value}'")
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.lookup[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self._encode(value))
+
+    def get(self, position):
+        return self.values[self.codes[position]]
+
+    def set(self, position, value):
+        self.codes[position] = self._encode(value)
+
+    def pop(self):
+        return self.values[self.codes.pop()]
+
+    def remove(self, removed, first):
+        """Удаляет значения в позициях removed, сдвигая следующие (first - наименьшая позиция)."""
+        self.codes[first:] = _kept(self.codes, removed, first)
+
+    def scan(self, value):
+        """Возвращает позиции, где значение равно value (сравниваются коды)."""
+        code = self.lookup.get(value)
+        if code is None:
+            return iter(())
+        return (i for i, item in enumerate(self.codes) if item == code)
+
+    def export(self):
+        """Возвращает (способ кодирования, буфер, список значений) для разделяемой памяти."""
+        return ('codes', self.codes, self.values)
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + sum(len(value.encode('utf-8')) for value in self.values)
+
+
+_COLUMN_TYPES = {
+    'int': _IntColumn,
+    'bool': _BoolColumn,
+    'str': _StrColumn,
+}
+
+
+class ColumnarTable:
+    """
+    Таблица, хранящая значения по столбцам.
+
+    Записи выдаются наружу как новые словари, поэтому изменять данные
+    нужно через update_row, а не через полученный словарь. Позиция записи -
+    номер значения в столбцах вместе с пустыми местами удаленных записей;
+    len и перебор учитывают только записи.
+    """
+
+    def __init__(self, columns):
+        self.columns = [(name, col_type) for name, col_type in columns]
+        self._data = {name: _COLUMN_TYPES[col_type]() for name, col_type in self.columns}
+        self._ids = self._data['ID']
+        self._positions = {}
+        self._dead = set()  # позиции удаленных записей, еще не вычищенные из столбцов
+        self.version = 0  # увеличивается при каждом изменении записей
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """
+        Строит колоночную таблицу из списка словарей.
+
+        Raises:
+            KeyError: Если в записи нет значения для столбца
+            TypeError: Если значение не соответствует типу столбца
+        """
+        table = cls(columns)
+        for row in rows:
+            table.append_row(row)
+        return table
+
+    def to_rows(self):
+        """Возвращает записи таблицы в виде списка словарей (пустые места вычищаются)."""
+        self.compact()
+        return [self.row(i) for i in range(len(self))]
+
+    def __len__(self):
+        return len(self._ids) - len(self._dead)
+
+    def __iter__(self):
+        return (self.row(i) for i in self.row_positions())
+
+    def __getitem__(self, position):
+        return self.row(position)
+
+    def row(self, position):
+        """Собирает запись в указанной позиции в словарь."""
+        return {name: column.get(position) for name, column in self._data.items()}
+
+    def value(self, position, column, default=None):
+        """Возвращает значение столбца записи в указанной позиции."""
+        if column not in self._data:
+            return default
+        return self._data[column].get(position)
+
+    def getter(self, column, default=None):
+        """Возвращает функцию position -> значение столбца (для скомпилированных условий)."""
+        if column not in self._data:
+            return lambda position: default
+        return self._data[column].get
+
+    @property
+    def positions(self):
+        """Словарь ID -> позиция записи."""
+        return self._positions
+
+    def position_of(self, row_id):
+        """Возвращает позицию записи с указанным ID или None."""
+        return self._positions.get(row_id)
+
+    def row_positions(self):
+        """Возвращает позиции всех записей по порядку (без пустых мест)."""
+        if not self._dead:
+            return range(len(self._ids))
+        return (i for i in range(len(self._ids)) if i not in self._dead)
+
+    def scan(self, column, value):
+        """Возвращает позиции записей, у которых значение столбца равно value."""
+        if column not in self._data:
+            return iter(())
+        positions = self._data[column].scan(value)
+        if not self._dead:
+            return positions
+        return (i for i in positions if i not in self._dead)
+
+    def export_column(self, column):
+        """
+        Возвращает данные столбца для копирования в разделяемую память.
+
+        Пустые места вычищаются, чтобы позиции в буфере совпадали с позициями записей.
+
+        Returns:
+            Кортеж (способ кодирования 'int', 'bits' или 'codes', буфер,
+            список значений для 'codes') или None, если столбца нет
+        """
+        if column not in self._data:
+            return None
+        self.compact()
+        return self._data[column].export()
+
+    def append_row(self, row):
+        """Добавляет запись в конец таблицы."""
+        self.version += 1
+        appended = []
+        try:
+            for name, column in self._data.items():
+                column.append(row[name])
+                appended.append(column)
+        except (KeyError, TypeError, OverflowError):
+            # Откатываем частично добавленную запись
+            for column in appended:
+                column.pop()
+            raise
+        self._positions[row['ID']] = len(self._ids) - 1
+
+    def update_row(self, position, values):
+        """Обновляет поля записи в указанной позиции."""
+        self.version += 1
+        for name, value in values.items():
+            if name not in self._data:
+                raise KeyError(name)
+            self._data[name].set(position, value)
+
+    def remove_positions(self, positions):
+        """
+        Удаляет записи по позициям, оставляя на их месте пустые места (порядок вставки сохраняется).
+
+        Значения столбцов не сдвигаются, поэтому удаление стоит O(1) на запись
+        (с учетом вычищения пустых мест, когда их становится больше, чем записей).
+        """
+        removed = set(positions)
+        if not removed:
+            return
+        self.version += 1
+        for i in removed:
+            del self._positions[self._ids.get(i)]
+        self._dead |= removed
+        if len(self._dead) > len(self):
+            self.compact()
+
+    def compact(self):
+        """Вычищает из столбцов значения удаленных записей (позиции следующих записей меняются)."""
+        if not self._dead:
+            return
+        first = min(self._dead)
+        for column in self._data.values():
+            column.remove(self._dead, first)
+        self._dead = set()
+        for i in range(first, len(self._ids)):
+            self._positions[self._ids.get(i)] = i
+
+    def apply_change(self, record):
+        """Применяет запись журнала изменений (insert/update/delete)."""
+        op = record['op']
+        if op == 'insert':
+            position = self.position_of(record['row']['ID'])
+            if position is None:
+                self.append_row(record['row'])
+            else:
+                # Повторное применение журнала (например, после сбоя при уплотнении)
+                self.update_row(position, record['row'])
+        elif op == 'update':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.update_row(position, record['set'])
+        elif op == 'delete':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.remove_positions([position])
+
+    def nbytes(self):
+        """Оценивает объем памяти, занимаемый данными столбцов (без индекса ID)."""
+        return sum(column.nbytes() for column in self._data.values())
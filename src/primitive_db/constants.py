@@ -11,3 +11,59 @@ DATA_DIR = 'data'
 # Допустимые типы данных
 ALLOWED_TYPES = {'int', 'str', 'bool'}
 
+# Движок хранения данных таблиц: 'log' (снимок + журнал изменений), 'json'
+# или 'chunked' (фрагменты по диапазонам ID)
+STORAGE_BACKEND = 'log'
+
+# Число ID в одном фрагменте таблицы, хранящейся фрагментами (движок 'chunked')
+CHUNK_ROWS = 4096
+
+# Минимальный размер журнала (в байтах), после которого он сворачивается в снимок
+LOG_COMPACT_MIN_BYTES = 64 * 1024
+
+# Ограничения кэша результатов select: число записей, объем памяти (байт)
+# и время жизни записи в секундах (None - без ограничения)
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = None
+
+# Количество изменяющих команд между записями данных сессии на диск
+# (1 - изменения сохраняются после каждой команды)
+SESSION_CHECKPOINT_INTERVAL = 1
+
+# Количество записей, обрабатываемых за один шаг при загрузке из файла
+BULK_CHUNK_SIZE = 10000
+
+# Количество записей на одной странице вывода select
+SELECT_PAGE_SIZE = 100
+
+# Представление таблиц в памяти сессии: 'rows' - список словарей,
+# 'columnar' - типизированные массивы по столбцам (меньше памяти)
+TABLE_LAYOUT = 'rows'
+
+# Число процессов для параллельного просмотра таблицы по условию без индекса
+# (1 - последовательный просмотр, 0 - по числу ядер процессора)
+PARALLEL_WORKERS = 1
+
+# Минимальное число записей таблицы, начиная с которого просмотр распараллеливается
+PARALLEL_MIN_ROWS = 200000
+
+# Уровень надежности записи файлов: 'always' - fsync после каждой записи,
+# 'batched' - дозапись журналов сбрасывается на диск в контрольных точках сессии,
+# 'none' - без fsync (файлы все равно заменяются атомарно)
+DURABILITY = 'batched'
+
+# Максимальное время ожидания блокировки таблицы другим процессом (в секундах)
+LOCK_TIMEOUT = 30
+
+# Адрес сервера по умолчанию (database serve): 'unix:<путь>' или '<хост>:<порт>'
+SERVER_ADDRESS = 'unix:database.sock'
+
+# Максимальное число одновременно открытых соединений пула клиента
+SERVER_POOL_SIZE = 4
+
+# Количество строк в каждой части отчета команды profile
+PROFILE_TOP = 15
+
+# Максимальное число форм команд в кэше разобранных команд
+STATEMENT_CACHE_SIZE = 256
@@ -1,10 +1,68 @@
-import hashlib
-import json
+import time
+from itertools import islice
+
 from .decorators import handle_db_errors, confirm_action, log_time, create_cacher
-from .constants import ALLOWED_TYPES
+from .constants import ALLOWED_TYPES, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL
+from .index import INDEX_KINDS, SORTED_INDEX_TYPES, table_indexes
+from .metrics import increment, register_gauges
+from .planner import collect_stats, plan_query, run_plan
+from .schema import retired_columns
+from .table import TableData
+
+# Создаем кэшер для select операций.
+# Ключ кэша: (имя таблицы, поколение таблицы, нормализованное условие WHERE)
+_cache_result = create_cacher(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL)
+
+
+def cache_stats():
+    """Возвращает статистику кэша select (попадания, промахи, вытеснения, память)."""
+    return _cache_result.stats()
+
+
+def _cache_gauges():
+    """Возвращает показатели кэша select для метрик (см. metrics.register_gauges)."""
+    stats = cache_stats()
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'evictions': stats['evictions'],
+        'entries': stats['entries'],
+        'bytes': stats['bytes'],
+        'hit_ratio': stats['hits'] / lookups if lookups else 0.0,
+    }
+
+
+register_gauges('select_cache', _cache_gauges)
+
+
+def _bump_generation(metadata, table_name):
+    """
+    Увеличивает поколение таблицы после изменения её данных.
+    
+    Поколение хранится в метаданных и монотонно растет, поэтому закэшированные
+    результаты выборок для старых поколений больше не используются.
+    Записи кэша удаляются только для измененной таблицы.
+    """
+    table_info = metadata[table_name]
+    table_info['generation'] = table_info.get('generation', 0) + 1
+    evict_table_cache(table_name)
+
 
-# Создаем кэшер для select операций
-_cache_result = create_cacher()
+def evict_table_cache(table_name):
+    """Удаляет из кэша выборок все записи указанной таблицы."""
+    _cache_result.evict(lambda key: key[0] == table_name)
+
+
+def _normalize_where(where_clause):
+    """Приводит условие WHERE к хешируемому виду для ключа кэша."""
+    if not where_clause:
+        return None
+    if not isinstance(where_clause, dict):
+        # Дерево выражения хешируемо; repr различает, например, 1 и True
+        return repr(where_clause)
+    # Тип значения входит в ключ, чтобы не смешивать, например, 1 и True
+    return tuple(sorted((column, type(value).__name__, value) for column, value in where_clause.items()))
 
 
 def _validate_type(value, expected_type):
@@ -63,10 +121,16 @@ def create_table(metadata, table_name, columns):
     # Автоматическое добавление столбца ID:int в начало
     columns_with_id = [('ID', 'int')] + list(columns)
     
-    # Обновление метаданных
+    # Обновление метаданных (sequence - последний выданный ID). Поколение новой
+    # таблицы начинается с текущего времени в наносекундах, а не с 0: если другой
+    # процесс удалит и заново создаст таблицу, её поколения не совпадут с поколениями
+    # прежней таблицы в кэше выборок этого процесса
     metadata[table_name] = {
-        'columns': columns_with_id
+        'columns': columns_with_id,
+        'sequence': 0,
+        'generation': time.time_ns(),
     }
+    evict_table_cache(table_name)
     
     print(f"Таблица '{table_name}' успешно создана.")
     return metadata
@@ -92,182 +156,859 @@ def drop_table(metadata, table_name):
     
     # Удаление таблицы из метаданных
     del metadata[table_name]
+    evict_table_cache(table_name)
     
     print(f"Таблица '{table_name}' успешно удалена.")
     return metadata
 
 
 @handle_db_errors
-@log_time
-def insert(metadata, table_name, values):
+def create_index(metadata, table_name, column, kind='hash'):
     """
-    Вставляет новую запись в таблицу.
+    Добавляет описание индекса по столбцу в метаданные.
     
     Args:
         metadata: Словарь с метаданными базы данных
         table_name: Имя таблицы
-        values: Список значений для вставки (без ID)
+        column: Имя индексируемого столбца
+        kind: Вид индекса: 'hash' (равенство) или 'sorted' (диапазоны и сортировка)
     
     Returns:
-        Обновленные данные таблицы или None при ошибке
+        Обновленный словарь метаданных
     """
-    # Проверка существования таблицы
+    if kind not in INDEX_KINDS:
+        print(f"Ошибка: Неизвестный вид индекса '{kind}'. Допустимые: {', '.join(INDEX_KINDS)}")
+        return metadata
+    
     if table_name not in metadata:
         print(f"Ошибка: Таблица '{table_name}' не существует.")
-        return None
+        return metadata
     
-    # Получаем схему таблицы
     table_info = metadata[table_name]
-    columns = table_info.get('columns', [])
+    column_types = dict(table_info.get('columns', []))
+    if column not in column_types:
+        print(f"Ошибка: Столбец '{column}' не существует в таблице '{table_name}'.")
+        return metadata
     
-    # Проверка количества значений (минус ID)
-    expected_count = len(columns) - 1  # Все столбцы кроме ID
-    if len(values) != expected_count:
-        column_names = [col[0] for col in columns[1:]]  # Исключаем ID
-        print(f"Ошибка: Количество значений ({len(values)}) не соответствует количеству столбцов ({expected_count}).")
-        print(f"Ожидаемые столбцы (ID генерируется автоматически): {', '.join(column_names)}")
-        return None
+    if column in table_indexes(table_info):
+        print(f"Ошибка: Индекс по столбцу '{column}' уже существует.")
+        return metadata
     
-    # Загружаем текущие данные таблицы
-    from .utils import load_table_data
-    table_data = load_table_data(table_name)
+    if kind == 'sorted' and column_types[column] not in SORTED_INDEX_TYPES:
+        print(f"Ошибка: Упорядоченный индекс поддерживается только для типов: {', '.join(sorted(SORTED_INDEX_TYPES))}")
+        return metadata
     
-    # Генерируем новый ID
-    if table_data:
-        max_id = max(row.get('ID', 0) for row in table_data)
-        new_id = max_id + 1
-    else:
-        new_id = 1
+    table_info.setdefault(INDEX_KINDS[kind], []).append(column)
+    print(f"Индекс по столбцу '{column}' таблицы '{table_name}' успешно создан.")
+    return metadata
+
+
+@handle_db_errors
+def drop_index(metadata, table_name, column):
+    """
+    Удаляет описание индекса по столбцу из метаданных.
     
-    # Создаем новую запись
-    new_row = {'ID': new_id}
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        column: Имя проиндексированного столбца
+    
+    Returns:
+        Обновленный словарь метаданных
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return metadata
+    
+    table_info = metadata[table_name]
+    kind = table_indexes(table_info).get(column)
+    if kind is None:
+        print(f"Ошибка: Индекс по столбцу '{column}' не существует.")
+        return metadata
+    
+    table_info[INDEX_KINDS[kind]].remove(column)
+    print(f"Индекс по столбцу '{column}' таблицы '{table_name}' успешно удален.")
+    return metadata
+
+
+def _schema_change(metadata, table_name, change):
+    """
+    Записывает изменение схемы в метаданные таблицы и увеличивает версию схемы.
+    
+    Записи на диске не переписываются: изменение применяется к ним при чтении
+    (см. schema.upgrade_row), а vacuum переписывает данные в актуальной схеме.
+    """
+    table_info = metadata[table_name]
+    table_info['schema_version'] = table_info.get('schema_version', 0) + 1
+    change['version'] = table_info['schema_version']
+    table_info.setdefault('schema_changes', []).append(change)
+    _bump_generation(metadata, table_name)
+
+
+def _check_new_column(metadata, table_name, column):
+    """
+    Проверяет, что новое имя столбца можно использовать в таблице.
+    
+    Returns:
+        Сообщение об ошибке или None
+    """
+    table_info = metadata[table_name]
+    if column in dict(table_info.get('columns', [])):
+        return f"Ошибка: Столбец '{column}' уже существует в таблице '{table_name}'."
+    if column in retired_columns(table_info.get('schema_changes', [])):
+        return f"Ошибка: Имя столбца '{column}' освободится после выполнения vacuum {table_name}."
+    return None
+
+
+@handle_db_errors
+def add_column(metadata, table_name, column, col_type, default):
+    """
+    Добавляет столбец в схему таблицы без перезаписи существующих записей.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        column: Имя нового столбца
+        col_type: Тип нового столбца
+        default: Значение столбца для существующих записей
     
-    # Валидация и добавление значений
-    for i, (col_name, col_type) in enumerate(columns[1:], 0):  # Пропускаем ID
-        value = values[i]
+    Returns:
+        Обновленный словарь метаданных
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return metadata
+    
+    if col_type not in ALLOWED_TYPES:
+        print(f"Ошибка: Недопустимый тип данных '{col_type}'. Разрешены только: {', '.join(ALLOWED_TYPES)}")
+        return metadata
+    
+    error = _check_new_column(metadata, table_name, column)
+    if error is None:
+        # Значение по умолчанию проверяется так же, как значение новой записи
+        row, error = _build_row([('ID', 'int'), (column, col_type)], [default])
+    if error:
+        print(error)
+        return metadata
+    
+    metadata[table_name]['columns'].append((column, col_type))
+    _schema_change(metadata, table_name, {'op': 'add', 'column': column, 'type': col_type,
+                                          'default': row[column]})
+    print(f"Столбец '{column}' добавлен в таблицу '{table_name}' "
+          f"(версия схемы {metadata[table_name]['schema_version']}).")
+    return metadata
+
+
+@handle_db_errors
+@confirm_action("удаление столбца")
+def drop_column(metadata, table_name, column):
+    """
+    Удаляет столбец из схемы таблицы без перезаписи существующих записей.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        column: Имя удаляемого столбца
+    
+    Returns:
+        Обновленный словарь метаданных
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return metadata
+    
+    table_info = metadata[table_name]
+    if column == 'ID':
+        print("Ошибка: Столбец 'ID' нельзя удалить.")
+        return metadata
+    if column not in dict(table_info.get('columns', [])):
+        print(f"Ошибка: Столбец '{column}' не существует в таблице '{table_name}'.")
+        return metadata
+    
+    table_info['columns'] = [(name, col_type) for name, col_type in table_info['columns'] if name != column]
+    # Индекс и статистика по удаленному столбцу больше не нужны
+    kind = table_indexes(table_info).get(column)
+    if kind is not None:
+        table_info[INDEX_KINDS[kind]].remove(column)
+    for values in table_info.get('stats', {}).values():
+        if isinstance(values, dict):
+            values.pop(column, None)
+    _schema_change(metadata, table_name, {'op': 'drop', 'column': column})
+    print(f"Столбец '{column}' удален из таблицы '{table_name}' (версия схемы {table_info['schema_version']}).")
+    return metadata
+
+
+@handle_db_errors
+def rename_column(metadata, table_name, column, new_name):
+    """
+    Переименовывает столбец таблицы без перезаписи существующих записей.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        column: Текущее имя столбца
+        new_name: Новое имя столбца
+    
+    Returns:
+        Обновленный словарь метаданных
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return metadata
+    
+    table_info = metadata[table_name]
+    if column == 'ID':
+        print("Ошибка: Столбец 'ID' нельзя переименовать.")
+        return metadata
+    if column not in dict(table_info.get('columns', [])):
+        print(f"Ошибка: Столбец '{column}' не существует в таблице '{table_name}'.")
+        return metadata
+    error = _check_new_column(metadata, table_name, new_name)
+    if error:
+        print(error)
+        return metadata
+    
+    table_info['columns'] = [(new_name if name == column else name, col_type)
+                             for name, col_type in table_info['columns']]
+    # Индекс и статистика переходят к новому имени столбца
+    kind = table_indexes(table_info).get(column)
+    if kind is not None:
+        indexed = table_info[INDEX_KINDS[kind]]
+        indexed[indexed.index(column)] = new_name
+    for values in table_info.get('stats', {}).values():
+        if isinstance(values, dict) and column in values:
+            values[new_name] = values.pop(column)
+    _schema_change(metadata, table_name, {'op': 'rename', 'column': column, 'to': new_name})
+    print(f"Столбец '{column}' таблицы '{table_name}' переименован в '{new_name}' "
+          f"(версия схемы {table_info['schema_version']}).")
+    return metadata
+
+
+def _as_table(table_data):
+    """Оборачивает обычный список записей в TableData (таблицы с позициями ID - без изменений)."""
+    if hasattr(table_data, 'positions'):
+        return table_data
+    return TableData(table_data)
+
+
+def _check_set_values(columns, set_values):
+    """
+    Приводит значения SET к типам столбцов таблицы.
+    
+    Returns:
+        (словарь значений, None) или (None, сообщение об ошибке)
+    """
+    column_types = dict(columns)
+    checked = {}
+    for column, value in set_values.items():
+        if column not in column_types:
+            return None, f"Ошибка: Столбец '{column}' не существует."
+        col_type = column_types[column]
+        if not _validate_type(value, col_type):
+            value = _convert_value(value, col_type)
+            if value is None or not _validate_type(value, col_type):
+                return None, f"Ошибка: Значение для столбца '{column}' должно быть типа {col_type}."
+        checked[column] = value
+    return checked, None
+
+
+def _matching_positions(table_data, where_clause, indexes=None, column_types=None, stats=None):
+    """Возвращает список позиций записей, удовлетворяющих условию WHERE."""
+    return list(_iter_matching_positions(table_data, where_clause, indexes, column_types, stats=stats))
+
+
+def _iter_matching_positions(table_data, where_clause, indexes=None, column_types=None, order_by=None,
+                             stats=None, limit=None, offset=0):
+    """
+    Лениво находит позиции записей, удовлетворяющих условию WHERE.
+    
+    Способ доступа к записям (полный просмотр, поиск по ID или индексу,
+    диапазон упорядоченного индекса) выбирает планировщик, а условие
+    компилируется в предикат один раз на запрос.
+    
+    Args:
+        table_data: Список записей таблицы
+        where_clause: Словарь равенств, например {'age': 28}, дерево выражения или None
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        column_types: Словарь {столбец: тип} для приведения значений условия
+        order_by: Кортеж (столбец, по убыванию) или None
+        stats: Статистика таблицы для планировщика
+        limit: Ожидаемое ограничение числа записей (учитывается при планировании)
+        offset: Ожидаемое количество пропускаемых записей
+    
+    Returns:
+        Генератор позиций записей в порядке сортировки (без order_by - в порядке
+        их следования в таблице)
+    """
+    table_data = _as_table(table_data)
+    plan = plan_query(table_data, where_clause, indexes, column_types, order_by, limit, offset, stats)
+    return run_plan(table_data, plan, indexes)
+
+
+def _column_types(metadata, table_name):
+    """Возвращает словарь {столбец: тип} таблицы или None, если схема неизвестна."""
+    if metadata is None or table_name not in metadata:
+        return None
+    return dict(metadata[table_name].get('columns', []))
+
+
+def _table_stats(metadata, table_name):
+    """Возвращает статистику таблицы для планировщика или None, если она не собрана."""
+    if metadata is None or table_name not in metadata:
+        return None
+    return metadata[table_name].get('stats')
+
+
+def _build_row(columns, values):
+    """
+    Проверяет и преобразует значения новой записи по схеме таблицы.
+    
+    Args:
+        columns: Схема таблицы [('ID', 'int'), ('name', 'str'), ...]
+        values: Значения для всех столбцов, кроме ID, в порядке схемы
+    
+    Returns:
+        Кортеж (словарь {столбец: значение} без ID, None) или (None, сообщение об ошибке)
+    """
+    row = {}
+    for (col_name, col_type), value in zip(columns[1:], values):  # Пропускаем ID
         
         # Проверка на пустое значение (все поля обязательные)
         if value is None or (isinstance(value, str) and value.strip() == ''):
-            print(f"Ошибка: Поле '{col_name}' является обязательным и не может быть пустым.")
-            return None
+            return None, f"Ошибка: Поле '{col_name}' является обязательным и не может быть пустым."
         
         # Преобразуем значение в нужный тип
         converted_value = _convert_value(value, col_type)
         if converted_value is None:
-            print(f"Ошибка: Невозможно преобразовать значение '{value}' в тип {col_type} для столбца '{col_name}'.")
-            return None
+            return None, f"Ошибка: Невозможно преобразовать значение '{value}' в тип {col_type} для столбца '{col_name}'."
         
         # Дополнительная проверка на пустые строки после преобразования
         if col_type == 'str' and isinstance(converted_value, str) and converted_value.strip() == '':
-            print(f"Ошибка: Поле '{col_name}' является обязательным и не может быть пустым.")
-            return None
+            return None, f"Ошибка: Поле '{col_name}' является обязательным и не может быть пустым."
         
         # Валидация типа
         if not _validate_type(converted_value, col_type):
-            print(f"Ошибка: Значение '{converted_value}' не соответствует типу {col_type} для столбца '{col_name}'.")
-            return None
+            return None, f"Ошибка: Значение '{converted_value}' не соответствует типу {col_type} для столбца '{col_name}'."
         
-        new_row[col_name] = converted_value
+        row[col_name] = converted_value
+    return row, None
+
+
+@handle_db_errors
+@log_time
+def insert(metadata, table_name, values, changes=None, table_data=None):
+    """
+    Вставляет новую запись в таблицу.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        values: Список значений для вставки (без ID)
+        changes: Список, в который добавляются записи об изменениях для журнала
+        table_data: Уже загруженные данные таблицы (если не указаны, загружаются из файла)
+    
+    Returns:
+        Обновленные данные таблицы или None при ошибке.
+        Последовательность ID таблицы в metadata сдвигается при успешной вставке.
+    """
+    # Проверка существования таблицы
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return None
+    
+    # Получаем схему таблицы
+    table_info = metadata[table_name]
+    columns = table_info.get('columns', [])
+    
+    # Проверка количества значений (минус ID)
+    expected_count = len(columns) - 1  # Все столбцы кроме ID
+    if len(values) != expected_count:
+        column_names = [col[0] for col in columns[1:]]  # Исключаем ID
+        print(f"Ошибка: Количество значений ({len(values)}) не соответствует количеству столбцов ({expected_count}).")
+        print(f"Ожидаемые столбцы (ID генерируется автоматически): {', '.join(column_names)}")
+        return None
+    
+    # Загружаем текущие данные таблицы, если они не переданы
+    if table_data is None:
+        from .utils import load_table_data
+        table_data = load_table_data(table_name)
+    else:
+        table_data = _as_table(table_data)
+    
+    # Генерируем новый ID по последовательности таблицы
+    sequence = table_info.get('sequence')
+    if sequence is None:
+        # Таблица создана до появления последовательностей - вычисляем один раз
+        sequence = max((row.get('ID', 0) for row in table_data), default=0)
+    new_id = sequence + 1
+    
+    # Создаем новую запись
+    row_values, error = _build_row(columns, values)
+    if error:
+        print(error)
+        return None
+    new_row = {'ID': new_id, **row_values}
     
     # Добавляем запись
-    table_data.append(new_row)
+    table_data.append_row(new_row)
+    table_info['sequence'] = new_id
+    if changes is not None:
+        changes.append({'op': 'insert', 'row': new_row})
     
-    # Очищаем кэш после изменения данных
-    _cache_result.clear()
+    # Новое поколение таблицы: кэш выборок этой таблицы устаревает
+    _bump_generation(metadata, table_name)
     
     print(f"Запись успешно добавлена в таблицу '{table_name}' (ID: {new_id}).")
     return table_data
 
 
+@handle_db_errors
+def insert_many(metadata, table_name, rows, changes=None, table_data=None):
+    """
+    Вставляет пакет записей в таблицу.
+    
+    Значения проверяются по схеме так же, как в insert, а ID выдаются одним
+    диапазоном из последовательности таблицы. Некорректные записи пропускаются.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        rows: Список пар (номер строки, список значений без ID)
+        changes: Список, в который добавляются записи об изменениях для журнала
+        table_data: Уже загруженные данные таблицы
+    
+    Returns:
+        Кортеж (количество вставленных записей, список ошибок вида (номер строки, сообщение))
+        или None при ошибке
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return None
+    
+    table_info = metadata[table_name]
+    columns = table_info.get('columns', [])
+    if table_data is None:
+        from .utils import load_table_data
+        table_data = load_table_data(table_name)
+    
+    sequence = table_info.get('sequence')
+    if sequence is None:
+        sequence = max((row.get('ID', 0) for row in table_data), default=0)
+    
+    errors = []
+    inserted = 0
+    for line_number, values in rows:
+        row_values, error = _build_row(columns, values)
+        if error:
+            errors.append((line_number, error))
+            continue
+        sequence += 1
+        new_row = {'ID': sequence, **row_values}
+        table_data.append_row(new_row)
+        if changes is not None:
+            changes.append({'op': 'insert', 'row': new_row})
+        inserted += 1
+    
+    table_info['sequence'] = sequence
+    if inserted:
+        _bump_generation(metadata, table_name)
+    return inserted, errors
+
+
+def iter_select(table_data, where_clause=None, indexes=None, limit=None, offset=0, column_types=None,
+                order_by=None, stats=None):
+    """
+    Лениво перебирает записи таблицы с опциональным условием WHERE и сортировкой.
+    
+    Записи копируются по одной по мере перебора, поэтому время до первой
+    записи и объем памяти не зависят от размера результата.
+    
+    Args:
+        table_data: Список записей таблицы
+        where_clause: Словарь условий, например {'age': 28}, или дерево выражения
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        limit: Максимальное количество записей (None - без ограничения)
+        offset: Количество пропускаемых записей
+        column_types: Словарь {столбец: тип} для приведения значений условия
+        order_by: Кортеж (столбец, по убыванию) или None
+        stats: Статистика таблицы для планировщика (см. analyze_table)
+    
+    Returns:
+        Генератор копий записей
+    """
+    if where_clause or order_by:
+        positions = _iter_matching_positions(table_data, where_clause, indexes, column_types, order_by,
+                                             stats, limit, offset)
+        rows = (table_data[i] for i in positions)
+    else:
+        rows = iter(table_data)
+    
+    stop = None if limit is None else offset + limit
+    returned = 0
+    try:
+        for row in islice(rows, offset, stop):
+            returned += 1
+            yield row.copy()  # Копируем строку, чтобы не изменять исходные данные
+    finally:
+        increment('rows_returned', returned)
+
+
 @log_time
-def select(table_data, where_clause=None):
+def select(table_data, where_clause=None, indexes=None, metadata=None, table_name=None, limit=None, offset=0,
+           order_by=None):
     """
     Выбирает записи из таблицы с опциональным условием WHERE.
-    Использует кэширование для одинаковых запросов.
+    Использует кэширование для одинаковых запросов с условием WHERE,
+    если указаны metadata и table_name.
     
     Args:
         table_data: Список записей таблицы
-        where_clause: Словарь условий, например {'age': 28}
+        where_clause: Словарь условий, например {'age': 28}, или дерево выражения
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        metadata: Словарь с метаданными базы данных (для поколения таблицы)
+        table_name: Имя таблицы
+        limit: Максимальное количество записей (None - без ограничения)
+        offset: Количество пропускаемых записей
+        order_by: Кортеж (столбец, по убыванию) или None
     
     Returns:
         Список отфильтрованных записей
     """
-    # Создаем ключ для кэша на основе данных и условий
-    # Используем хеш содержимого данных и условий для стабильного ключа
-    try:
-        data_str = json.dumps(table_data, sort_keys=True, default=str)
-        data_hash = hashlib.md5(data_str.encode()).hexdigest()
-    except (TypeError, ValueError):
-        # Если не удается сериализовать, используем длину и первый элемент
-        data_hash = f"{len(table_data)}_{hash(str(table_data[0]) if table_data else '')}"
+    computed = False
+    
+    def _select_impl():
+        """Внутренняя функция для выполнения выборки."""
+        nonlocal computed
+        computed = True
+        column_types = _column_types(metadata, table_name)
+        stats = _table_stats(metadata, table_name)
+        return list(iter_select(table_data, where_clause, indexes, limit, offset, column_types, order_by, stats))
+    
+    # Без условия кэшировать нечего: копия таблицы стоит столько же, сколько выборка
+    if not where_clause or metadata is None or table_name not in metadata:
+        return _select_impl()
+    
+    # Ключ кэша строится за O(1) от размера таблицы: данные таблицы
+    # однозначно определяются её именем и поколением
+    generation = metadata[table_name].get('generation', 0)
+    cache_key = (table_name, generation, _normalize_where(where_clause), limit, offset, order_by)
+    result = _cache_result(cache_key, _select_impl)
+    if not computed:
+        # Записи, выданные из кэша (выполненная выборка учтена в iter_select)
+        increment('rows_returned', len(result))
+    return result
+
+
+def explain(table_data, where_clause=None, indexes=None, metadata=None, table_name=None, limit=None, offset=0,
+            order_by=None):
+    """
+    Строит план выборки, выполняет её и возвращает план с фактическими показателями.
+    
+    Кэш выборок не используется, чтобы замеры отражали реальное выполнение.
+    
+    Args:
+        table_data: Список записей таблицы
+        where_clause: Словарь условий, например {'age': 28}, или дерево выражения
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        metadata: Словарь с метаданными базы данных (схема и статистика таблицы)
+        table_name: Имя таблицы
+        limit: Максимальное количество записей (None - без ограничения)
+        offset: Количество пропускаемых записей
+        order_by: Кортеж (столбец, по убыванию) или None
+    
+    Returns:
+        Словарь плана (см. planner.plan_query) с ключом 'actual':
+        {'checked': проверено записей, 'rows': записей в результате,
+        'planning': время планирования, 'execution': время выполнения (секунды)}
+    """
+    table_data = _as_table(table_data)
+    start_time = time.perf_counter()
+    plan = plan_query(table_data, where_clause, indexes, _column_types(metadata, table_name), order_by,
+                      limit, offset, _table_stats(metadata, table_name))
+    planned_time = time.perf_counter()
+    
+    counters = {}
+    rows = 0
+    if limit != 0:
+        # При limit 0 выборка, как и в select, не выполняется
+        positions = run_plan(table_data, plan, indexes, counters)
+        stop = None if limit is None else offset + limit
+        rows = sum(1 for _ in islice(positions, offset, stop))
+    end_time = time.perf_counter()
+    
+    plan['actual'] = {
+        # Счетчик не заполняется, если генератор плана не запускался
+        'checked': counters.get('checked', 0),
+        'rows': rows,
+        'planning': planned_time - start_time,
+        'execution': end_time - planned_time,
+    }
+    return plan
+
+
+@handle_db_errors
+def analyze_table(metadata, table_name, table_data):
+    """
+    Собирает статистику таблицы для планировщика и сохраняет её в метаданных.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        table_data: Данные таблицы
+    
+    Returns:
+        Обновленный словарь метаданных
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return metadata
+    
+    table_info = metadata[table_name]
+    table_info['stats'] = collect_stats(_as_table(table_data), table_info.get('columns', []))
+    # Статистика влияет на планы, но не на результаты: кэш выборок остается актуальным
+    distinct = ', '.join(f"{column}: {count}" for column, count in table_info['stats']['distinct'].items())
+    print(f"Статистика таблицы '{table_name}' обновлена: {table_info['stats']['rows']} записей "
+          f"(различных значений - {distinct}).")
+    return metadata
+
+
+# Агрегатные функции SELECT
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'min', 'max', 'avg')
+
+
+def aggregate_label(function, column):
+    """Возвращает заголовок столбца результата: 'count(*)', 'avg(age)' или имя столбца группировки."""
+    return column if function is None else f"{function}({column})"
+
+
+def _check_aggregate(columns, items, group_by):
+    """
+    Проверяет список выражений агрегатного запроса по схеме таблицы.
+    
+    Returns:
+        Сообщение об ошибке или None
+    """
+    column_types = dict(columns)
+    for column in group_by:
+        if column not in column_types:
+            return f"Ошибка: Столбец '{column}' не существует."
+    for function, column in items:
+        if function is None:
+            if column not in group_by:
+                return f"Ошибка: Столбец '{column}' должен быть указан в GROUP BY или в агрегатной функции."
+            continue
+        if function not in AGGREGATE_FUNCTIONS:
+            return f"Ошибка: Неизвестная агрегатная функция '{function}'. Доступны: {', '.join(AGGREGATE_FUNCTIONS)}."
+        if column == '*':
+            if function != 'count':
+                return f"Ошибка: Функция {function} не поддерживает аргумент '*'."
+            continue
+        if column not in column_types:
+            return f"Ошибка: Столбец '{column}' не существует."
+        if function in ('sum', 'avg') and column_types[column] != 'int':
+            return f"Ошибка: Функция {function} применима только к столбцам типа int."
+    return None
+
+
+def _aggregate_step(table_data, function, column):
+    """
+    Возвращает (начальное состояние, функция шага (состояние, позиция) -> состояние,
+    функция получения итогового значения) для одной агрегатной функции.
+    """
+    if function == 'count' and column == '*':
+        return 0, lambda state, position: state + 1, None
+    
+    get = table_data.getter(column, None)
+    if function == 'count':
+        return 0, lambda state, position: state + (get(position) is not None), None
+    if function == 'avg':
+        def step(state, position):
+            value = get(position)
+            return state if value is None else (state[0] + value, state[1] + 1)
+        return (0, 0), step, lambda state: state[0] / state[1] if state[1] else None
+    
+    # sum, min, max: состояние None, пока не встретилось ни одного значения
+    combine = {'sum': lambda a, b: a + b, 'min': min, 'max': max}[function]
+    
+    def step(state, position):
+        value = get(position)
+        if value is None:
+            return state
+        return value if state is None else combine(state, value)
+    return None, step, None
+
+
+def _aggregate_from_indexes(table_data, items, group_by, indexes):
+    """
+    Пытается ответить на агрегатный запрос без WHERE по метаданным таблицы и индексам.
+    
+    - COUNT(*) без группировки - по числу записей таблицы;
+    - MIN/MAX по столбцу с упорядоченным индексом - по первому/последнему ключу;
+    - COUNT(*) с группировкой по столбцу с хеш-индексом - по размерам множеств ID.
+    
+    Returns:
+        Список строк в формате _aggregate_scan или None, если нужен просмотр таблицы
+    """
+    indexes = indexes or {}
+    if not group_by:
+        row = []
+        for function, column in items:
+            index = indexes.get(column)
+            if function == 'count' and column == '*':
+                row.append(len(table_data))
+            elif function in ('min', 'max') and getattr(index, 'kind', None) == 'sorted':
+                row.append(index.first() if function == 'min' else index.last())
+            else:
+                return None
+        return [tuple(row)]
+    
+    index = indexes.get(group_by[0])
+    if len(group_by) != 1 or getattr(index, 'kind', None) != 'hash':
+        return None
+    if not all(item in ((None, group_by[0]), ('count', '*')) for item in items):
+        return None
+    counts = sum(function is not None for function, _ in items)
+    return [(value,) + (len(ids),) * counts for value, ids in index.entries.items()]
+
+
+@handle_db_errors
+@log_time
+def aggregate(table_data, items, where_clause=None, group_by=None, indexes=None, metadata=None, table_name=None):
+    """
+    Вычисляет агрегатные функции (COUNT, SUM, MIN, MAX, AVG) с опциональной группировкой.
+    
+    Записи перебираются один раз потоком, а в памяти хранится только состояние
+    агрегатов для каждой группы, поэтому расход памяти - O(число групп).
+    Запросы без WHERE по возможности отвечаются по числу записей и индексам
+    без просмотра таблицы.
+    
+    Args:
+        table_data: Данные таблицы
+        items: Список пар (функция, столбец), например [('count', '*'), ('avg', 'age')];
+            для столбцов группировки функция - None
+        where_clause: Словарь условий или дерево выражения
+        group_by: Список столбцов группировки
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+    
+    Returns:
+        Кортеж (заголовки столбцов, список строк-кортежей) или None при ошибке.
+        Группы упорядочены по значениям столбцов группировки.
+    """
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return None
+    
+    group_by = list(group_by or [])
+    error = _check_aggregate(metadata[table_name].get('columns', []), items, group_by)
+    if error:
+        print(error)
+        return None
+    
+    table_data = _as_table(table_data)
+    labels = [aggregate_label(function, column) for function, column in items]
+    
+    rows = None if where_clause else _aggregate_from_indexes(table_data, items, group_by, indexes)
+    if rows is None:
+        rows = _aggregate_scan(table_data, items, where_clause, group_by, indexes, metadata, table_name)
+    
+    # Строки результата: значения группировки, затем агрегаты - расставляем в порядке items
+    order = []
+    aggregate_position = len(group_by)
+    for function, column in items:
+        if function is None:
+            order.append(group_by.index(column))
+        else:
+            order.append(aggregate_position)
+            aggregate_position += 1
+    if group_by:
+        # Пропущенные значения (None) - в конце
+        rows.sort(key=lambda row: [(value is None, value) for value in row[:len(group_by)]])
+    rows = [tuple(row[i] for i in order) for row in rows]
+    return labels, rows
+
+
+def _aggregate_scan(table_data, items, where_clause, group_by, indexes, metadata, table_name):
+    """
+    Вычисляет агрегаты одним проходом по подходящим записям.
+    
+    Returns:
+        Список строк: значения столбцов группировки, затем значения агрегатов
+        (в порядке items, без столбцов группировки)
+    """
+    steps = [_aggregate_step(table_data, function, column) for function, column in items if function is not None]
+    initial = [state for state, _, _ in steps]
+    updates = list(enumerate(step for _, step, _ in steps))
     
     if where_clause:
-        try:
-            where_str = json.dumps(where_clause, sort_keys=True, default=str)
-            where_hash = hashlib.md5(where_str.encode()).hexdigest()
-        except (TypeError, ValueError):
-            where_hash = str(hash(tuple(sorted(where_clause.items()))))
+        positions = _iter_matching_positions(table_data, where_clause, indexes, _column_types(metadata, table_name),
+                                             stats=_table_stats(metadata, table_name))
     else:
-        where_hash = 'none'
+        positions = table_data.row_positions()
     
-    cache_key = (data_hash, where_hash)
+    group_getters = [table_data.getter(column, None) for column in group_by]
+    groups = {} if group_by else {(): list(initial)}
+    for position in positions:
+        key = tuple(get(position) for get in group_getters)
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = list(initial)
+        for n, step in updates:
+            states[n] = step(states[n], position)
     
-    def _select_impl():
-        """Внутренняя функция для выполнения выборки."""
-        if where_clause is None:
-            return table_data.copy()  # Возвращаем копию, чтобы не изменять исходные данные
-        
-        # Фильтрация по условиям
-        result = []
-        for row in table_data:
-            match = True
-            for column, value in where_clause.items():
-                if column not in row or row[column] != value:
-                    match = False
-                    break
-            if match:
-                result.append(row.copy())  # Копируем строку для безопасности
-        
-        return result
-    
-    # Используем кэширование
-    return _cache_result(cache_key, _select_impl)
+    finishers = [finish for _, _, finish in steps]
+    return [key + tuple(state if finish is None else finish(state) for state, finish in zip(states, finishers))
+            for key, states in groups.items()]
 
 
 @handle_db_errors
-def update(table_data, set_clause, where_clause):
+def update(table_data, set_clause, where_clause, changes=None, indexes=None, metadata=None, table_name=None):
     """
     Обновляет записи в таблице.
     
     Args:
         table_data: Список записей таблицы
         set_clause: Словарь полей для обновления, например {'age': 30}
-        where_clause: Словарь условий, например {'name': 'John'}
+        where_clause: Словарь условий, например {'name': 'John'}, или дерево выражения
+        changes: Список, в который добавляются записи об изменениях для журнала
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        metadata: Словарь с метаданными базы данных (для поколения таблицы)
+        table_name: Имя таблицы
     
     Returns:
         Обновленные данные таблицы
     """
     updated_count = 0
+    # ID нельзя изменять
+    set_values = {column: value for column, value in set_clause.items() if column != 'ID'}
+    if metadata is not None and table_name in metadata:
+        set_values, error = _check_set_values(metadata[table_name].get('columns', []), set_values)
+        if error:
+            print(error)
+            return table_data
+    table_data = _as_table(table_data)
     
-    for row in table_data:
-        # Проверяем условие WHERE
-        match = True
-        if where_clause:
-            for column, value in where_clause.items():
-                if column not in row or row[column] != value:
-                    match = False
-                    break
-        
-        if match:
-            # Обновляем поля согласно SET
-            for column, value in set_clause.items():
-                if column != 'ID':  # ID нельзя изменять
-                    row[column] = value
-            updated_count += 1  # Считаем записи, а не поля
+    # Проверяем условие WHERE
+    if where_clause:
+        positions = _matching_positions(table_data, where_clause, indexes, _column_types(metadata, table_name),
+                                        _table_stats(metadata, table_name))
+    else:
+        positions = table_data.row_positions()
+    
+    for i in positions:
+        # Обновляем поля согласно SET
+        table_data.update_row(i, set_values)
+        if changes is not None:
+            changes.append({'op': 'update', 'id': table_data.value(i, 'ID'), 'set': set_values})
+        updated_count += 1  # Считаем записи, а не поля
     
     if updated_count > 0:
         # Очищаем кэш после изменения данных
-        _cache_result.clear()
+        if metadata is not None and table_name in metadata:
+            _bump_generation(metadata, table_name)
+        else:
+            _cache_result.clear()
         print(f"Обновлено записей: {updated_count}.")
     else:
         print("Записи для обновления не найдены.")
@@ -277,13 +1018,17 @@ def update(table_data, set_clause, where_clause):
 
 @handle_db_errors
 @confirm_action("удаление записей")
-def delete(table_data, where_clause):
+def delete(table_data, where_clause, changes=None, indexes=None, metadata=None, table_name=None):
     """
     Удаляет записи из таблицы по условию WHERE.
     
     Args:
         table_data: Список записей таблицы
-        where_clause: Словарь условий, например {'age': 28}
+        where_clause: Словарь условий, например {'age': 28}, или дерево выражения
+        changes: Список, в который добавляются записи об изменениях для журнала
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        metadata: Словарь с метаданными базы данных (для поколения таблицы)
+        table_name: Имя таблицы
     
     Returns:
         Обновленные данные таблицы
@@ -292,25 +1037,26 @@ def delete(table_data, where_clause):
         print("Ошибка: Условие WHERE обязательно для команды DELETE.")
         return table_data
     
+    table_data = _as_table(table_data)
+    
     # Находим индексы записей для удаления
-    indices_to_remove = []
-    for i, row in enumerate(table_data):
-        match = True
-        for column, value in where_clause.items():
-            if column not in row or row[column] != value:
-                match = False
-                break
-        if match:
-            indices_to_remove.append(i)
-    
-    # Удаляем записи в обратном порядке
-    for i in reversed(indices_to_remove):
-        del table_data[i]
+    indices_to_remove = _matching_positions(table_data, where_clause, indexes, _column_types(metadata, table_name),
+                                            _table_stats(metadata, table_name))
+    
+    if changes is not None:
+        for i in indices_to_remove:
+            changes.append({'op': 'delete', 'id': table_data.value(i, 'ID')})
+    
+    # Удаленные записи оставляют пустые места: следующие записи не сдвигаются и порядок сохраняется
+    table_data.remove_positions(indices_to_remove)
     
     deleted_count = len(indices_to_remove)
     if deleted_count > 0:
         # Очищаем кэш после изменения данных
-        _cache_result.clear()
+        if metadata is not None and table_name in metadata:
+            _bump_generation(metadata, table_name)
+        else:
+            _cache_result.clear()
         print(f"Удалено записей: {deleted_count}.")
     else:
         print("Записи для удаления не найдены.")
@@ -1,10 +1,63 @@
 """
 Декораторы для обработки ошибок, логирования и кэширования.
 """
+import sys
+import threading
 import time
 import functools
+from collections import OrderedDict
 from prompt import string
 
+from .metrics import observe
+
+# Политика подтверждения опасных операций: 'ask' - спрашивать пользователя,
+# 'yes' - подтверждать автоматически, 'no' - автоматически отменять
+CONFIRM_POLICIES = ('ask', 'yes', 'no')
+_confirm_policy = 'ask'
+
+# Дополнительный получатель замеров времени log_time (например, отчет скрипта):
+# None или функция sink(имя_функции, секунды)
+_timing_sink = None
+
+
+def set_confirm_policy(policy):
+    """
+    Устанавливает политику подтверждения опасных операций.
+    
+    Args:
+        policy: 'ask', 'yes' или 'no'
+    """
+    global _confirm_policy
+    if policy not in CONFIRM_POLICIES:
+        raise ValueError(f"Неизвестная политика подтверждения '{policy}'")
+    _confirm_policy = policy
+
+
+def set_timing_sink(sink):
+    """
+    Задает дополнительного получателя замеров времени log_time.
+    
+    Замеры всегда попадают в гистограммы metrics, получатель нужен
+    для собственных отчетов (например, отчета run_script).
+    
+    Args:
+        sink: Функция sink(имя_функции, секунды) или None
+    """
+    global _timing_sink
+    _timing_sink = sink
+
+
+def report_time(name, elapsed):
+    """
+    Передает замер времени получателю, заданному set_timing_sink.
+    
+    Args:
+        name: Имя замера (например, имя функции)
+        elapsed: Время в секундах
+    """
+    if _timing_sink is not None:
+        _timing_sink(name, elapsed)
+
 
 def handle_db_errors(func):
     """
@@ -43,7 +96,10 @@ def confirm_action(action_name):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            response = string(prompt=f'Вы уверены, что хотите выполнить "{action_name}"? [y/n]: ')
+            if _confirm_policy == 'ask':
+                response = string(prompt=f'Вы уверены, что хотите выполнить "{action_name}"? [y/n]: ')
+            else:
+                response = 'y' if _confirm_policy == 'yes' else 'n'
             if response.lower() != 'y':
                 print("Операция отменена.")
                 # Возвращаем исходные данные без изменений
@@ -58,26 +114,73 @@ def confirm_action(action_name):
 def log_time(func):
     """
     Декоратор для замера времени выполнения функции.
+    
+    Время записывается в гистограмму metrics 'function_seconds'
+    (см. команду stats) и передается получателю set_timing_sink.
     """
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.monotonic()
+        start_time = time.perf_counter()
         result = func(*args, **kwargs)
-        end_time = time.monotonic()
-        elapsed = end_time - start_time
-        print(f"Функция {func.__name__} выполнилась за {elapsed:.3f} секунд.")
+        elapsed = time.perf_counter() - start_time
+        observe('function_seconds', elapsed, function=func.__name__)
+        report_time(func.__name__, elapsed)
         return result
     return wrapper
 
 
-def create_cacher():
+def _estimate_size(value):
+    """
+    Оценивает объем памяти (в байтах), занимаемый значением.
+    
+    Учитываются вложенные списки, кортежи и словари; общие объекты
+    (например, одинаковые строки) могут быть посчитаны несколько раз.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + _estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _estimate_size(item)
+    return size
+
+
+def create_cacher(max_entries=None, max_bytes=None, ttl=None):
     """
     Фабрика для создания функции кэширования с замыканием.
     
+    Кэш вытесняет давно не использованные записи (LRU), когда превышено
+    количество записей или оценка занимаемой памяти. Кэшем можно пользоваться
+    из нескольких потоков: записи изменяются под блокировкой, а value_func
+    выполняется без неё.
+    
+    Args:
+        max_entries: Максимальное количество записей (None - без ограничения)
+        max_bytes: Максимальный оценочный объем памяти в байтах (None - без ограничения)
+        ttl: Время жизни записи в секундах (None - записи не устаревают)
+    
     Returns:
         Функция cache_result(key, value_func) для кэширования результатов
     """
-    cache = {}  # Кэш хранится в замыкании
+    # Кэш хранится в замыкании: ключ -> (значение, размер, время устаревания)
+    cache = OrderedDict()
+    stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'bytes': 0}
+    lock = threading.Lock()
+    
+    def _remove(key):
+        """Удаляет запись из кэша и уменьшает счетчик памяти."""
+        _, size, _ = cache.pop(key)
+        stats['bytes'] -= size
+    
+    def _shrink():
+        """Вытесняет самые старые записи, пока кэш не уложится в ограничения."""
+        while cache and (
+            (max_entries is not None and len(cache) > max_entries)
+            or (max_bytes is not None and stats['bytes'] > max_bytes)
+        ):
+            _remove(next(iter(cache)))
+            stats['evictions'] += 1
     
     def cache_result(key, value_func):
         """
@@ -90,18 +193,72 @@ def create_cacher():
         Returns:
             Результат из кэша или результат выполнения value_func()
         """
-        if key in cache:
-            return cache[key]
+        with lock:
+            entry = cache.get(key)
+            if entry is not None:
+                value, _, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    stats['hits'] += 1
+                    cache.move_to_end(key)
+                    return value
+                _remove(key)
+                stats['expired'] += 1
+            stats['misses'] += 1
         
         result = value_func()
-        cache[key] = result
+        
+        size = _estimate_size(result)
+        if max_bytes is not None and size > max_bytes:
+            # Результат не помещается в кэш целиком - не кэшируем его
+            return result
+        
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with lock:
+            if key in cache:
+                # Значение успел добавить другой поток
+                _remove(key)
+            cache[key] = (result, size, expires_at)
+            stats['bytes'] += size
+            _shrink()
         return result
     
     def clear_cache():
         """Очищает кэш."""
-        cache.clear()
+        with lock:
+            cache.clear()
+            stats['bytes'] = 0
+    
+    def evict(match):
+        """
+        Удаляет из кэша записи, ключи которых удовлетворяют условию.
+        
+        Args:
+            match: Функция key -> bool
+        """
+        with lock:
+            for key in [key for key in cache if match(key)]:
+                _remove(key)
+    
+    def get_stats():
+        """
+        Возвращает статистику кэша.
+        
+        Returns:
+            Словарь с количеством попаданий, промахов, вытеснений, устаревших
+            записей, текущим числом записей, объемом памяти и ограничениями
+        """
+        with lock:
+            return {
+                **stats,
+                'entries': len(cache),
+                'max_entries': max_entries,
+                'max_bytes': max_bytes,
+                'ttl': ttl,
+            }
     
-    # Добавляем метод очистки кэша
+    # Добавляем методы очистки кэша и статистики
     cache_result.clear = clear_cache
+    cache_result.evict = evict
+    cache_result.stats = get_stats
     
     return cache_result
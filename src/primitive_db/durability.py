@@ -0,0 +1,269 @@
+"""
+Надежная запись файлов базы данных.
+
+Файлы метаданных, снимков таблиц и индексов записываются во временный файл,
+который затем атомарно переименовывается поверх старого, поэтому прерванная
+запись не оставляет обрезанных файлов. Уровень надежности задает, когда
+данные сбрасываются на диск (fsync):
+- 'always' - после каждой записи (файл и каталог);
+- 'batched' - временный файл перед переименованием, а дозапись в журналы
+  и каталоги - один раз в контрольной точке сессии (sync_pending);
+- 'none' - без fsync (защита только от прерывания процесса, но не ОС).
+
+recover проверяет файлы при запуске и восстанавливает поврежденные.
+"""
+import json
+import os
+
+from .constants import DATA_DIR, DURABILITY
+from .metrics import increment
+
+# Допустимые уровни надежности
+DURABILITY_LEVELS = ('always', 'batched', 'none')
+
+_level = DURABILITY
+_pending = set()  # пути файлов и каталогов, ожидающих fsync в контрольной точке
+
+
+def set_durability(level):
+    """
+    Задает уровень надежности записи.
+
+    Raises:
+        ValueError: Если уровень неизвестен
+    """
+    global _level
+    if level not in DURABILITY_LEVELS:
+        raise ValueError(f"Неизвестный уровень надежности '{level}'. Доступны: {', '.join(DURABILITY_LEVELS)}")
+    _level = level
+
+
+def durability():
+    """Возвращает текущий уровень надежности записи."""
+    return _level
+
+
+def _fsync_path(path):
+    """Сбрасывает на диск файл или каталог по пути (если он существует)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _directory(path):
+    """Возвращает каталог файла."""
+    return os.path.dirname(path) or '.'
+
+
+def removed(path):
+    """Отмечает удаление файла: каталог сбрасывается на диск сразу или в контрольной точке."""
+    _synced(path)
+
+
+def created(path):
+    """Отмечает создание файла: каталог сбрасывается на диск сразу или в контрольной точке."""
+    _synced(path)
+
+
+def _synced(path):
+    """Отмечает изменение каталога файла: fsync сразу или в контрольной точке."""
+    if _level == 'always':
+        _fsync_path(_directory(path))
+    elif _level == 'batched':
+        _pending.add(_directory(path))
+
+
+def sync_file(f):
+    """
+    Сбрасывает на диск открытый файл после дозаписи.
+
+    При уровне 'batched' файл запоминается и сбрасывается в контрольной точке.
+    """
+    f.flush()
+    if _level == 'always':
+        os.fsync(f.fileno())
+    elif _level == 'batched':
+        _pending.add(f.name)
+
+
+def sync_pending():
+    """Сбрасывает на диск файлы и каталоги, отложенные до контрольной точки."""
+    # Сначала файлы, затем каталоги (чтобы новые имена ссылались на сохраненные данные)
+    for path in sorted(_pending, key=os.path.isdir):
+        _fsync_path(path)
+    _pending.clear()
+
+
+def atomic_write(path, write, binary=False, backup=False):
+    """
+    Атомарно заменяет файл: запись во временный файл, fsync и переименование.
+
+    Args:
+        path: Путь к файлу
+        write: Функция write(f), записывающая содержимое в открытый файл
+        binary: Открыть временный файл в двоичном режиме
+        backup: Сохранить предыдущую версию файла в <path>.bak (жесткой ссылкой,
+            без копирования данных)
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
+            write(f)
+            increment('bytes_written', f.tell())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if backup and os.path.exists(path):
+        backup_path = path + '.bak'
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        os.link(path, backup_path)
+    replace_file(tmp_path, path)
+
+
+def replace_file(tmp_path, path):
+    """Переименовывает записанный временный файл поверх path, предварительно сбросив его на диск."""
+    if _level != 'none':
+        # Данные должны оказаться на диске раньше, чем новое имя файла
+        _fsync_path(tmp_path)
+    os.replace(tmp_path, path)
+    _synced(path)
+
+
+def _is_json(path):
+    """Проверяет, что файл содержит корректный JSON."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            json.load(f)
+    except (ValueError, OSError):
+        return False
+    return True
+
+
+def _looks_complete(path):
+    """Быстро проверяет, что снимок таблицы (JSON-массив) не обрезан: начинается с '[' и кончается ']'."""
+    with open(path, 'rb') as f:
+        head = f.read(1)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - 64, 0))
+        tail = f.read().rstrip()
+    return head == b'[' and tail.endswith(b']')
+
+
+def _set_aside(path):
+    """Переименовывает поврежденный файл в <path>.corrupt и возвращает новое имя."""
+    corrupt_path = path + '.corrupt'
+    os.replace(path, corrupt_path)
+    return corrupt_path
+
+
+def _recover_metadata(metadata_file, messages):
+    """Восстанавливает файл метаданных из резервной копии, если он поврежден."""
+    backup_path = metadata_file + '.bak'
+    if os.path.exists(metadata_file) and _is_json(metadata_file):
+        return
+    if os.path.exists(backup_path) and _is_json(backup_path):
+        if os.path.exists(metadata_file):
+            _set_aside(metadata_file)
+        with open(backup_path, 'rb') as f:
+            content = f.read()
+        atomic_write(metadata_file, lambda f: f.write(content), binary=True)
+        messages.append(f"Файл метаданных '{metadata_file}' поврежден и восстановлен из резервной копии.")
+    elif os.path.exists(metadata_file):
+        corrupt_path = _set_aside(metadata_file)
+        messages.append(f"Файл метаданных поврежден и перемещен в '{corrupt_path}'.")
+
+
+def recover_log(path):
+    """
+    Удаляет из журнала изменений поврежденные строки.
+
+    Оборванная запись в конце журнала отрезается; строки, которые не
+    разбираются как JSON (например, оборванная запись, к которой дописали
+    следующие), удаляются, остальные записи сохраняются.
+
+    Returns:
+        Количество удаленных строк
+    """
+    with open(path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    # После последнего перевода строки остается оборванная запись (или пустая строка)
+    tail = lines.pop()
+    valid = []
+    for line in lines:
+        try:
+            json.loads(line)
+        except ValueError:
+            continue
+        valid.append(line)
+    dropped = len(lines) - len(valid) + (1 if tail else 0)
+    if dropped:
+        atomic_write(path, lambda f: f.write(b''.join(line + b'\n' for line in valid)), binary=True)
+    return dropped
+
+
+def recover(metadata_file):
+    """
+    Проверяет файлы базы данных при запуске и восстанавливает поврежденные.
+
+    Вызывается, только когда с базой данных не работают другие процессы
+    (иначе временные файлы могут принадлежать незавершенной записи).
+
+    - удаляются временные файлы прерванных записей (*.tmp);
+    - поврежденный файл метаданных восстанавливается из резервной копии;
+    - из журналов удаляются оборванные и поврежденные строки;
+    - обрезанные снимки таблиц перемещаются в <table>.json.corrupt;
+    - у двоичных таблиц отменяются изменения, не сохраненные до сбоя
+      (по журналу отката), и проверяются заголовок и число записей;
+    - у таблиц, хранящихся фрагментами, удаляются файлы фрагментов,
+      на которые не ссылается оглавление.
+
+    Args:
+        metadata_file: Путь к файлу метаданных
+
+    Returns:
+        Список сообщений о найденных и исправленных проблемах
+    """
+    from .binary import check_binary
+    from .chunked import check_chunked
+
+    messages = []
+    # Временные файлы метаданных и журналов фиксации транзакций (<metadata>.<pid>.txn)
+    directory = os.path.dirname(metadata_file) or '.'
+    prefix = os.path.basename(metadata_file) + '.'
+    tmp_paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.startswith(prefix) and name.endswith('.tmp')]
+    if os.path.isdir(DATA_DIR):
+        tmp_paths.extend(os.path.join(DATA_DIR, name) for name in os.listdir(DATA_DIR) if name.endswith('.tmp'))
+    for tmp_path in tmp_paths:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+            messages.append(f"Удален незавершенный временный файл '{tmp_path}'.")
+
+    _recover_metadata(metadata_file, messages)
+
+    if not os.path.isdir(DATA_DIR):
+        return messages
+    for name in sorted(os.listdir(DATA_DIR)):
+        path = os.path.join(DATA_DIR, name)
+        table_name, extension = os.path.splitext(name)
+        if extension == '.log':
+            dropped = recover_log(path)
+            if dropped:
+                messages.append(f"Из журнала таблицы '{table_name}' удалено поврежденных записей: {dropped}.")
+        elif extension == '.json' and '.' not in table_name and not _looks_complete(path):
+            corrupt_path = _set_aside(path)
+            messages.append(f"Снимок таблицы '{table_name}' обрезан и перемещен в '{corrupt_path}'.")
+        elif extension == '.bin':
+            messages.extend(check_binary(table_name))
+        elif extension == '.chunks':
+            messages.extend(check_chunked(table_name))
+    return messages
@@ -1,209 +1,1069 @@
+import csv
+import functools
+import json
+import re
 import shlex
+import sys
+import time
+from itertools import islice
 from prompt import string
 from prettytable import PrettyTable
 
-from .utils import load_metadata, save_metadata, load_table_data, save_table_data
-from .core import create_table, drop_table, insert, select, update, delete
-from .parser import parse_where_clause, parse_set_clause
-from .constants import METADATA_FILE
+from .utils import compact_table_data, convert_table_data, remove_table_data, vacuum_table_data
+from .core import (
+    create_table, drop_table, create_index, drop_index, insert, insert_many, select, iter_select, update, delete,
+    cache_stats, explain, analyze_table, aggregate, evict_table_cache, add_column, drop_column, rename_column,
+)
+from .bulk import detect_format, read_chunks, write_rows
+from .index import build_index, drop_index_file, table_indexes
+from .parser import parse_where_clause, parse_set_clause, parse_select_args, parse_aggregate_args
+from .planner import format_plan
+from .prepared import StatementCache, prepare
+from .predicate import where_columns
+from .constants import SELECT_PAGE_SIZE
+from .session import Session
+from .storage import storage_for
+from .decorators import set_confirm_policy, set_timing_sink
+from . import metrics
+
+# Команды, которые сразу изменяют файлы на диске и поэтому не выполняются в транзакции
+_NON_TRANSACTIONAL_COMMANDS = (
+    "drop_table", "compact", "convert", "create_index", "drop_index", "checkpoint", "alter_table", "vacuum",
+)
+
+# Команды, изменяющие таблицу (второй аргумент) или её метаданные: выполняются
+# под блокировкой записи таблицы
+_WRITE_COMMANDS = (
+    "create_table", "drop_table", "insert", "update", "delete", "analyze", "compact", "convert",
+    "create_index", "drop_index", "load", "alter_table", "vacuum",
+)
+
+# Команды, которые работают с файлами таблицы напрямую: читатели ждут их завершения
+_FILE_COMMANDS = ("drop_table", "drop_index", "compact", "convert", "alter_table", "vacuum")
+
+# Команды, время которых учитывается в метриках под собственным именем
+# (остальные, например опечатки, - под именем 'unknown')
+_COMMANDS = (
+    "help", "create_table", "drop_table", "show_tables", "insert", "select", "explain", "analyze", "update",
+    "delete", "compact", "convert", "create_index", "drop_index", "cache_stats", "stats", "profile", "load",
+    "export", "checkpoint", "begin", "commit", "rollback", "prepare", "execute", "deallocate", "alter_table",
+    "vacuum",
+)
+
+# Подготовленные команды по форме текста для команд, введенных без prepare
+_statement_cache = StatementCache()
+metrics.register_gauges('statement_cache', _statement_cache.stats)
+
+# Команда prepare: имя и текст подготавливаемой команды
+_PREPARE_RE = re.compile(r"\s*prepare\s+(\S+)\s+as\s+(.+)", re.IGNORECASE | re.DOTALL)
 
 
 def run():
     """Главная функция, содержащая основной цикл программы."""
+    # Сессия хранит метаданные и таблицы в памяти между командами
+    session = Session()
+    for message in session.recover():
+        print(message)
+    try:
+        while True:
+            # Запрос ввода у пользователя
+            print("\n<command> exit - выйти из программы")
+            print("<command> help - справочная информация")
+            user_input = string(prompt="Введите команду: ")
+            
+            if not execute(session, user_input):
+                break
+    finally:
+        if session.in_transaction:
+            _rollback(session)
+            print("Незавершенная транзакция отменена.")
+        session.close()
+
+
+def _add_timing(stats, name, elapsed):
+    """Добавляет замер времени в сводную статистику {имя: {count, total, max}}."""
+    entry = stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+    entry['count'] += 1
+    entry['total'] += elapsed
+    entry['max'] = max(entry['max'], elapsed)
+
+
+def run_script(lines, assume_yes=False, report_file=None):
+    """
+    Выполняет команды из скрипта в одном процессе без интерактивного ввода.
+    
+    Все изменения накапливаются в сессии и записываются на диск один раз
+    в конце скрипта (или по команде checkpoint). Опасные операции
+    подтверждаются только при assume_yes, иначе отменяются. Время выполнения
+    команд не выводится на экран, а собирается в сводный отчет, который
+    печатается в stderr и при необходимости сохраняется в JSON-файл.
+    
+    Args:
+        lines: Итерируемый объект со строками команд
+        assume_yes: Автоматически подтверждать опасные операции
+        report_file: Путь к JSON-файлу для отчета о времени выполнения
+    
+    Returns:
+        Словарь с отчетом о выполнении
+    """
+    command_stats = {}
+    function_stats = {}
+    set_confirm_policy('yes' if assume_yes else 'no')
+    set_timing_sink(lambda name, elapsed: _add_timing(function_stats, name, elapsed))
+    
+    session = Session(checkpoint_interval=None)
+    for message in session.recover():
+        print(message, file=sys.stderr)
+    commands_count = 0
+    start_time = time.monotonic()
+    try:
+        for line in lines:
+            line = line.strip()
+            # Пустые строки и комментарии пропускаются
+            if not line or line.startswith(('#', '--')):
+                continue
+            
+            command_start = time.monotonic()
+            if not execute(session, line):
+                break
+            commands_count += 1
+            command_name = line.split(maxsplit=1)[0].lower()
+            _add_timing(command_stats, command_name, time.monotonic() - command_start)
+        
+        if session.in_transaction:
+            _rollback(session)
+            print("Незавершенная транзакция отменена.", file=sys.stderr)
+        checkpoint_start = time.monotonic()
+        session.close()
+        _add_timing(command_stats, 'checkpoint', time.monotonic() - checkpoint_start)
+    finally:
+        set_confirm_policy('ask')
+        set_timing_sink(None)
+    
+    report = {
+        'commands': commands_count,
+        'total_seconds': time.monotonic() - start_time,
+        'by_command': command_stats,
+        'functions': function_stats,
+    }
+    _print_script_report(report)
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def _print_script_report(report):
+    """Печатает сводный отчет о выполнении скрипта в stderr."""
+    out = sys.stderr
+    print(f"\nВыполнено команд: {report['commands']} за {report['total_seconds']:.3f} секунд.", file=out)
+    for title, stats in (("Команды", report['by_command']), ("Функции", report['functions'])):
+        if not stats:
+            continue
+        print(f"{title}:", file=out)
+        for name, entry in sorted(stats.items(), key=lambda item: -item[1]['total']):
+            average = entry['total'] / entry['count']
+            print(
+                f"  {name}: {entry['count']} раз, всего {entry['total']:.3f} с, "
+                f"среднее {average * 1000:.3f} мс, максимум {entry['max'] * 1000:.3f} мс",
+                file=out,
+            )
+
+
+def _run_select(session, metadata, table_name, options, column_names, index_columns):
+    """
+    Выполняет выборку и выводит записи.
+    
+    Args:
+        session: Сессия работы с базой данных
+        metadata: Словарь с метаданными базы данных
+        table_name: Имя таблицы
+        options: Параметры выборки (см. parser.parse_select_args)
+        column_names: Названия столбцов таблицы
+        index_columns: Столбцы условия и сортировки, по которым могут использоваться индексы
+    """
+    where_clause, order_by = options['where'], options['order_by']
+    
+    # Загружаем данные таблицы
+    table_data = session.table(table_name)
+    indexes = session.indexes(table_name, index_columns) if index_columns else {}
+    
+    if where_clause:
+        # Выполняем выборку (способ доступа выбирает планировщик)
+        result = select(table_data, where_clause, indexes, metadata, table_name,
+                        options['limit'], options['offset'], order_by)
+    elif order_by:
+        # Сортировка по упорядоченному индексу выводится по мере перебора
+        result = iter_select(table_data, indexes=indexes, limit=options['limit'],
+                             offset=options['offset'], order_by=order_by)
+    else:
+        # Без условия записи выводятся по мере перебора, без копирования всей таблицы
+        result = iter_select(table_data, limit=options['limit'], offset=options['offset'])
+    _print_rows(column_names, result)
+
+
+def _run_insert(session, metadata, table_name, values):
+    """Вставляет запись со значениями values (строки в порядке столбцов схемы без ID)."""
+    # Берем данные таблицы из сессии (загружаются один раз)
+    table_data = session.table(table_name, for_update=True)
+    
+    # Выполняем вставку
+    changes = []
+    updated_data = insert(metadata, table_name, values, changes, table_data)
+    if updated_data is not None:
+        session.save_changes(table_name, updated_data, changes)
+        # Сохраняем сдвинутую последовательность ID и поколение таблицы
+        session.save_metadata()
+
+
+def _run_update(session, metadata, table_name, set_clause, where_clause):
+    """Обновляет записи, удовлетворяющие условию, и сохраняет изменения."""
+    # Загружаем данные таблицы
+    table_data = session.table(table_name, for_update=True)
+    
+    # Выполняем обновление
+    changes = []
+    indexes = session.indexes(table_name, where_columns(where_clause))
+    updated_data = update(table_data, set_clause, where_clause, changes, indexes, metadata, table_name)
+    if updated_data is not None and changes:
+        session.save_changes(table_name, updated_data, changes)
+        # Сохраняем новое поколение таблицы
+        session.save_metadata()
+
+
+def _run_delete(session, metadata, table_name, where_clause):
+    """Удаляет записи, удовлетворяющие условию, и сохраняет изменения."""
+    # Загружаем данные таблицы
+    table_data = session.table(table_name, for_update=True)
+    
+    # Выполняем удаление
+    changes = []
+    indexes = session.indexes(table_name, where_columns(where_clause))
+    updated_data = delete(table_data, where_clause, changes, indexes, metadata, table_name)
+    if updated_data is not None and changes:
+        session.save_changes(table_name, updated_data, changes)
+        # Сохраняем новое поколение таблицы
+        session.save_metadata()
+
+
+_ALTER_TABLE_USAGE = (
+    "Ошибка: Используйте формат: alter_table <table_name> add_column <column:type> default <value> | "
+    "drop_column <column> | rename_column <column> <new_name>"
+)
+
+
+def _run_alter_table(session, metadata, args):
+    """
+    Изменяет схему таблицы (alter_table).
+    
+    Записи на диске не переписываются: изменение схемы применяется к ним
+    при загрузке таблицы (см. Session._upgrade) до выполнения vacuum.
+    Двоичные таблицы хранят записи фиксированной длины по схеме из заголовка
+    файла, поэтому переписываются сразу.
+    """
+    if len(args) < 4:
+        print(_ALTER_TABLE_USAGE)
+        return
+    
+    table_name, action = args[1], args[2].lower()
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return
+    
+    if action == "add_column" and len(args) == 6 and ':' in args[3] and args[4].lower() == "default":
+        column, col_type = args[3].split(':', 1)
+        alter = functools.partial(add_column, metadata, table_name, column, col_type, args[5])
+    elif action == "drop_column" and len(args) == 4:
+        alter = functools.partial(drop_column, metadata, table_name, args[3])
+    elif action == "rename_column" and len(args) == 5:
+        alter = functools.partial(rename_column, metadata, table_name, args[3], args[4])
+    else:
+        print(_ALTER_TABLE_USAGE)
+        return
+    
+    # Несохраненные изменения записываются в прежней схеме
+    session.flush(table_name)
+    version = metadata[table_name].get('schema_version', 0)
+    indexed = table_indexes(metadata[table_name])
+    alter()
+    if metadata.get(table_name, {}).get('schema_version', 0) == version:
+        return
+    
+    # Индексы удаленного и переименованного столбцов больше не нужны
+    # (индекс под новым именем строится заново при первом обращении)
+    for column in set(indexed) - set(table_indexes(metadata[table_name])):
+        drop_index_file(table_name, column)
+        session.forget_index(table_name, column)
+    session.save_metadata()
+    if storage_for(table_name).name == 'binary':
+        _vacuum(session, metadata, table_name)
+    else:
+        # Таблица будет загружена заново и приведена к новой схеме
+        session.forget_table(table_name)
+
+
+def _vacuum(session, metadata, table_name):
+    """
+    Переписывает данные таблицы в актуальной схеме и очищает список изменений схемы.
+    
+    Returns:
+        Данные таблицы после перезаписи или None при ошибке
+    """
+    table_info = metadata[table_name]
+    session.flush(table_name)
+    try:
+        table_data = vacuum_table_data(table_name, table_info['columns'], table_info.get('schema_changes', []))
+    except ValueError as e:
+        print(f"Ошибка: Не удалось переписать таблицу '{table_name}': {e}")
+        return None
+    table_info.pop('schema_changes', None)
+    session.replace_table(table_name, table_data)
+    session.save_metadata()
+    return table_data
+
+
+def _run_statement(session, metadata, statement, parts):
+    """
+    Выполняет подготовленную команду с подставленными значениями.
+    
+    Args:
+        session: Сессия работы с базой данных
+        metadata: Словарь с метаданными базы данных
+        statement: Подготовленная команда (prepared.PreparedStatement)
+        parts: Части команды со значениями (см. PreparedStatement.bind)
+    """
+    table_name = statement.table
+    if statement.kind == "select":
+        _run_select(session, metadata, table_name, parts, statement.column_names, statement.index_columns)
+        return
+    
+    # Блокировка снимается, когда изменения таблицы будут сохранены (см. Session.command_done)
+    session.lock_table(table_name)
+    if statement.kind == "insert":
+        _run_insert(session, metadata, table_name, parts['values'])
+    elif statement.kind == "update":
+        _run_update(session, metadata, table_name, parts['set'], parts['where'])
+    else:
+        _run_delete(session, metadata, table_name, parts['where'])
+
+
+def prepare_statement(session, name, text):
+    """
+    Подготавливает команду со знаками ? на месте значений и сохраняет её в сессии под именем name.
+    
+    Args:
+        session: Сессия работы с базой данных
+        name: Имя подготовленной команды
+        text: Текст команды select, insert, update или delete
+    
+    Returns:
+        Подготовленная команда (prepared.PreparedStatement) или None при ошибке
+    """
+    try:
+        statement = prepare(text, session.metadata)
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return None
+    session.statements[name] = statement
+    print(f"Команда '{name}' подготовлена (параметров: {len(statement.parameters)}).")
+    return statement
+
+
+def execute_prepared(session, name, *values):
+    """
+    Выполняет подготовленную команду с указанными значениями параметров.
+    
+    Если схема таблицы изменилась после подготовки, команда готовится заново
+    по сохраненному тексту.
+    
+    Args:
+        session: Сессия работы с базой данных
+        name: Имя подготовленной команды
+        *values: Значения параметров (строки, как в команде execute, или значения Python)
+    """
+    statement = session.statements.get(name)
+    if statement is None:
+        print(f"Ошибка: Подготовленная команда '{name}' не существует.")
+        return
+    
+    metadata = session.metadata
+    table_info = metadata.get(statement.table)
+    if table_info is None or [tuple(column) for column in table_info.get('columns', [])] != statement.columns:
+        try:
+            statement = session.statements[name] = prepare(statement.text, metadata)
+        except ValueError as e:
+            print(f"Ошибка: Команду '{name}' нужно подготовить заново: {e}")
+            return
+    
+    try:
+        parts = statement.bind(values)
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return
+    _run_statement(session, metadata, statement, parts)
+
+
+def _format_ms(seconds):
+    """Форматирует время в миллисекундах для вывода stats."""
+    return '-' if seconds is None else f"{seconds * 1000:.3f}"
+
+
+def _run_stats(args):
+    """
+    Выполняет команду stats: вывод, сброс или выгрузка метрик.
+    
+    Args:
+        args: Слова команды после 'stats'
+    """
+    action = args[0].lower() if args else None
+    if action == "reset":
+        metrics.reset()
+        print("Метрики сброшены.")
+        return
+    if action == "export":
+        if len(args) < 2:
+            print("Ошибка: Используйте формат: stats export <file> [json|prometheus]")
+            return
+        try:
+            fmt = metrics.export(args[1], args[2].lower() if len(args) > 2 else None)
+        except (ValueError, OSError) as e:
+            print(f"Ошибка: {e}")
+            return
+        print(f"Метрики выгружены в файл '{args[1]}' (формат {fmt}).")
+        return
+    if action is not None:
+        print("Ошибка: Используйте формат: stats [reset | export <file> [json|prometheus]]")
+        return
+    
+    data = metrics.snapshot()
+    if data['histograms']:
+        pt = PrettyTable()
+        pt.field_names = ["Метрика", "Метки", "Количество", "p50, мс", "p95, мс", "p99, мс", "max, мс", "Всего, с"]
+        for item in data['histograms']:
+            labels = ', '.join(f"{key}={value}" for key, value in item['labels'].items())
+            pt.add_row([item['name'], labels, item['count'], _format_ms(item['p50']), _format_ms(item['p95']),
+                        _format_ms(item['p99']), _format_ms(item['max']), f"{item['sum']:.3f}"])
+        print()
+        print(pt)
+    else:
+        print("Замеров времени пока нет.")
+    counters = data['counters']
+    print("\nСчетчики:")
+    for name in ('rows_scanned', 'rows_returned', 'bytes_read', 'bytes_written', 'chunks_read', 'chunks_skipped'):
+        print(f"  {name}: {counters.get(name, 0)}")
+    gauges = data['gauges']
+    print(f"Кэш выборок: {gauges['select_cache_hit_ratio'] * 100:.1f}% попаданий "
+          f"({gauges['select_cache_hits']} из {gauges['select_cache_hits'] + gauges['select_cache_misses']})")
+    print(f"Кэш разобранных команд: {gauges['statement_cache_hit_ratio'] * 100:.1f}% попаданий "
+          f"({gauges['statement_cache_hits']} из "
+          f"{gauges['statement_cache_hits'] + gauges['statement_cache_misses']}, "
+          f"форм: {gauges['statement_cache_entries']})")
+
+
+def _rollback(session):
+    """Отменяет транзакцию и удаляет из кэша выборок результаты по отмененным данным."""
+    for table_name in session.rollback():
+        evict_table_cache(table_name)
+
+
+def _print_rows(column_names, rows):
+    """
+    Выводит записи с помощью PrettyTable страницами по SELECT_PAGE_SIZE записей.
+    
+    Каждая страница печатается сразу после того, как собрана, поэтому вывод
+    начинается до окончания перебора всех записей.
+    
+    Args:
+        column_names: Названия столбцов
+        rows: Итерируемый объект с записями
+    """
+    rows = iter(rows)
+    printed = 0
     while True:
-        # Загрузка актуальных метаданных
-        metadata = load_metadata(METADATA_FILE)
+        page = list(islice(rows, SELECT_PAGE_SIZE))
+        if not page:
+            break
         
-        # Запрос ввода у пользователя
-        print("\n<command> exit - выйти из программы")
-        print("<command> help - справочная информация")
-        user_input = string(prompt="Введите команду: ")
+        # Создаем таблицу для вывода
+        pt = PrettyTable()
+        pt.field_names = column_names
+        
+        # Добавляем строки
+        for row in page:
+            pt.add_row([row.get(col, '') for col in column_names])
         
+        print()
+        print(pt)
+        printed += len(page)
+    
+    if not printed:
+        print("Записи не найдены.")
+    elif printed > SELECT_PAGE_SIZE:
+        print(f"Всего записей: {printed}.")
+
+
+def _parse_select(metadata, args):
+    """
+    Разбирает аргументы команды select.
+    
+    Args:
+        metadata: Словарь с метаданными базы данных
+        args: Слова команды, начиная с 'select'
+    
+    Returns:
+        Кортеж (имя таблицы, параметры выборки, названия столбцов)
+        или None при ошибке (сообщение уже выведено)
+    """
+    if len(args) < 2:
+        print("Ошибка: Укажите имя таблицы.")
+        return None
+    
+    table_name = args[1]
+    
+    # Проверка существования таблицы
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return None
+    
+    # Парсинг WHERE, ORDER BY, LIMIT и OFFSET
+    options = parse_select_args(args[2:])
+    if options is None:
+        print("Ошибка: Некорректный формат команды. Используйте: "
+              "select <table_name> [where <условие>] [order by <column> [asc|desc]] [limit N] [offset M]")
+        return None
+    
+    # Получаем названия столбцов из метаданных
+    column_names = [col[0] for col in metadata[table_name].get('columns', [])]
+    order_by = options['order_by']
+    if order_by and order_by[0] not in column_names:
+        print(f"Ошибка: Столбец '{order_by[0]}' не существует в таблице '{table_name}'.")
+        return None
+    return table_name, options, column_names
+
+
+def _run_aggregate(session, metadata, args):
+    """
+    Выполняет агрегатный запрос: select <функции> from <table_name> [where ...] [group by ...].
+    
+    Args:
+        session: Сессия работы с базой данных
+        metadata: Словарь с метаданными базы данных
+        args: Слова команды, начиная с 'select'
+    """
+    options = parse_aggregate_args(args[1:])
+    if options is None:
+        print("Ошибка: Некорректный формат команды. Используйте: "
+              "select <func>(<column>|*), ... from <table_name> [where <условие>] [group by <column>, ...]")
+        return
+    
+    table_name = options['table']
+    if table_name not in metadata:
+        print(f"Ошибка: Таблица '{table_name}' не существует.")
+        return
+    
+    # Индексы нужны для условия, агрегируемых столбцов и группировки
+    where_clause = options['where']
+    columns = where_columns(where_clause) if where_clause else set()
+    columns.update(column for _, column in options['items'] if column != '*')
+    columns.update(options['group_by'])
+    indexes = session.indexes(table_name, columns)
+    
+    result = aggregate(session.table(table_name), options['items'], where_clause, options['group_by'],
+                       indexes, metadata, table_name)
+    if result is not None:
+        labels, rows = result
+        _print_rows(labels, (dict(zip(labels, row)) for row in rows))
+
+
+def execute(session, user_input):
+    """
+    Разбирает и выполняет одну команду.
+    
+    Args:
+        session: Сессия работы с базой данных
+        user_input: Строка команды
+    
+    Returns:
+        False, если введена команда exit, иначе True
+    """
+    start_time = time.perf_counter()
+    # Команды select/insert/update/delete уже встречавшейся формы не разбираются заново
+    cached = _statement_cache.match(user_input, session.metadata)
+    if cached is not None:
+        statement, parts = cached
+        command = statement.kind
+        run = functools.partial(_run_statement, session, session.metadata, statement, parts)
+    else:
         # Разбор введенной строки на команду и аргументы
         try:
             args = shlex.split(user_input)
         except ValueError:
             print("Ошибка: Некорректный ввод.")
-            continue
+            return True
         
         if not args:
-            continue
+            return True
+        
+        if args[0].lower() == "exit":
+            return False
         
         command = args[0].lower()
+        run = functools.partial(_execute_command, session, args, user_input)
+    
+    try:
+        run()
+    except TimeoutError as e:
+        print(f"Ошибка: {e}. Таблицу изменяет другой процесс, повторите команду позже.")
+    except ValueError as e:
+        # Ошибки в сохраненных данных, например неизвестный вид изменения схемы
+        print(f"Ошибка: {e}")
+    # Контрольная точка: изменения сохраняются согласно настройкам сессии, блокировки снимаются
+    session.command_done()
+    metrics.observe('command_seconds', time.perf_counter() - start_time,
+                    command=command if command in _COMMANDS else 'unknown')
+    return True
+
+
+def _execute_command(session, args, line):
+    """
+    Выполняет разобранную команду.
+    
+    Args:
+        session: Сессия работы с базой данных
+        args: Слова команды (после shlex.split)
+        line: Исходный текст команды
+    """
+    # Актуальные метаданные (перечитываются, только если файл изменен извне)
+    metadata = session.metadata
+    
+    command = args[0].lower()
+    
+    if command == "profile":
+        # Профилируется вложенная команда целиком, вместе с её проверками и блокировками
+        if len(args) < 2 or args[1].lower() in ("profile", "exit"):
+            print("Ошибка: Используйте формат: profile <команда>")
+            return
+        _, report = metrics.profile(lambda: _execute_command(session, args[1:], line.split(None, 1)[1]))
+        print(f"\n{report}")
+        return
+    
+    # Эти команды работают с файлами напрямую, поэтому их изменения нельзя отменить
+    if session.in_transaction and command in _NON_TRANSACTIONAL_COMMANDS:
+        print(f"Ошибка: Команда {command} недоступна внутри транзакции. Завершите её командой commit или rollback.")
+        return
+    
+    # Блокировка снимается, когда изменения таблицы будут сохранены (см. Session.command_done)
+    if command in _WRITE_COMMANDS and len(args) > 1:
+        session.lock_table(args[1])
+        if command in _FILE_COMMANDS:
+            session.lock_files(args[1], exclusive=True)
+    
+    # Обработка команд
+    if command == "help":
+        print("\n<command> exit - выйти из программы")
+        print("<command> help - справочная информация")
+        print("<command> create_table <table_name> <col1:type1> <col2:type2> ... - создать таблицу")
+        print("<command> drop_table <table_name> - удалить таблицу")
+        print("<command> show_tables - показать все таблицы")
+        print("<command> insert <table_name> <val1> <val2> ... - вставить запись")
+        print("<command> select <table_name> [where <условие>] [order by <column> [asc|desc]] [limit N] [offset M]"
+              " - выбрать записи")
+        print("<command> select <func>(<column>|*), ... from <table_name> [where <условие>] [group by <column>, ...]"
+              " - агрегаты count, sum, min, max, avg")
+        print("<command> explain select <table_name> ... - показать план выполнения выборки")
+        print("<command> analyze <table_name> - собрать статистику таблицы для планировщика")
+        print("<command> update <table_name> set <column>=<value> where <условие> - обновить записи")
+        print("<command> delete <table_name> where <условие> - удалить записи")
+        print("    условие: <column> =|!=|<|<=|>|>= <value>, <column> [not] in (<v1>, <v2>, ...),")
+        print("             <column> [not] between <v1> and <v2>; связки and, or, not и скобки")
+        print("<command> compact <table_name> - свернуть журнал изменений таблицы в снимок"
+              " (или переписать фрагменты с точными картами зон)")
+        print("<command> convert <table_name> binary|chunked|json - перевести таблицу в двоичный формат (mmap),"
+              " во фрагменты по диапазонам ID или в JSON")
+        print("<command> alter_table <table_name> add_column <column:type> default <value> - добавить столбец")
+        print("<command> alter_table <table_name> drop_column <column> - удалить столбец")
+        print("<command> alter_table <table_name> rename_column <column> <new_name> - переименовать столбец")
+        print("<command> vacuum <table_name> - переписать данные таблицы в актуальной схеме")
+        print("<command> create_index <table_name> <column> [hash|sorted] - создать индекс по столбцу")
+        print("<command> drop_index <table_name> <column> - удалить индекс по столбцу")
+        print("<command> cache_stats - статистика кэша выборок")
+        print("<command> prepare <name> as <select|insert|update|delete ...> - подготовить команду"
+              " со знаками ? на месте значений")
+        print("<command> execute <name> <val1> <val2> ... - выполнить подготовленную команду")
+        print("<command> deallocate <name> - удалить подготовленную команду")
+        print("<command> stats [reset] - метрики: время команд (p50/p95/p99), просмотренные записи, ввод-вывод")
+        print("<command> stats export <file> [json|prometheus] - выгрузить метрики в файл")
+        print("<command> profile <команда> - выполнить команду под профилировщиком")
+        print("<command> checkpoint - сохранить на диск все изменения сессии")
+        print("<command> begin - начать транзакцию (изменения сохраняются только по commit)")
+        print("<command> commit - сохранить изменения транзакции")
+        print("<command> rollback - отменить изменения транзакции")
+        print("<command> load <table_name> <file.csv|file.jsonl> - загрузить записи из файла")
+        print("<command> export <table_name> <file.csv|file.jsonl> - выгрузить записи в файл")
+    elif command == "create_table":
+        if len(args) < 2:
+            print("Ошибка: Укажите имя таблицы и столбцы.")
+            return
         
-        # Обработка команд
-        if command == "exit":
-            break
-        elif command == "help":
-            print("\n<command> exit - выйти из программы")
-            print("<command> help - справочная информация")
-            print("<command> create_table <table_name> <col1:type1> <col2:type2> ... - создать таблицу")
-            print("<command> drop_table <table_name> - удалить таблицу")
-            print("<command> show_tables - показать все таблицы")
-            print("<command> insert <table_name> <val1> <val2> ... - вставить запись")
-            print("<command> select <table_name> [where <column>=<value>] - выбрать записи")
-            print("<command> update <table_name> set <column>=<value> where <column>=<value> - обновить записи")
-            print("<command> delete <table_name> where <column>=<value> - удалить записи")
-        elif command == "create_table":
-            if len(args) < 2:
-                print("Ошибка: Укажите имя таблицы и столбцы.")
-                continue
-            
-            table_name = args[1]
-            columns = []
-            
-            # Парсинг столбцов
-            for col_arg in args[2:]:
-                if ':' not in col_arg:
-                    print(f"Ошибка: Некорректный формат столбца '{col_arg}'. Используйте формат 'name:type'")
-                    break
-                col_name, col_type = col_arg.split(':', 1)
-                columns.append((col_name, col_type))
-            else:
-                # Если цикл завершился без break, обновляем метаданные
-                metadata = create_table(metadata, table_name, columns)
-                save_metadata(METADATA_FILE, metadata)
-        elif command == "drop_table":
-            if len(args) < 2:
-                print("Ошибка: Укажите имя таблицы.")
-                continue
-            
-            table_name = args[1]
-            metadata = drop_table(metadata, table_name)
-            save_metadata(METADATA_FILE, metadata)
-        elif command == "show_tables":
-            if not metadata:
-                print("База данных пуста. Таблиц нет.")
-            else:
-                print("\nТаблицы в базе данных:")
-                for table_name, table_info in metadata.items():
-                    columns = table_info.get('columns', [])
-                    col_str = ', '.join([f"{col[0]}:{col[1]}" for col in columns])
-                    print(f"  - {table_name}: {col_str}")
-        elif command == "insert":
-            if len(args) < 3:
-                print("Ошибка: Укажите имя таблицы и значения для вставки.")
-                continue
-            
-            table_name = args[1]
-            values = args[2:]
-            
-            # Загружаем данные таблицы
-            table_data = load_table_data(table_name)
-            
-            # Выполняем вставку
-            updated_data = insert(metadata, table_name, values)
-            if updated_data is not None:
-                save_table_data(table_name, updated_data)
-        elif command == "select":
-            if len(args) < 2:
-                print("Ошибка: Укажите имя таблицы.")
-                continue
-            
-            table_name = args[1]
-            
-            # Проверка существования таблицы
-            if table_name not in metadata:
-                print(f"Ошибка: Таблица '{table_name}' не существует.")
-                continue
-            
-            # Парсинг WHERE условия
-            where_clause = None
-            if len(args) > 2:
-                if args[2].lower() == 'where' and len(args) > 3:
-                    where_str = args[3]
-                    where_clause = parse_where_clause(where_str)
-                    if where_clause is None:
-                        print("Ошибка: Некорректный формат условия WHERE. Используйте: where column=value")
-                        continue
-            
-            # Загружаем данные таблицы
-            table_data = load_table_data(table_name)
-            
-            # Выполняем выборку
-            result = select(table_data, where_clause)
-            
-            # Выводим результат с помощью PrettyTable
-            if not result:
-                print("Записи не найдены.")
-            else:
-                # Получаем названия столбцов из метаданных
-                table_info = metadata[table_name]
+        table_name = args[1]
+        columns = []
+        
+        # Парсинг столбцов
+        for col_arg in args[2:]:
+            if ':' not in col_arg:
+                print(f"Ошибка: Некорректный формат столбца '{col_arg}'. Используйте формат 'name:type'")
+                break
+            col_name, col_type = col_arg.split(':', 1)
+            columns.append((col_name, col_type))
+        else:
+            # Если цикл завершился без break, обновляем метаданные
+            metadata = create_table(metadata, table_name, columns)
+            session.save_metadata()
+    elif command == "drop_table":
+        if len(args) < 2:
+            print("Ошибка: Укажите имя таблицы.")
+            return
+        
+        table_name = args[1]
+        metadata = drop_table(metadata, table_name)
+        if metadata is not None and table_name not in metadata:
+            session.forget_table(table_name)
+            remove_table_data(table_name)
+        session.save_metadata()
+    elif command == "show_tables":
+        if not metadata:
+            print("База данных пуста. Таблиц нет.")
+        else:
+            print("\nТаблицы в базе данных:")
+            for table_name, table_info in metadata.items():
                 columns = table_info.get('columns', [])
-                column_names = [col[0] for col in columns]
-                
-                # Создаем таблицу для вывода
-                pt = PrettyTable()
-                pt.field_names = column_names
-                
-                # Добавляем строки
-                for row in result:
-                    pt.add_row([row.get(col, '') for col in column_names])
-                
-                print()
-                print(pt)
-        elif command == "update":
-            if len(args) < 6:
-                print("Ошибка: Используйте формат: update <table_name> set <column>=<value> where <column>=<value>")
-                continue
-            
-            table_name = args[1]
-            
-            # Проверка существования таблицы
-            if table_name not in metadata:
-                print(f"Ошибка: Таблица '{table_name}' не существует.")
-                continue
-            
-            # Парсинг SET и WHERE
-            if args[2].lower() != 'set' or args[4].lower() != 'where':
-                print("Ошибка: Используйте формат: update <table_name> set <column>=<value> where <column>=<value>")
-                continue
-            
-            set_str = args[3]
-            where_str = args[5]
-            
-            set_clause = parse_set_clause(set_str)
-            where_clause = parse_where_clause(where_str)
-            
-            if set_clause is None or where_clause is None:
-                print("Ошибка: Некорректный формат условий. Используйте: column=value")
-                continue
-            
-            # Загружаем данные таблицы
-            table_data = load_table_data(table_name)
-            
-            # Выполняем обновление
-            updated_data = update(table_data, set_clause, where_clause)
-            save_table_data(table_name, updated_data)
-        elif command == "delete":
-            if len(args) < 4:
-                print("Ошибка: Используйте формат: delete <table_name> where <column>=<value>")
-                continue
-            
-            table_name = args[1]
-            
-            # Проверка существования таблицы
-            if table_name not in metadata:
-                print(f"Ошибка: Таблица '{table_name}' не существует.")
-                continue
-            
-            # Парсинг WHERE
-            if args[2].lower() != 'where':
-                print("Ошибка: Используйте формат: delete <table_name> where <column>=<value>")
-                continue
-            
-            where_str = args[3]
-            where_clause = parse_where_clause(where_str)
-            
-            if where_clause is None:
-                print("Ошибка: Некорректный формат условия WHERE. Используйте: where column=value")
-                continue
-            
-            # Загружаем данные таблицы
-            table_data = load_table_data(table_name)
-            
-            # Выполняем удаление
-            updated_data = delete(table_data, where_clause)
-            save_table_data(table_name, updated_data)
+                col_str = ', '.join([f"{col[0]}:{col[1]}" for col in columns])
+                print(f"  - {table_name}: {col_str}")
+                storage_name = storage_for(table_name).name
+                if storage_name == 'binary':
+                    print("    формат: binary")
+                elif storage_name == 'chunked':
+                    print(f"    формат: chunked (фрагментов: {session.table(table_name).chunk_count})")
+                if table_info.get('schema_version'):
+                    print(f"    версия схемы: {table_info['schema_version']} "
+                          f"(изменений до vacuum: {len(table_info.get('schema_changes', []))})")
+                indexes = table_indexes(table_info)
+                if indexes:
+                    index_str = ', '.join(f"{column} ({kind})" for column, kind in indexes.items())
+                    print(f"    индексы: {index_str}")
+    elif command == "insert":
+        if len(args) < 3:
+            print("Ошибка: Укажите имя таблицы и значения для вставки.")
+            return
+        
+        _run_insert(session, metadata, args[1], args[2:])
+    elif command in ("select", "explain"):
+        if command == "explain":
+            # explain select <table_name> ...
+            if len(args) < 2 or args[1].lower() != "select":
+                print("Ошибка: Используйте формат: explain select <table_name> [where <условие>] ...")
+                return
+            args = args[1:]
+        elif any(arg.lower() == "from" for arg in args[1:]):
+            # Агрегатный запрос: select count(*), avg(age) from users ...
+            _run_aggregate(session, metadata, args)
+            return
+        
+        query = _parse_select(metadata, args)
+        if query is None:
+            return
+        table_name, options, column_names = query
+        
+        # Индексы нужны для столбцов условия и сортировки
+        columns = where_columns(options['where']) if options['where'] else set()
+        if options['order_by']:
+            columns.add(options['order_by'][0])
+        
+        if command == "explain":
+            plan = explain(session.table(table_name), options['where'], session.indexes(table_name, columns),
+                           metadata, table_name, options['limit'], options['offset'], options['order_by'])
+            print(f"\nПлан запроса к таблице '{table_name}':")
+            for plan_line in format_plan(plan):
+                print(f"  {plan_line}")
+            if 'stats' not in metadata[table_name]:
+                print(f"  Статистика не собрана: выполните analyze {table_name}")
         else:
-            print(f"Неизвестная команда: {command}. Введите 'help' для справки.")
+            _run_select(session, metadata, table_name, options, column_names, columns)
+    elif command == "analyze":
+        if len(args) < 2:
+            print("Ошибка: Укажите имя таблицы.")
+            return
+        
+        table_name = args[1]
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        
+        metadata = analyze_table(metadata, table_name, session.table(table_name))
+        session.save_metadata()
+    elif command == "update":
+        if len(args) < 6:
+            print("Ошибка: Используйте формат: update <table_name> set <column>=<value> where <column>=<value>")
+            return
+        
+        table_name = args[1]
+        
+        # Проверка существования таблицы
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        
+        # Парсинг SET и WHERE
+        if args[2].lower() != 'set' or args[4].lower() != 'where':
+            print("Ошибка: Используйте формат: update <table_name> set <column>=<value> where <column>=<value>")
+            return
+        
+        set_str = args[3]
+        set_clause = parse_set_clause(set_str)
+        where_clause = parse_where_clause(args[5:])
+        
+        if set_clause is None or where_clause is None:
+            print("Ошибка: Некорректный формат условий. Используйте: set column=value where <условие>")
+            return
+        
+        _run_update(session, metadata, table_name, set_clause, where_clause)
+    elif command == "delete":
+        if len(args) < 4:
+            print("Ошибка: Используйте формат: delete <table_name> where <column>=<value>")
+            return
+        
+        table_name = args[1]
+        
+        # Проверка существования таблицы
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        
+        # Парсинг WHERE
+        if args[2].lower() != 'where':
+            print("Ошибка: Используйте формат: delete <table_name> where <column>=<value>")
+            return
+        
+        where_clause = parse_where_clause(args[3:])
+        
+        if where_clause is None:
+            print("Ошибка: Некорректный формат условия WHERE. Используйте: where <условие>")
+            return
+        
+        _run_delete(session, metadata, table_name, where_clause)
+    elif command == "compact":
+        if len(args) < 2:
+            print("Ошибка: Укажите имя таблицы.")
+            return
+        
+        table_name = args[1]
+        
+        # Проверка существования таблицы
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        
+        # Сначала сохраняем несохраненные изменения сессии
+        session.flush(table_name)
+        table_data = compact_table_data(table_name)
+        session.replace_table(table_name, table_data)
+        if storage_for(table_name).name == 'chunked':
+            print(f"Фрагменты таблицы '{table_name}' переписаны ({len(table_data)} записей).")
+        else:
+            print(f"Журнал таблицы '{table_name}' свернут в снимок ({len(table_data)} записей).")
+    elif command == "convert":
+        if len(args) < 3 or args[2].lower() not in ("binary", "chunked", "json"):
+            print("Ошибка: Используйте формат: convert <table_name> binary|chunked|json")
+            return
+        
+        table_name, target = args[1], args[2].lower()
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        
+        # Сначала сохраняем несохраненные изменения сессии
+        session.flush(table_name)
+        try:
+            table_data = convert_table_data(table_name, metadata[table_name]['columns'], target,
+                                            metadata[table_name].get('schema_changes'))
+        except ValueError as e:
+            print(f"Ошибка: Не удалось преобразовать таблицу '{table_name}': {e}")
+            return
+        if target == 'binary' and metadata[table_name].pop('schema_changes', None):
+            # Записи переписаны в актуальной схеме: двоичные таблицы не приводятся к ней при чтении
+            session.save_metadata()
+        session.replace_table(table_name, table_data)
+        print(f"Таблица '{table_name}' хранится в формате {target} ({len(table_data)} записей).")
+    elif command == "alter_table":
+        _run_alter_table(session, metadata, args)
+    elif command == "vacuum":
+        if len(args) < 2:
+            print("Ошибка: Укажите имя таблицы.")
+            return
+        
+        table_name = args[1]
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        if not metadata[table_name].get('schema_changes'):
+            print(f"Данные таблицы '{table_name}' уже записаны в актуальной схеме.")
+            return
+        
+        table_data = _vacuum(session, metadata, table_name)
+        if table_data is not None:
+            print(f"Таблица '{table_name}' переписана в схеме версии {metadata[table_name]['schema_version']} "
+                  f"({len(table_data)} записей).")
+    elif command == "create_index":
+        if len(args) < 3:
+            print("Ошибка: Используйте формат: create_index <table_name> <column> [hash|sorted]")
+            return
+        
+        table_name, column = args[1], args[2]
+        kind = args[3].lower() if len(args) > 3 else 'hash'
+        if column in table_indexes(metadata.get(table_name, {})):
+            print(f"Ошибка: Индекс по столбцу '{column}' уже существует.")
+            return
+        
+        metadata = create_index(metadata, table_name, column, kind)
+        if column in table_indexes(metadata.get(table_name, {})):
+            # Строим индекс по текущим данным таблицы
+            table_data = session.table(table_name)
+            session.flush(table_name)
+            build_index(table_name, column, table_data, kind)
+            session.save_metadata()
+    elif command == "drop_index":
+        if len(args) < 3:
+            print("Ошибка: Используйте формат: drop_index <table_name> <column>")
+            return
+        
+        table_name, column = args[1], args[2]
+        if column not in table_indexes(metadata.get(table_name, {})):
+            print(f"Ошибка: Индекс по столбцу '{column}' не существует.")
+            return
+        
+        metadata = drop_index(metadata, table_name, column)
+        drop_index_file(table_name, column)
+        session.forget_index(table_name, column)
+        session.save_metadata()
+    elif command == "cache_stats":
+        stats = cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_ratio = stats['hits'] / lookups * 100 if lookups else 0.0
+        limit_entries = stats['max_entries'] if stats['max_entries'] is not None else 'нет'
+        limit_bytes = stats['max_bytes'] if stats['max_bytes'] is not None else 'нет'
+        ttl = f"{stats['ttl']} сек." if stats['ttl'] is not None else 'нет'
+        
+        print("\nСтатистика кэша выборок:")
+        print(f"  Записей: {stats['entries']} (лимит: {limit_entries})")
+        print(f"  Память: {stats['bytes']} байт (лимит: {limit_bytes})")
+        print(f"  Время жизни записи: {ttl}")
+        print(f"  Попадания: {stats['hits']}, промахи: {stats['misses']} ({hit_ratio:.1f}% попаданий)")
+        print(f"  Вытеснено: {stats['evictions']}, устарело: {stats['expired']}")
+    elif command == "prepare":
+        match = _PREPARE_RE.fullmatch(line)
+        if match is None:
+            print("Ошибка: Используйте формат: prepare <name> as <команда со знаками ? на месте значений>")
+            return
+        prepare_statement(session, *match.groups())
+    elif command == "execute":
+        if len(args) < 2:
+            print("Ошибка: Используйте формат: execute <name> <val1> <val2> ...")
+            return
+        execute_prepared(session, args[1], *args[2:])
+    elif command == "deallocate":
+        if len(args) < 2:
+            print("Ошибка: Укажите имя подготовленной команды.")
+            return
+        if session.statements.pop(args[1], None) is None:
+            print(f"Ошибка: Подготовленная команда '{args[1]}' не существует.")
+            return
+        print(f"Подготовленная команда '{args[1]}' удалена.")
+    elif command == "stats":
+        _run_stats(args[1:])
+    elif command == "load":
+        if len(args) < 3:
+            print("Ошибка: Используйте формат: load <table_name> <file.csv|file.jsonl>")
+            return
+        
+        table_name, filepath = args[1], args[2]
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        try:
+            detect_format(filepath)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        
+        start_time = time.monotonic()
+        table_data = session.table(table_name, for_update=True)
+        column_names = [col[0] for col in metadata[table_name]['columns'][1:]]
+        inserted = 0
+        errors = []
+        try:
+            # Файл читается частями, каждая часть проверяется и вставляется целиком
+            for chunk in read_chunks(filepath, column_names):
+                changes = []
+                result = insert_many(metadata, table_name, chunk, changes, table_data)
+                if result is None:
+                    break
+                inserted += result[0]
+                errors.extend(result[1])
+                session.save_changes(table_name, table_data, changes)
+        except FileNotFoundError:
+            print(f"Ошибка: Файл '{filepath}' не найден.")
+            return
+        except (ValueError, csv.Error) as e:
+            print(f"Ошибка: Некорректные данные в файле '{filepath}': {e}")
+        
+        if inserted:
+            session.save_metadata()
+        for line_number, error in errors[:5]:
+            print(f"Строка {line_number}: {error}")
+        if len(errors) > 5:
+            print(f"... и еще {len(errors) - 5} ошибок.")
+        elapsed = time.monotonic() - start_time
+        print(f"Загружено записей: {inserted}, пропущено: {len(errors)} ({elapsed:.3f} секунд).")
+    elif command == "export":
+        if len(args) < 3:
+            print("Ошибка: Используйте формат: export <table_name> <file.csv|file.jsonl>")
+            return
+        
+        table_name, filepath = args[1], args[2]
+        if table_name not in metadata:
+            print(f"Ошибка: Таблица '{table_name}' не существует.")
+            return
+        
+        column_names = [col[0] for col in metadata[table_name]['columns']]
+        try:
+            count = write_rows(filepath, column_names, session.table(table_name))
+        except (ValueError, OSError) as e:
+            print(f"Ошибка: {e}")
+            return
+        print(f"Выгружено записей: {count} в файл '{filepath}'.")
+    elif command == "checkpoint":
+        session.checkpoint()
+        print("Изменения сохранены на диск.")
+    elif command == "begin":
+        try:
+            session.begin()
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        print("Транзакция начата.")
+    elif command == "commit":
+        try:
+            count = session.commit()
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        print(f"Транзакция зафиксирована (изменений: {count}).")
+    elif command == "rollback":
+        try:
+            _rollback(session)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        print("Транзакция отменена.")
+    else:
+        print(f"Неизвестная команда: {command}. Введите 'help' для справки.")
@@ -0,0 +1,384 @@
+"""
+Вторичные индексы по столбцам таблиц.
+
+Поддерживаются два вида индексов:
+- 'hash' - хеш-индекс для поиска по равенству;
+- 'sorted' - упорядоченный индекс для диапазонов и ORDER BY (столбцы int и str).
+
+Индекс хранится в файле data/<table>.<column>.idx вместе с отпечатком снимка
+таблицы и позицией в журнале изменений, до которой он актуален. При загрузке
+индекс догоняет таблицу, применяя только новые записи журнала; если снимок
+таблицы был переписан, индекс перестраивается заново.
+"""
+import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
+from .constants import DATA_DIR
+from .durability import atomic_write
+from .storage import storage_for
+
+
+def _index_path(table_name, column):
+    """Возвращает путь к файлу индекса."""
+    return f'{DATA_DIR}/{table_name}.{column}.idx'
+
+
+# Виды индексов -> ключ списка проиндексированных столбцов в метаданных таблицы
+INDEX_KINDS = {
+    'hash': 'indexes',
+    'sorted': 'sorted_indexes',
+}
+
+# Типы столбцов, для которых можно построить упорядоченный индекс
+SORTED_INDEX_TYPES = {'int', 'str'}
+
+# Размер блока упорядоченного индекса: блок делится пополам, когда
+# становится вдвое больше
+_BLOCK_SIZE = 1000
+
+# Значение ключа (значение, ID) упорядоченного индекса
+_key_value = itemgetter(0)
+
+
+def table_indexes(table_info):
+    """
+    Возвращает индексы таблицы из её метаданных.
+
+    Returns:
+        Словарь {столбец: вид индекса}
+    """
+    result = {}
+    for kind, key in INDEX_KINDS.items():
+        for column in table_info.get(key, []):
+            result[column] = kind
+    return result
+
+
+class _Index:
+    """Общая часть индексов: применение записей журнала изменений."""
+
+    def apply(self, record):
+        """Применяет запись об изменении (insert/update/delete) к индексу."""
+        op = record['op']
+        if op == 'insert':
+            row = record['row']
+            if self.column in row:
+                self.add(row['ID'], row[self.column])
+        elif op == 'update':
+            if self.column in record['set']:
+                self.remove(record['id'])
+                self.add(record['id'], record['set'][self.column])
+        elif op == 'delete':
+            self.remove(record['id'])
+
+
+class HashIndex(_Index):
+    """Хеш-индекс: значение столбца -> множество ID записей."""
+
+    kind = 'hash'
+
+    def __init__(self, column):
+        self.column = column
+        self.entries = {}  # значение -> множество ID
+        self.values = {}  # ID -> значение (для удаления и обновления)
+
+    @classmethod
+    def build(cls, column, table_data):
+        """Строит индекс по данным таблицы."""
+        index = cls(column)
+        for row in table_data:
+            if column in row:
+                index.add(row['ID'], row[column])
+        return index
+
+    def add(self, row_id, value):
+        """Добавляет ID записи в индекс."""
+        self.entries.setdefault(value, set()).add(row_id)
+        self.values[row_id] = value
+
+    def remove(self, row_id):
+        """Удаляет ID записи из индекса."""
+        if row_id not in self.values:
+            return
+        value = self.values.pop(row_id)
+        ids = self.entries[value]
+        ids.discard(row_id)
+        if not ids:
+            del self.entries[value]
+
+    def lookup(self, value):
+        """Возвращает множество ID записей с указанным значением."""
+        return self.entries.get(value, set())
+
+    def dump(self):
+        """Возвращает содержимое индекса для сохранения в файл."""
+        return [[value, sorted(ids)] for value, ids in self.entries.items()]
+
+    @classmethod
+    def restore(cls, column, entries):
+        """Восстанавливает индекс из сохраненного содержимого."""
+        index = cls(column)
+        for value, ids in entries:
+            for row_id in ids:
+                index.add(row_id, value)
+        return index
+
+
+class SortedIndex(_Index):
+    """
+    Упорядоченный индекс: ключи (значение, ID) в порядке возрастания.
+
+    Ключи хранятся в отсортированных блоках ограниченного размера (двухуровневое
+    дерево), поэтому вставка и удаление не сдвигают весь индекс, а поиск границ
+    диапазона выполняется двоичным поиском: выборка k записей из диапазона
+    стоит O(log n + k).
+    """
+
+    kind = 'sorted'
+
+    def __init__(self, column):
+        self.column = column
+        self.blocks = []  # отсортированные блоки ключей (значение, ID)
+        self.maxes = []  # последний ключ каждого блока
+        self.values = {}  # ID -> значение (для удаления и обновления)
+
+    @classmethod
+    def build(cls, column, table_data):
+        """Строит индекс по данным таблицы."""
+        keys = []
+        for row in table_data:
+            value = row.get(column)
+            if value is not None:
+                keys.append((value, row['ID']))
+        keys.sort()
+        return cls._from_keys(column, keys)
+
+    @classmethod
+    def _from_keys(cls, column, keys):
+        """Создает индекс из отсортированного списка ключей."""
+        index = cls(column)
+        index.blocks = [keys[i:i + _BLOCK_SIZE] for i in range(0, len(keys), _BLOCK_SIZE)]
+        index.maxes = [block[-1] for block in index.blocks]
+        index.values = {row_id: value for value, row_id in keys}
+        return index
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, row_id, value):
+        """Добавляет ID записи в индекс (значения None не индексируются)."""
+        if value is None:
+            return
+        key = (value, row_id)
+        self.values[row_id] = value
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            return
+
+        i = min(bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[i]
+        insort(block, key)
+        self.maxes[i] = block[-1]
+        if len(block) > 2 * _BLOCK_SIZE:
+            # Делим переполненный блок пополам
+            self.blocks[i:i + 1] = [block[:_BLOCK_SIZE], block[_BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [self.blocks[i][-1], self.blocks[i + 1][-1]]
+
+    def remove(self, row_id):
+        """Удаляет ID записи из индекса."""
+        if row_id not in self.values:
+            return
+        key = (self.values.pop(row_id), row_id)
+        i = bisect_left(self.maxes, key)
+        block = self.blocks[i]
+        del block[bisect_left(block, key)]
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+
+    def lookup(self, value):
+        """Возвращает множество ID записей с указанным значением."""
+        return set(self.range(value, value))
+
+    def first(self):
+        """Возвращает наименьшее значение в индексе или None для пустого индекса."""
+        return self.blocks[0][0][0] if self.blocks else None
+
+    def last(self):
+        """Возвращает наибольшее значение в индексе или None для пустого индекса."""
+        return self.blocks[-1][-1][0] if self.blocks else None
+
+    def accepts(self, value):
+        """Проверяет, можно ли сравнивать value со значениями индекса."""
+        if not self.blocks:
+            return True
+        return type(value) is type(self.blocks[0][0][0])
+
+    def _start(self, low, include_low):
+        """Возвращает (блок, позиция) первого ключа, не меньшего нижней границы."""
+        if low is None:
+            return 0, 0
+        find = bisect_left if include_low else bisect_right
+        i = find(self.maxes, low, key=_key_value)
+        if i == len(self.blocks):
+            return i, 0
+        return i, find(self.blocks[i], low, key=_key_value)
+
+    def _end(self, high, include_high):
+        """Возвращает (блок, позиция) сразу за последним ключом, не большим верхней границы."""
+        if high is None or not self.blocks:
+            return len(self.blocks), 0
+        find = bisect_right if include_high else bisect_left
+        i = find(self.maxes, high, key=_key_value)
+        if i == len(self.blocks):
+            return i, 0
+        return i, find(self.blocks[i], high, key=_key_value)
+
+    def range(self, low=None, high=None, include_low=True, include_high=True, reverse=False):
+        """
+        Находит ID записей со значениями в диапазоне.
+
+        Границы диапазона находятся сразу (двоичным поиском), а ID выдаются
+        лениво в порядке значений.
+
+        Args:
+            low: Нижняя граница (None - без ограничения)
+            high: Верхняя граница (None - без ограничения)
+            include_low: Включать ли нижнюю границу
+            include_high: Включать ли верхнюю границу
+            reverse: Выдавать ID в порядке убывания значений
+
+        Returns:
+            Итератор ID записей
+
+        Raises:
+            TypeError: Если границы несравнимы со значениями индекса
+        """
+        start = self._start(low, include_low)
+        end = self._end(high, include_high)
+        if start >= end:
+            return iter(())
+        return self._iterate(start, end, reverse)
+
+    def _iterate(self, start, end, reverse):
+        """Перебирает ключи между позициями start и end."""
+        (first_block, first_pos), (last_block, last_pos) = start, end
+        block_numbers = range(first_block, min(last_block, len(self.blocks) - 1) + 1)
+        if reverse:
+            block_numbers = reversed(block_numbers)
+        for i in block_numbers:
+            block = self.blocks[i]
+            begin = first_pos if i == first_block else 0
+            stop = last_pos if i == last_block else len(block)
+            keys = block[begin:stop]
+            if reverse:
+                keys.reverse()
+            for _, row_id in keys:
+                yield row_id
+
+    def dump(self):
+        """Возвращает содержимое индекса для сохранения в файл."""
+        return [list(key) for block in self.blocks for key in block]
+
+    @classmethod
+    def restore(cls, column, entries):
+        """Восстанавливает индекс из сохраненного содержимого."""
+        return cls._from_keys(column, [tuple(key) for key in entries])
+
+
+# Вид индекса -> класс
+_INDEX_CLASSES = {
+    'hash': HashIndex,
+    'sorted': SortedIndex,
+}
+
+
+def save_index(table_name, index, log_offset=0):
+    """
+    Сохраняет индекс в файл.
+
+    Args:
+        table_name: Имя таблицы
+        index: Объект HashIndex или SortedIndex
+        log_offset: Позиция в журнале таблицы, до которой индекс актуален
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    payload = {
+        'column': index.column,
+        'kind': index.kind,
+        'snapshot': storage_for(table_name).signature(table_name),
+        'log_offset': log_offset,
+        'entries': index.dump(),
+    }
+    atomic_write(_index_path(table_name, index.column),
+                 lambda f: json.dump(payload, f, ensure_ascii=False, separators=(',', ':')))
+
+
+def build_index(table_name, column, table_data, kind='hash', save=True):
+    """
+    Строит индекс по данным таблицы и сохраняет его.
+
+    Args:
+        table_name: Имя таблицы
+        column: Индексируемый столбец
+        table_data: Актуальные данные таблицы
+        kind: Вид индекса ('hash' или 'sorted')
+        save: Сохранить индекс в файл (False - для данных, еще не записанных
+            на диск, например изменений незавершенной транзакции)
+
+    Returns:
+        Объект HashIndex или SortedIndex
+    """
+    index = _INDEX_CLASSES[kind].build(column, table_data)
+    if not save:
+        return index
+    _, log_offset = storage_for(table_name).read_changes(table_name)
+    save_index(table_name, index, log_offset)
+    return index
+
+
+def load_index(table_name, column, table_data, kind='hash'):
+    """
+    Загружает индекс и приводит его в соответствие с таблицей.
+
+    Args:
+        table_name: Имя таблицы
+        column: Индексируемый столбец
+        table_data: Актуальные данные таблицы (используются для перестроения)
+        kind: Вид индекса ('hash' или 'sorted')
+
+    Returns:
+        Объект HashIndex или SortedIndex
+    """
+    storage = storage_for(table_name)
+    try:
+        with open(_index_path(table_name, column), 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        payload = None
+
+    if (payload is None or payload.get('kind', 'hash') != kind
+            or payload.get('snapshot') != storage.signature(table_name)):
+        # Снимок таблицы изменился (или индекс другого вида) - индекс нужно перестроить
+        return build_index(table_name, column, table_data, kind)
+
+    index = _INDEX_CLASSES[kind].restore(column, payload['entries'])
+
+    # Догоняем таблицу по записям журнала, сделанным после сохранения индекса
+    records, _ = storage.read_changes(table_name, payload['log_offset'])
+    for record in records:
+        index.apply(record)
+    return index
+
+
+def drop_index_file(table_name, column):
+    """Удаляет файл индекса, если он существует."""
+    try:
+        os.remove(_index_path(table_name, column))
+    except FileNotFoundError:
+        pass
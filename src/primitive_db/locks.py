@@ -0,0 +1,103 @@
+"""
+Блокировки файлов для одновременной работы нескольких процессов.
+
+Используются рекомендательные блокировки flock: они снимаются
+автоматически при завершении процесса, поэтому аварийно завершенный
+процесс не оставляет таблицу заблокированной. На платформах без fcntl
+(Windows) блокировки не выполняются.
+
+Для каждой таблицы используются два файла блокировок в DATA_DIR:
+- <table>.lock - блокировка записи: её держит процесс, изменяющий таблицу,
+  от чтения данных до сохранения изменений, поэтому изменения таблицы
+  выполняются по очереди, а разные таблицы изменяются параллельно;
+- <table>.data.lock - блокировка файлов: читатели держат её в общем режиме
+  на время команды, а записывающий процесс - в исключительном только
+  пока изменяет файлы таблицы, поэтому читатель всегда видит согласованное
+  состояние таблицы.
+"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from .constants import DATA_DIR, LOCK_TIMEOUT
+
+
+def table_lock_path(table_name):
+    """Возвращает путь к файлу блокировки записи таблицы."""
+    return os.path.join(DATA_DIR, f"{table_name}.lock")
+
+
+def data_lock_path(table_name):
+    """Возвращает путь к файлу блокировки файлов таблицы."""
+    return os.path.join(DATA_DIR, f"{table_name}.data.lock")
+
+
+class FileLock:
+    """
+    Блокировка flock на отдельном файле в общем или исключительном режиме.
+
+    Повторный захват в другом режиме меняет режим уже удерживаемой блокировки.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mode = None  # None, 'shared' или 'exclusive'
+        self._file = None
+
+    def acquire(self, exclusive=False, timeout=LOCK_TIMEOUT):
+        """
+        Захватывает блокировку, ожидая её освобождения другими процессами.
+
+        Args:
+            exclusive: Исключительный режим (иначе общий)
+            timeout: Максимальное время ожидания в секундах
+
+        Returns:
+            Время ожидания в секундах (0.0, если блокировка была свободна)
+
+        Raises:
+            TimeoutError: Если блокировку не удалось получить за timeout секунд
+        """
+        mode = 'exclusive' if exclusive else 'shared'
+        if self.mode == mode or fcntl is None:
+            self.mode = mode
+            return 0.0
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a+b')  # noqa: SIM115 - файл открыт, пока удерживается блокировка
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+
+        # Смена режима в flock не атомарна: пока другой процесс мешает получить
+        # новый режим, прежняя блокировка может быть уже снята
+        start = time.monotonic()
+        delay = 0.001
+        waited = 0.0
+        while True:
+            try:
+                fcntl.flock(self._file.fileno(), operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                waited = time.monotonic() - start
+                if waited >= timeout:
+                    self.release()
+                    raise TimeoutError(f"Не удалось получить блокировку '{self.path}' за {timeout} секунд") from None
+                time.sleep(min(delay, timeout - waited))
+                delay = min(delay * 2, 0.05)
+        self.mode = mode
+        return time.monotonic() - start if waited else 0.0
+
+    def release(self):
+        """Снимает блокировку."""
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._close()
+        self.mode = None
+
+    def _close(self):
+        """Закрывает файл блокировки."""
+        self._file.close()
+        self._file = None
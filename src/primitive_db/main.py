@@ -1,13 +1,75 @@
 #!/usr/bin/env python3
 
-from .engine import run
+import argparse
+import sys
 
+from .constants import SERVER_ADDRESS
+from .decorators import set_confirm_policy
+from .durability import DURABILITY_LEVELS, set_durability
+from .engine import run, run_script
+from .parallel import set_parallel_workers
+from .server import serve
 
-def main():
-    """Точка входа в приложение. Запускает основной цикл программы."""
-    run()
+
+def main(argv=None):
+    """Точка входа в приложение. Запускает основной цикл программы, выполняет скрипт или запускает сервер."""
+    parser = argparse.ArgumentParser(prog='database', description='Простая база данных')
+    parser.add_argument(
+        'mode',
+        nargs='?',
+        choices=['serve'],
+        help='serve - запустить сервер, принимающий команды через сокет',
+    )
+    parser.add_argument(
+        '--listen',
+        metavar='ADDRESS',
+        default=SERVER_ADDRESS,
+        help=f"адрес сервера: unix:<путь> или <хост>:<порт> (по умолчанию {SERVER_ADDRESS})",
+    )
+    parser.add_argument(
+        '--script',
+        metavar='FILE',
+        help="выполнить команды из файла ('-' - из стандартного ввода) без интерактивного режима",
+    )
+    parser.add_argument('--yes', action='store_true', help='автоматически подтверждать опасные операции')
+    parser.add_argument('--report', metavar='FILE', help='сохранить отчет о времени выполнения скрипта в JSON')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        metavar='N',
+        help='число процессов для просмотра больших таблиц по условию без индекса (0 - по числу ядер)',
+    )
+    parser.add_argument(
+        '--durability',
+        choices=DURABILITY_LEVELS,
+        help='когда сбрасывать записанные данные на диск: после каждой записи, в контрольных точках или никогда',
+    )
+    args = parser.parse_args(argv)
+    
+    if args.workers is not None:
+        if args.workers < 0:
+            parser.error('число процессов не может быть отрицательным')
+        set_parallel_workers(args.workers)
+    if args.durability is not None:
+        set_durability(args.durability)
+    
+    if args.mode == 'serve':
+        if args.script is not None:
+            parser.error('режим serve нельзя совмещать с --script')
+        try:
+            serve(args.listen, assume_yes=args.yes)
+        except (ValueError, OSError) as e:
+            parser.exit(1, f"Ошибка: {e}\n")
+    elif args.script is None:
+        if args.yes:
+            set_confirm_policy('yes')
+        run()
+    elif args.script == '-':
+        run_script(sys.stdin, assume_yes=args.yes, report_file=args.report)
+    else:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            run_script(f, assume_yes=args.yes, report_file=args.report)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,295 @@
+"""
+Метрики выполнения и профилирование команд.
+
+Метрики хранятся в памяти процесса:
+- гистограммы времени (команды, функции с log_time, ожидание блокировок)
+  с фиксированными границами корзин, поэтому память не зависит от числа
+  замеров, а процентили p50/p95/p99 оцениваются интерполяцией внутри
+  корзины (как histogram_quantile в Prometheus);
+- счетчики (просмотренные и возвращенные записи, прочитанные и записанные
+  байты файлов данных, загруженные и пропущенные фрагменты таблиц);
+- показатели, которые модули отдают по запросу (например, статистика кэша
+  выборок, см. register_gauges).
+
+Метрики общие для всех потоков процесса (сервер выполняет команды
+соединений в потоках), поэтому изменяются под блокировкой.
+
+Метрики выводятся командой stats и выгружаются в JSON или в текстовый
+формат Prometheus. Команда profile выполняет одну команду под cProfile
+и tracemalloc и выводит самые затратные функции и места выделения памяти.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+
+from .constants import PROFILE_TOP
+
+# Префикс имен метрик в формате Prometheus
+PROMETHEUS_PREFIX = 'primitive_db'
+
+# Форматы выгрузки метрик
+EXPORT_FORMATS = ('json', 'prometheus')
+
+# Верхние границы корзин гистограмм времени: от 10 мкс до ~84 секунд с шагом x2
+_BUCKETS = tuple(1e-5 * 2 ** i for i in range(24))
+
+# Описания метрик для выгрузки в Prometheus
+_DESCRIPTIONS = {
+    'command_seconds': 'Время выполнения команд',
+    'function_seconds': 'Время выполнения функций ядра (log_time)',
+    'lock_wait_seconds': 'Время ожидания блокировок таблиц',
+    'rows_scanned': 'Записи, проверенные при выборке, обновлении и удалении',
+    'rows_returned': 'Записи, возвращенные выборками',
+    'bytes_read': 'Байты, прочитанные из файлов данных',
+    'bytes_written': 'Байты, записанные в файлы данных и метаданных',
+    'chunks_read': 'Фрагменты таблиц, загруженные из файлов',
+    'chunks_skipped': 'Фрагменты таблиц, исключенные из просмотра по картам зон',
+}
+
+_histograms = {}  # (имя, метки) -> Histogram
+_counters = {}  # имя -> значение
+_gauges = {}  # префикс -> функция, возвращающая словарь {имя: число}
+_lock = threading.Lock()  # защищает _histograms и _counters
+
+
+class Histogram:
+    """Гистограмма значений (в секундах) с фиксированными корзинами."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(_BUCKETS) + 1)  # последняя корзина - больше _BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Добавляет значение."""
+        self.buckets[bisect_left(_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Оценивает квантиль q (от 0 до 1) линейной интерполяцией внутри корзины.
+
+        Returns:
+            Значение в секундах или None, если значений нет
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.buckets):
+            if count and cumulative + count >= rank:
+                lower = _BUCKETS[i - 1] if i else 0.0
+                upper = _BUCKETS[i] if i < len(_BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+
+def observe(name, seconds, **labels):
+    """
+    Добавляет замер времени в гистограмму.
+
+    Args:
+        name: Имя метрики, например 'command_seconds'
+        seconds: Время в секундах
+        **labels: Метки гистограммы, например command='select'
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def increment(name, value=1):
+    """Увеличивает счетчик name на value."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def register_gauges(prefix, func):
+    """
+    Регистрирует источник показателей, которые вычисляются при чтении метрик.
+
+    Args:
+        prefix: Префикс имен показателей, например 'select_cache'
+        func: Функция без аргументов, возвращающая словарь {имя: число}
+    """
+    _gauges[prefix] = func
+
+
+def reset():
+    """Сбрасывает гистограммы и счетчики (показатели источников не сбрасываются)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def snapshot():
+    """
+    Возвращает текущие значения метрик.
+
+    Returns:
+        Словарь {'histograms': [...], 'counters': {...}, 'gauges': {...}}, где
+        элемент histograms - {'name', 'labels', 'count', 'sum', 'max', 'p50',
+        'p95', 'p99', 'buckets': [[граница, накопленное число], ...]}
+    """
+    with _lock:
+        histograms = []
+        for (name, labels), histogram in sorted(_histograms.items()):
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(_BUCKETS + (None,), histogram.buckets):
+                cumulative += count
+                buckets.append([bound, cumulative])
+            histograms.append({
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'max': histogram.max,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+                'buckets': buckets,
+            })
+        counters = dict(sorted(_counters.items()))
+    gauges = {}
+    for prefix, func in sorted(_gauges.items()):
+        for name, value in func().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges[f"{prefix}_{name}"] = value
+    return {'histograms': histograms, 'counters': counters, 'gauges': gauges}
+
+
+def _prometheus_labels(labels, **extra):
+    """Форматирует метки Prometheus: {command="select",le="0.01"}."""
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in items.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    """Экранирует значение метки Prometheus."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(data=None):
+    """
+    Возвращает метрики в текстовом формате Prometheus.
+
+    Args:
+        data: Результат snapshot() (None - текущие метрики)
+    """
+    data = snapshot() if data is None else data
+    lines = []
+    described = set()
+
+    def describe(name, kind, suffix=''):
+        full_name = f"{PROMETHEUS_PREFIX}_{name}{suffix}"
+        if full_name not in described:
+            described.add(full_name)
+            if name in _DESCRIPTIONS:
+                lines.append(f"# HELP {full_name} {_DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {full_name} {kind}")
+        return full_name
+
+    for item in data['histograms']:
+        full_name = describe(item['name'], 'histogram')
+        for bound, count in item['buckets']:
+            le = '+Inf' if bound is None else repr(bound)
+            lines.append(f"{full_name}_bucket{_prometheus_labels(item['labels'], le=le)} {count}")
+        lines.append(f"{full_name}_sum{_prometheus_labels(item['labels'])} {item['sum']!r}")
+        lines.append(f"{full_name}_count{_prometheus_labels(item['labels'])} {item['count']}")
+    for name, value in data['counters'].items():
+        lines.append(f"{describe(name, 'counter', '_total')} {value}")
+    for name, value in data['gauges'].items():
+        lines.append(f"{describe(name, 'gauge')} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def export(path, fmt=None):
+    """
+    Выгружает текущие метрики в файл (файл заменяется атомарно, поэтому его
+    можно отдавать сборщику метрик, например textfile collector Prometheus).
+
+    Args:
+        path: Путь к файлу
+        fmt: 'json' или 'prometheus' (None - по расширению: .json - JSON, иначе Prometheus)
+
+    Returns:
+        Использованный формат
+
+    Raises:
+        ValueError: Если формат неизвестен
+    """
+    if fmt is None:
+        fmt = 'json' if path.lower().endswith('.json') else 'prometheus'
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат '{fmt}'. Доступны: {', '.join(EXPORT_FORMATS)}")
+    data = snapshot()
+    content = json.dumps(data, indent=2, ensure_ascii=False) if fmt == 'json' else to_prometheus(data)
+    # Модуль durability сам пишет метрики, поэтому замена файла выполняется здесь
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return fmt
+
+
+def profile(func, limit=PROFILE_TOP):
+    """
+    Выполняет func под cProfile и tracemalloc.
+
+    Args:
+        func: Функция без аргументов
+        limit: Количество строк в каждой части отчета
+
+    Returns:
+        Кортеж (результат func, текст отчета): самые затратные функции
+        по суммарному времени и места, где выделено больше всего памяти
+    """
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            result = func()
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    report = io.StringIO()
+    print(f"Время выполнения под профилировщиком: {elapsed:.3f} секунд, пик памяти: {peak / 1024:.1f} КБ.",
+          file=report)
+    print(f"\nФункции с наибольшим суммарным временем (топ {limit}):", file=report)
+    stats = pstats.Stats(profiler, stream=report)
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    print(f"Места выделения памяти, которая осталась занятой (топ {limit}):", file=report)
+    allocations = memory.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+    for statistic in allocations[:limit]:
+        print(f"  {statistic}", file=report)
+    if not allocations:
+        print("  нет", file=report)
+    return result, report.getvalue().rstrip('\n')
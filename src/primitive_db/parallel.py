@@ -0,0 +1,238 @@
+"""
+Параллельный просмотр таблицы для условий без подходящего индекса.
+
+Столбцы, которые использует условие, копируются в разделяемую память
+(multiprocessing.shared_memory) в компактном виде: целые числа - массивом
+64-битных значений, логические значения колоночной таблицы - битовой картой,
+остальные - массивом кодов и списком различных значений. Процессы пула
+подключаются к этим блокам по имени и проверяют условие на своих частях
+таблицы, поэтому записи-словари между процессами не передаются.
+
+Скопированные столбцы остаются в разделяемой памяти, пока таблица не
+изменится (см. атрибут version таблиц) или не будет освобождена: повторные
+запросы к неизменной таблице не выгружают столбцы заново.
+
+Режим включается явно (set_parallel_workers или параметр --workers)
+и используется только для таблиц от PARALLEL_MIN_ROWS записей.
+"""
+import atexit
+import os
+import weakref
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from .constants import PARALLEL_MIN_ROWS, PARALLEL_WORKERS
+from .predicate import compile_where, where_columns
+
+# Формат элементов буфера для каждого способа кодирования столбца
+_FORMATS = {
+    'int': 'q',
+    'bits': 'B',
+    'codes': 'I',
+}
+
+# Настроенное число процессов и пул процессов (создается при первом использовании)
+_workers = PARALLEL_WORKERS
+_executor = None
+_executor_workers = 0
+
+# Столбцы таблиц в разделяемой памяти: id(таблицы) -> _SharedTable
+_shared = {}
+
+
+def set_parallel_workers(workers):
+    """
+    Задает число процессов для параллельного просмотра.
+
+    Args:
+        workers: Число процессов (1 - последовательный просмотр,
+            0 - по числу ядер процессора)
+    """
+    global _workers
+    if workers < 0:
+        raise ValueError("Число процессов не может быть отрицательным")
+    _workers = workers
+
+
+def parallel_workers(rows):
+    """Возвращает число процессов для просмотра таблицы из rows записей (1 - последовательно)."""
+    workers = _workers or os.cpu_count() or 1
+    if workers <= 1 or rows < PARALLEL_MIN_ROWS:
+        return 1
+    return workers
+
+
+def _get_executor(workers):
+    """Возвращает пул процессов (пересоздается при изменении числа процессов)."""
+    global _executor, _executor_workers
+    if _executor is not None and _executor_workers != workers:
+        _executor.shutdown()
+        _executor = None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+
+def _share_column(table_data, column):
+    """
+    Копирует столбец в разделяемую память.
+
+    Returns:
+        Кортеж (блок разделяемой памяти, описание столбца для процессов пула)
+        или (None, None), если столбца нет в таблице
+    """
+    exported = table_data.export_column(column)
+    if exported is None:
+        return None, None
+    encoding, buffer, values = exported
+    # Представление буфера освобождается сразу, иначе массив столбца нельзя будет изменить
+    with memoryview(buffer) as view, view.cast('B') as data:
+        size = len(data)
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        block.buf[:size] = data
+    return block, (encoding, block.name, size, values)
+
+
+class _SharedTable:
+    """Столбцы одной версии таблицы, скопированные в разделяемую память."""
+
+    def __init__(self, table_data):
+        key = id(table_data)
+        # Блоки освобождаются вместе с таблицей (например, после загрузки новой версии из файла)
+        self.ref = weakref.ref(table_data, lambda _: _release(key))
+        self.version = table_data.version
+        self.blocks = []
+        self.descriptions = {}  # столбец -> описание для процессов пула
+
+    def current(self, table_data):
+        """Проверяет, что столбцы скопированы из этой таблицы и она с тех пор не изменялась."""
+        return self.ref() is table_data and self.version == table_data.version
+
+    def close(self):
+        """Освобождает блоки разделяемой памяти."""
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+        self.descriptions.clear()
+
+
+def _release(key):
+    """Освобождает столбцы таблицы в разделяемой памяти."""
+    shared = _shared.pop(key, None)
+    if shared is not None:
+        shared.close()
+
+
+@atexit.register
+def release_shared():
+    """Освобождает все столбцы в разделяемой памяти."""
+    for key in list(_shared):
+        _release(key)
+
+
+def _shared_columns(table_data, columns):
+    """
+    Возвращает описания столбцов таблицы в разделяемой памяти.
+
+    Столбцы текущей версии таблицы копируются один раз; после изменения
+    таблицы прежние блоки освобождаются и столбцы копируются заново.
+    """
+    key = id(table_data)
+    shared = _shared.get(key)
+    if shared is not None and not shared.current(table_data):
+        _release(key)
+        shared = None
+    if shared is None:
+        shared = _shared[key] = _SharedTable(table_data)
+    for column in columns:
+        if column not in shared.descriptions:
+            block, description = _share_column(table_data, column)
+            if block is not None:
+                shared.blocks.append(block)
+                shared.descriptions[column] = description
+    return {column: shared.descriptions[column] for column in columns if column in shared.descriptions}
+
+
+class _SharedColumns:
+    """Столбцы таблицы в разделяемой памяти с интерфейсом getter, как у таблиц."""
+
+    def __init__(self, descriptions):
+        self.blocks = []
+        self.views = []
+        self.getters = {}
+        for column, (encoding, name, nbytes, values) in descriptions.items():
+            block = shared_memory.SharedMemory(name=name, track=False)
+            self.blocks.append(block)
+            view = block.buf[:nbytes]
+            self.views.append(view)
+            items = view.cast(_FORMATS[encoding])
+            self.views.append(items)
+            self.getters[column] = (encoding, items, values)
+
+    def getter(self, column, default=None):
+        """Возвращает функцию position -> значение столбца."""
+        if column not in self.getters:
+            return lambda position: default
+        encoding, items, values = self.getters[column]
+        if encoding == 'int':
+            return items.__getitem__
+        if encoding == 'bits':
+            return lambda position: bool(items[position >> 3] >> (position & 7) & 1)
+        # Отсутствующее значение (None) заменяется на default
+        values = [default if value is None else value for value in values]
+        return lambda position: values[items[position]]
+
+    def close(self):
+        """Освобождает буферы и отключается от разделяемой памяти."""
+        self.getters.clear()
+        for view in reversed(self.views):
+            view.release()
+        for block in self.blocks:
+            block.close()
+
+
+def _scan_chunk(descriptions, expression, start, stop):
+    """Проверяет условие для позиций [start, stop) в процессе пула и возвращает подходящие позиции."""
+    columns = _SharedColumns(descriptions)
+    try:
+        predicate = compile_where(expression, columns)
+        return array('q', (i for i in range(start, stop) if predicate(i))).tobytes()
+    finally:
+        columns.close()
+
+
+def parallel_scan(table_data, expression, workers):
+    """
+    Находит позиции записей, удовлетворяющих условию, в нескольких процессах.
+
+    Args:
+        table_data: Данные таблицы (TableData или ColumnarTable)
+        expression: Дерево выражения (см. predicate.bind_where)
+        workers: Число процессов
+
+    Returns:
+        Список позиций в порядке следования записей в таблице
+        или None, если пул процессов недоступен (нужен последовательный просмотр)
+    """
+    rows = len(table_data)
+    if not rows:
+        return []
+    try:
+        descriptions = _shared_columns(table_data, where_columns(expression))
+
+        # Частей больше, чем процессов, чтобы процессы загружались равномерно
+        chunk = -(-rows // (workers * 4))
+        starts = range(0, rows, chunk)
+        executor = _get_executor(workers)
+        results = executor.map(_scan_chunk, [descriptions] * len(starts), [expression] * len(starts),
+                               starts, [min(start + chunk, rows) for start in starts])
+        positions = array('q')
+        for result in results:
+            positions.frombytes(result)
+        return positions.tolist()
+    except (OSError, BrokenProcessPool):
+        return None
@@ -1,56 +1,276 @@
 """
 Парсеры для разбора условий WHERE и SET в SQL-подобных командах.
 """
+import re
+import shlex
 
+# Лексемы условия WHERE: строка в кавычках, оператор или слово
+_TOKEN_RE = re.compile(r"""\s*(?:('[^']*'|"[^"]*")|(<=|>=|!=|<>|=|<|>|\(|\)|,)|([^<>=!(),'"]+))""")
 
-def parse_where_clause(where_str):
+# Элемент списка выборки с агрегатами: функция(столбец или *) или имя столбца
+_AGGREGATE_RE = re.compile(r"^\s*(?:(\w+)\s*\(\s*(\*|\w+)\s*\)|(\w+))\s*$")
+
+# Ключевые слова условия WHERE
+_KEYWORDS = {'and', 'or', 'not', 'in', 'between'}
+
+# Разделы команды SELECT, которыми заканчивается условие WHERE
+_SELECT_CLAUSES = {'order', 'limit', 'offset'}
+
+# Операторы сравнения ('<>' - синоним '!=')
+_COMPARISONS = {'=', '!=', '<>', '<', '<=', '>', '>='}
+
+
+class Placeholder:
     """
-    Парсит строку условия WHERE в словарь.
+    Параметр подготовленной команды: знак ? на месте значения.
     
-    Примеры:
-        "age = 28" -> {'age': 28}
-        "name = 'John'" -> {'name': 'John'}
-        "active = true" -> {'active': True}
+    Attributes:
+        index: Номер параметра (с нуля) в порядке следования в тексте команды
+        column: Столбец, с которым сравнивается или которому присваивается значение
+            ('limit' и 'offset' - для параметров LIMIT и OFFSET)
+    """
     
-    Args:
-        where_str: Строка условия, например "age = 28"
+    __slots__ = ('column', 'index')
     
-    Returns:
-        Словарь вида {'column': value} или None при ошибке
-    """
-    if not where_str:
+    def __init__(self, index, column):
+        self.index = index
+        self.column = column
+    
+    def __repr__(self):
+        return f"?{self.index + 1}"
+
+
+def _placeholder(placeholders, column):
+    """Создает параметр с очередным номером и добавляет его в список placeholders."""
+    placeholder = Placeholder(len(placeholders), column)
+    placeholders.append(placeholder)
+    return placeholder
+
+
+def _parse_value(value_str):
+    """Преобразует строковое значение в str, bool или int."""
+    # Строки в кавычках
+    if value_str.startswith("'") and value_str.endswith("'") and len(value_str) >= 2:
+        return value_str[1:-1]
+    if value_str.startswith('"') and value_str.endswith('"') and len(value_str) >= 2:
+        return value_str[1:-1]
+    # Булевы значения
+    if value_str.lower() == 'true':
+        return True
+    if value_str.lower() == 'false':
+        return False
+    # Целые числа
+    if value_str.isdigit() or (value_str.startswith('-') and value_str[1:].isdigit()):
+        return int(value_str)
+    # Попытка как строка без кавычек (для обратной совместимости)
+    return value_str
+
+
+def _parse_assignment(assignment_str):
+    """Парсит строку вида "column = value" в словарь {'column': value} или None."""
+    if not assignment_str:
         return None
     
     # Разбиваем по '='
-    parts = where_str.split('=', 1)
+    parts = assignment_str.split('=', 1)
     if len(parts) != 2:
         return None
     
     column = parts[0].strip()
-    value_str = parts[1].strip()
+    value = _parse_value(parts[1].strip())
+    return {column: value}
+
+
+def _tokenize_where(where):
+    """
+    Разбивает условие WHERE на лексемы.
     
-    # Обработка значений
-    # Строки в кавычках
-    if value_str.startswith("'") and value_str.endswith("'"):
-        value = value_str[1:-1]
-    elif value_str.startswith('"') and value_str.endswith('"'):
-        value = value_str[1:-1]
-    # Булевы значения
-    elif value_str.lower() == 'true':
-        value = True
-    elif value_str.lower() == 'false':
-        value = False
-    # Целые числа
-    elif value_str.isdigit() or (value_str.startswith('-') and value_str[1:].isdigit()):
-        value = int(value_str)
-    else:
-        # Попытка как строка без кавычек (для обратной совместимости)
-        value = value_str
+    Args:
+        where: Строка условия или список слов команды (уже разобранных shlex)
     
-    return {column: value}
+    Returns:
+        Список пар (вид, текст), где вид - 'value', 'op', 'keyword' или 'word';
+        None при ошибке
+    """
+    if isinstance(where, str):
+        # Кавычки сохраняются, чтобы '30' осталось строкой
+        lexer = shlex.shlex(where, posix=False)
+        lexer.whitespace_split = True
+        try:
+            where = list(lexer)
+        except ValueError:
+            return None
+    
+    tokens = []
+    for part in where:
+        position = 0
+        while position < len(part):
+            match = _TOKEN_RE.match(part, position)
+            if match is None:
+                return None
+            position = match.end()
+            quoted, operator, word = match.groups()
+            if quoted is not None:
+                tokens.append(('value', quoted[1:-1]))
+            elif operator is not None:
+                tokens.append(('op', '!=' if operator == '<>' else operator))
+            elif word.strip():
+                word = word.strip()
+                if word.lower() in _KEYWORDS:
+                    tokens.append(('keyword', word.lower()))
+                else:
+                    tokens.append(('word', word))
+    return tokens
 
 
-def parse_set_clause(set_str):
+class _WhereParser:
+    """
+    Рекурсивный разбор условия WHERE.
+    
+    Грамматика:
+        выражение := и_выражение ('or' и_выражение)*
+        и_выражение := отрицание ('and' отрицание)*
+        отрицание := 'not' отрицание | '(' выражение ')' | условие
+        условие := столбец оператор значение
+                 | столбец ['not'] 'in' '(' значение (',' значение)* ')'
+                 | столбец ['not'] 'between' значение 'and' значение
+    """
+
+    def __init__(self, tokens, placeholders=None):
+        self.tokens = tokens
+        self.position = 0
+        self.placeholders = placeholders
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (text and token[1] != text):
+            raise ValueError(f"неожиданная лексема {token[1]!r}")
+        self.position += 1
+        return token
+
+    def accept(self, kind, text):
+        if self.peek() == (kind, text):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        expression = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"неожиданная лексема {self.peek()[1]!r}")
+        return expression
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.accept('keyword', 'or'):
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else ('or', tuple(operands))
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.accept('keyword', 'and'):
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else ('and', tuple(operands))
+
+    def parse_not(self):
+        if self.accept('keyword', 'not'):
+            return ('not', self.parse_not())
+        if self.accept('op', '('):
+            expression = self.parse_or()
+            self.take('op', ')')
+            return expression
+        return self.parse_condition()
+
+    def parse_value(self, column):
+        kind, text = self.take()
+        if kind == 'value':
+            return text
+        if kind == 'word':
+            if text == '?' and self.placeholders is not None:
+                return _placeholder(self.placeholders, column)
+            return _parse_value(text)
+        raise ValueError(f"ожидалось значение, получено {text!r}")
+
+    def parse_condition(self):
+        column = self.take('word')[1]
+        negate = self.accept('keyword', 'not')
+        if self.accept('keyword', 'in'):
+            self.take('op', '(')
+            values = [self.parse_value(column)]
+            while self.accept('op', ','):
+                values.append(self.parse_value(column))
+            self.take('op', ')')
+            condition = ('in', column, tuple(values))
+        elif self.accept('keyword', 'between'):
+            low = self.parse_value(column)
+            self.take('keyword', 'and')
+            condition = ('between', column, low, self.parse_value(column))
+        elif negate:
+            raise ValueError("после 'not' ожидалось 'in' или 'between'")
+        else:
+            operator = self.take('op')[1]
+            if operator not in _COMPARISONS:
+                raise ValueError(f"неизвестный оператор {operator!r}")
+            condition = ('cmp', column, operator, self.parse_value(column))
+        return ('not', condition) if negate else condition
+
+
+def _as_equality_dict(expression):
+    """Возвращает словарь {столбец: значение}, если условие - конъюнкция равенств, иначе None."""
+    operands = expression[1] if expression[0] == 'and' else (expression,)
+    result = {}
+    for operand in operands:
+        if operand[0] != 'cmp' or operand[2] != '=' or operand[1] in result:
+            return None
+        result[operand[1]] = operand[3]
+    return result
+
+
+def parse_where_clause(where, placeholders=None):
+    """
+    Парсит условие WHERE.
+    
+    Поддерживаются операторы =, !=, <, <=, >, >=, in (...), between ... and ...,
+    логические связки and, or, not и скобки.
+    
+    Примеры:
+        "age = 28" -> {'age': 28}
+        "name = 'John'" -> {'name': 'John'}
+        "active = true and age = 28" -> {'active': True, 'age': 28}
+        "age > 28" -> ('cmp', 'age', '>', 28)
+        "age between 20 and 30 or name in ('A', 'B')" ->
+            ('or', (('between', 'age', 20, 30), ('in', 'name', ('A', 'B'))))
+    
+    Args:
+        where: Строка условия или список слов команды после 'where'
+        placeholders: Список параметров подготовленной команды: если указан,
+            знак ? без кавычек становится параметром (Placeholder) и добавляется в список
+    
+    Returns:
+        Словарь вида {'column': value}, если условие - только равенства,
+        соединенные and; иначе дерево выражения из кортежей.
+        None при ошибке
+    """
+    if not where:
+        return None
+    tokens = _tokenize_where(where)
+    if not tokens:
+        return None
+    try:
+        expression = _WhereParser(tokens, placeholders).parse()
+    except ValueError:
+        return None
+    
+    equalities = _as_equality_dict(expression)
+    return equalities if equalities is not None else expression
+
+
+def parse_set_clause(set_str, placeholders=None):
     """
     Парсит строку условия SET в словарь.
     
@@ -61,10 +281,136 @@ def parse_set_clause(set_str):
     
     Args:
         set_str: Строка условия, например "age = 30"
+        placeholders: Список параметров подготовленной команды (см. parse_where_clause)
     
     Returns:
         Словарь вида {'column': value} или None при ошибке
     """
-    # SET использует тот же формат, что и WHERE
-    return parse_where_clause(set_str)
+    assignment = _parse_assignment(set_str)
+    if assignment is not None and placeholders is not None:
+        column, value = next(iter(assignment.items()))
+        if value == '?' and set_str.split('=', 1)[1].strip() == '?':
+            assignment[column] = _placeholder(placeholders, column)
+    return assignment
+
+
+def parse_select_args(tokens, placeholders=None):
+    """
+    Парсит необязательную часть команды SELECT после имени таблицы.
+    
+    Примеры:
+        [] -> {'where': None, 'order_by': None, 'limit': None, 'offset': 0}
+        ['where', 'age=28', 'limit', '10'] -> {'where': {'age': 28}, 'order_by': None, 'limit': 10, 'offset': 0}
+        ['where', 'age', '>', '28'] -> {'where': ('cmp', 'age', '>', 28), ...}
+        ['order', 'by', 'age', 'desc'] -> {'where': None, 'order_by': ('age', True), ...}
+        ['limit', '10', 'offset', '20'] -> {'where': None, 'order_by': None, 'limit': 10, 'offset': 20}
+    
+    Args:
+        tokens: Список слов команды после имени таблицы
+        placeholders: Список параметров подготовленной команды (см. parse_where_clause);
+            параметрами могут быть и значения LIMIT и OFFSET
+    
+    Returns:
+        Словарь с ключами 'where', 'order_by' (кортеж (столбец, по убыванию)),
+        'limit', 'offset' или None при ошибке
+    """
+    options = {'where': None, 'order_by': None, 'limit': None, 'offset': 0}
+    i = 0
+    while i < len(tokens):
+        keyword = tokens[i].lower()
+        if i + 1 >= len(tokens):
+            return None
+        argument = tokens[i + 1]
+        
+        if keyword == 'where':
+            # Условие продолжается до следующего раздела команды
+            end = i + 1
+            while end < len(tokens) and tokens[end].lower() not in _SELECT_CLAUSES:
+                end += 1
+            options['where'] = parse_where_clause(tokens[i + 1:end], placeholders)
+            if options['where'] is None:
+                return None
+            i = end
+            continue
+        elif keyword == 'order':
+            if argument.lower() != 'by' or i + 2 >= len(tokens):
+                return None
+            column = tokens[i + 2]
+            direction = tokens[i + 3].lower() if i + 3 < len(tokens) else None
+            if direction in ('asc', 'desc'):
+                options['order_by'] = (column, direction == 'desc')
+                i += 4
+            else:
+                options['order_by'] = (column, False)
+                i += 3
+            continue
+        elif keyword in ('limit', 'offset'):
+            if argument == '?' and placeholders is not None:
+                options[keyword] = _placeholder(placeholders, keyword)
+            elif not argument.isdigit():
+                return None
+            else:
+                options[keyword] = int(argument)
+        else:
+            return None
+        i += 2
+    return options
+
+
+def parse_aggregate_args(tokens):
+    """
+    Парсит команду SELECT с агрегатными функциями (после слова select).
+    
+    Примеры:
+        ['count(*)', 'from', 'users'] ->
+            {'items': [('count', '*')], 'table': 'users', 'where': None, 'group_by': []}
+        ['active,', 'count(*),', 'avg(age)', 'from', 'users', 'group', 'by', 'active'] ->
+            {'items': [(None, 'active'), ('count', '*'), ('avg', 'age')], 'table': 'users',
+             'where': None, 'group_by': ['active']}
+    
+    Args:
+        tokens: Список слов команды после 'select'
+    
+    Returns:
+        Словарь с ключами 'items' (пары (функция, столбец); для столбцов группировки
+        функция - None), 'table', 'where', 'group_by' или None при ошибке
+    """
+    lowered = [token.lower() for token in tokens]
+    if 'from' not in lowered:
+        return None
+    from_position = lowered.index('from')
+    if from_position + 1 >= len(tokens):
+        return None
+    
+    # Список выражений: count(*), sum(age), active, ...
+    items = []
+    for item in ' '.join(tokens[:from_position]).split(','):
+        match = _AGGREGATE_RE.match(item)
+        if match is None:
+            return None
+        function, argument, column = match.groups()
+        items.append((function.lower(), argument) if function else (None, column))
+    
+    options = {'items': items, 'table': tokens[from_position + 1], 'where': None, 'group_by': []}
+    rest = tokens[from_position + 2:]
+    i = 0
+    while i < len(rest):
+        keyword = rest[i].lower()
+        if keyword == 'where' and i + 1 < len(rest):
+            end = i + 1
+            while end < len(rest) and rest[end].lower() != 'group':
+                end += 1
+            options['where'] = parse_where_clause(rest[i + 1:end])
+            if options['where'] is None:
+                return None
+            i = end
+        elif keyword == 'group' and i + 2 < len(rest) and rest[i + 1].lower() == 'by':
+            columns = [column.strip() for column in ' '.join(rest[i + 2:]).split(',')]
+            if not all(columns):
+                return None
+            options['group_by'] = columns
+            break
+        else:
+            return None
+    return options
 
@@ -0,0 +1,451 @@
+"""
+Планировщик запросов.
+
+Для условия WHERE (и сортировки ORDER BY) планировщик выбирает способ доступа
+к записям: полный просмотр, поиск по ID, поиск по индексу, просмотр диапазона
+упорядоченного индекса или просмотр столбца колоночной таблицы. Выбор
+делается по оценке стоимости, которая строится по числу записей таблицы,
+индексам и статистике из метаданных (собирается командой analyze).
+У таблиц, хранящихся фрагментами, полный просмотр пропускает фрагменты,
+которые исключаются картами зон (см. chunked.ChunkedTable.prune).
+
+План - словарь, который затем исполняется функцией run_plan и может быть
+выведен командой explain (format_plan).
+"""
+import math
+
+from .metrics import increment
+from .parallel import parallel_scan, parallel_workers
+from .predicate import MISSING, bind_where, compile_where
+
+# Доля записей, подходящих под равенство, если число различных значений неизвестно
+DEFAULT_EQ_SELECTIVITY = 0.1
+
+# Доля записей, подходящих под одностороннее и двустороннее условие диапазона,
+# если распределение значений неизвестно
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+DEFAULT_BETWEEN_SELECTIVITY = 1 / 5
+
+# Относительная стоимость проверки одной записи при просмотре столбца
+# колоночной таблицы (без сборки записи)
+COLUMN_SCAN_COST = 0.25
+
+# Названия способов доступа для вывода explain
+ACCESS_NAMES = {
+    'full_scan': 'полный просмотр таблицы',
+    'id_lookup': 'поиск по ID',
+    'index_probe': 'поиск по индексу',
+    'range_scan': 'просмотр диапазона индекса',
+    'index_scan': 'просмотр индекса по порядку',
+    'column_scan': 'просмотр столбца',
+}
+
+
+def collect_stats(table_data, columns):
+    """
+    Собирает статистику таблицы для планировщика.
+
+    Args:
+        table_data: Данные таблицы
+        columns: Схема таблицы [('ID', 'int'), ('name', 'str'), ...]
+
+    Returns:
+        Словарь {'rows': число записей, 'distinct': {столбец: число различных значений},
+        'min': {столбец: минимум}, 'max': {столбец: максимум}} (минимум и максимум -
+        только для столбцов int)
+    """
+    stats = {'rows': len(table_data), 'distinct': {}, 'min': {}, 'max': {}}
+    for column, col_type in columns:
+        get = table_data.getter(column, MISSING)
+        values = {get(i) for i in table_data.row_positions()}
+        values.discard(MISSING)
+        values.discard(None)
+        stats['distinct'][column] = len(values)
+        if col_type == 'int' and values:
+            stats['min'][column] = min(values)
+            stats['max'][column] = max(values)
+    return stats
+
+
+def conjuncts(expression):
+    """Возвращает части условия, соединенные через and."""
+    return expression[1] if expression[0] == 'and' else (expression,)
+
+
+def range_bounds(expression, column):
+    """
+    Находит границы значений столбца, заданные условием.
+
+    Учитываются сравнения и BETWEEN по столбцу, соединенные с остальной
+    частью условия через and.
+
+    Returns:
+        Кортеж (нижняя граница, верхняя граница, включать нижнюю, включать верхнюю)
+        или None, если условие не ограничивает столбец
+    """
+    low = high = None
+    include_low = include_high = True
+    found = False
+    for operand in conjuncts(expression):
+        if operand[0] not in ('cmp', 'between') or operand[1] != column:
+            continue
+        if operand[0] == 'between':
+            lower, upper = [(operand[2], True)], [(operand[3], True)]
+        else:
+            op, value = operand[2], operand[3]
+            lower = [(value, op == '>=' or op == '=')] if op in ('>', '>=', '=') else []
+            upper = [(value, op == '<=' or op == '=')] if op in ('<', '<=', '=') else []
+        try:
+            for value, inclusive in lower:
+                if low is None or value > low or (value == low and not inclusive):
+                    low, include_low = value, inclusive
+            for value, inclusive in upper:
+                if high is None or value < high or (value == high and not inclusive):
+                    high, include_high = value, inclusive
+        except TypeError:
+            return None
+        found = found or bool(lower or upper)
+    if not found:
+        return None
+    return low, high, include_low, include_high
+
+
+class _Estimator:
+    """Оценка доли записей, подходящих под условия, по индексам и статистике."""
+
+    def __init__(self, table_rows, indexes, stats, column_types):
+        self.table_rows = table_rows
+        self.indexes = indexes
+        self.stats = stats or {}
+        self.column_types = column_types or {}
+
+    def distinct(self, column):
+        """Число различных значений столбца или None, если оно неизвестно."""
+        if column == 'ID':
+            return max(self.table_rows, 1)
+        index = self.indexes.get(column)
+        if index is not None and hasattr(index, 'entries'):
+            return max(len(index.entries), 1)
+        known = self.stats.get('distinct', {}).get(column)
+        if known:
+            return min(known, max(self.table_rows, 1))
+        if self.column_types.get(column) == 'bool':
+            return 2
+        return None
+
+    def equality(self, column):
+        """Доля записей с одним конкретным значением столбца."""
+        distinct = self.distinct(column)
+        return 1 / distinct if distinct else DEFAULT_EQ_SELECTIVITY
+
+    def range(self, column, bounds):
+        """Доля записей со значениями столбца в диапазоне."""
+        low, high, include_low, include_high = bounds
+        if low is not None and high is not None and low == high:
+            return self.equality(column)
+        minimum = self.stats.get('min', {}).get(column)
+        maximum = self.stats.get('max', {}).get(column)
+        numeric = all(isinstance(value, int) and not isinstance(value, bool)
+                      for value in (low, high, minimum, maximum) if value is not None)
+        if minimum is not None and maximum is not None and numeric:
+            # Равномерное распределение между минимумом и максимумом
+            span = maximum - minimum + 1
+            start = minimum if low is None else max(low + (0 if include_low else 1), minimum)
+            stop = maximum if high is None else min(high - (0 if include_high else 1), maximum)
+            return max(stop - start + 1, 0) / span
+        if low is not None and high is not None:
+            return DEFAULT_BETWEEN_SELECTIVITY
+        return DEFAULT_RANGE_SELECTIVITY
+
+    def selectivity(self, expression):
+        """Доля записей, удовлетворяющих условию."""
+        kind = expression[0]
+        if kind == 'and':
+            result = 1.0
+            for operand in expression[1]:
+                result *= self.selectivity(operand)
+            return result
+        if kind == 'or':
+            result = 0.0
+            for operand in expression[1]:
+                part = self.selectivity(operand)
+                result = result + part - result * part
+            return result
+        if kind == 'not':
+            return 1 - self.selectivity(expression[1])
+        if kind == 'in':
+            return min(1.0, len(set(expression[2])) * self.equality(expression[1]))
+        if kind == 'between':
+            return self.range(expression[1], (expression[2], expression[3], True, True))
+        op = expression[2]
+        if op == '=':
+            return self.equality(expression[1])
+        if op == '!=':
+            return 1 - self.equality(expression[1])
+        bounds = range_bounds(expression, expression[1])
+        return self.range(expression[1], bounds) if bounds else DEFAULT_RANGE_SELECTIVITY
+
+
+def _sort_cost(count):
+    """Стоимость сортировки count записей."""
+    return count * math.log2(count + 1)
+
+
+def plan_query(table_data, where_clause=None, indexes=None, column_types=None, order_by=None,
+               limit=None, offset=0, stats=None):
+    """
+    Выбирает способ выполнения выборки.
+
+    Args:
+        table_data: Данные таблицы
+        where_clause: Словарь равенств, дерево выражения или None
+        indexes: Словарь {столбец: индекс} с доступными индексами
+        column_types: Словарь {столбец: тип} для приведения значений условия
+        order_by: Кортеж (столбец, по убыванию) или None
+        limit: Максимальное количество записей (None - без ограничения)
+        offset: Количество пропускаемых записей
+        stats: Статистика таблицы (см. collect_stats) или None
+
+    Returns:
+        Словарь плана: способ доступа ('access'), столбец и значения или границы,
+        способ сортировки ('order': None, 'index' или 'sort'), число процессов
+        для параллельного просмотра ('workers', если он используется), номера
+        просматриваемых фрагментов ('chunks', если часть фрагментов исключена
+        картами зон), оценки числа проверяемых записей, результата и стоимости
+    """
+    indexes = indexes or {}
+    rows = len(table_data)
+    expression = bind_where(where_clause, column_types) if where_clause else None
+    estimator = _Estimator(rows, indexes, stats, column_types)
+    selectivity = estimator.selectivity(expression) if expression else 1.0
+    estimated_rows = rows * selectivity
+
+    # Фрагменты, которые не исключаются картами зон, - только их просматривает полный просмотр
+    chunks = table_data.prune(expression) if expression is not None and hasattr(table_data, 'prune') else None
+    scan_rows = rows if chunks is None else table_data.chunk_rows_count(chunks)
+
+    # Варианты доступа: (стоимость, план)
+    options = [(float(scan_rows), {'access': 'full_scan', 'candidates': scan_rows})]
+    for operand in conjuncts(expression) if expression else ():
+        if operand[0] == 'cmp' and operand[2] == '=':
+            column, values = operand[1], (operand[3],)
+        elif operand[0] == 'in':
+            column, values = operand[1], tuple(dict.fromkeys(operand[2]))
+        else:
+            continue
+        if column == 'ID':
+            options.append((len(values), {
+                'access': 'id_lookup', 'column': column, 'values': values, 'candidates': len(values)}))
+        elif column in indexes and all(
+                not hasattr(indexes[column], 'accepts') or indexes[column].accepts(value) for value in values):
+            candidates = rows * min(1.0, len(values) * estimator.equality(column))
+            options.append((len(values) + _sort_cost(candidates) / 10 + candidates, {
+                'access': 'index_probe', 'column': column, 'index': indexes[column].kind,
+                'values': values, 'candidates': candidates}))
+        elif len(values) == 1 and hasattr(table_data, 'scan'):
+            candidates = rows * estimator.equality(column)
+            options.append((rows * COLUMN_SCAN_COST + candidates, {
+                'access': 'column_scan', 'column': column, 'values': values, 'candidates': candidates}))
+    for column, index in indexes.items():
+        bounds = range_bounds(expression, column) if expression and hasattr(index, 'range') else None
+        if bounds is None or not all(index.accepts(value) for value in bounds[:2] if value is not None):
+            continue
+        candidates = rows * estimator.range(column, bounds)
+        options.append((math.log2(rows + 1) + candidates + _sort_cost(candidates) / 10, {
+            'access': 'range_scan', 'column': column, 'index': index.kind,
+            'bounds': bounds, 'candidates': candidates}))
+
+    needed = None if limit is None else offset + limit
+    if order_by:
+        # Без индекса по столбцу сортировки подходящие записи сортируются
+        options = [(cost + _sort_cost(min(estimated_rows, plan['candidates'])), {**plan, 'order': 'sort'})
+                   for cost, plan in options]
+        column, _ = order_by
+        index = indexes.get(column)
+        if hasattr(index, 'range'):
+            bounds = range_bounds(expression, column) if expression else None
+            if bounds is not None and not all(index.accepts(value) for value in bounds[:2] if value is not None):
+                bounds = None
+            candidates = rows * estimator.range(column, bounds) if bounds else rows
+            cost = candidates
+            if needed is not None and estimated_rows > 0:
+                # Перебор по индексу останавливается, как только набрано limit записей
+                cost = min(candidates, needed * candidates / estimated_rows)
+            options.append((cost, {
+                'access': 'range_scan' if bounds else 'index_scan', 'column': column, 'index': index.kind,
+                'bounds': bounds, 'candidates': candidates, 'order': 'index'}))
+    elif needed is not None and estimated_rows > 0:
+        # Перебор останавливается после limit подходящих записей
+        options = [(min(cost, cost * needed / estimated_rows), plan) for cost, plan in options]
+
+    cost, plan = min(options, key=lambda option: option[0])
+    plan.setdefault('order', None)
+    if plan['access'] == 'full_scan' and chunks is not None and len(chunks) < table_data.chunk_count:
+        plan['chunks'] = chunks
+        plan['table_chunks'] = table_data.chunk_count
+    elif plan['access'] == 'full_scan' and expression is not None and (needed is None or plan['order'] == 'sort'):
+        # Полный просмотр без раннего останова можно разделить между процессами
+        workers = parallel_workers(rows)
+        if workers > 1:
+            plan['workers'] = workers
+    plan.update({
+        'expression': expression,
+        'order_by': order_by,
+        'table_rows': rows,
+        'estimated_candidates': plan.pop('candidates'),
+        'estimated_rows': estimated_rows if needed is None else min(estimated_rows, needed),
+        'cost': cost,
+    })
+    return plan
+
+
+def _sort_key(value):
+    """Ключ сортировки: записи без значения идут после остальных."""
+    if value is MISSING or value is None:
+        return (True, 0)
+    return (False, value)
+
+
+def _access_positions(table_data, plan, indexes):
+    """Возвращает позиции записей-кандидатов согласно способу доступа плана."""
+    access = plan['access']
+    positions = table_data.positions
+    if access == 'id_lookup':
+        return sorted({positions[value] for value in plan['values'] if value in positions})
+    if access == 'index_probe':
+        index = indexes[plan['column']]
+        ids = set().union(*(index.lookup(value) for value in plan['values']))
+        return sorted(positions[row_id] for row_id in ids if row_id in positions)
+    if access in ('range_scan', 'index_scan'):
+        index = indexes[plan['column']]
+        descending = plan['order'] == 'index' and plan['order_by'][1]
+        ids = index.range(*(plan['bounds'] or ()), reverse=descending)
+        if plan['order'] == 'index':
+            # Записи выдаются в порядке индекса
+            return (positions[row_id] for row_id in ids if row_id in positions)
+        return sorted(positions[row_id] for row_id in ids if row_id in positions)
+    if access == 'column_scan':
+        return table_data.scan(plan['column'], plan['values'][0])
+    if 'chunks' in plan:
+        return table_data.chunk_positions(plan['chunks'])
+    return table_data.row_positions()
+
+
+def _count_scanned(positions):
+    """Перебирает позиции и учитывает их число в метрике rows_scanned."""
+    scanned = 0
+    try:
+        for position in positions:
+            scanned += 1
+            yield position
+    finally:
+        increment('rows_scanned', scanned)
+
+
+def _serial_positions(table_data, plan, indexes, counters):
+    """Перебирает кандидатов согласно способу доступа и проверяет условие в текущем процессе."""
+    candidates = _access_positions(table_data, plan, indexes or {})
+    if plan['access'] == 'column_scan':
+        # Сравнение по столбцу просматривает все значения столбца
+        increment('rows_scanned', len(table_data))
+    elif hasattr(candidates, '__len__'):
+        increment('rows_scanned', len(candidates))
+    else:
+        candidates = _count_scanned(candidates)
+    if counters is not None:
+        counters['checked'] = 0
+
+        def counted(positions):
+            for position in positions:
+                counters['checked'] += 1
+                yield position
+        candidates = counted(candidates)
+
+    expression = plan['expression']
+    if expression is not None:
+        predicate = compile_where(expression, table_data)
+        candidates = (i for i in candidates if predicate(i))
+    return candidates
+
+
+def run_plan(table_data, plan, indexes=None, counters=None):
+    """
+    Выполняет план и лениво выдает позиции подходящих записей.
+
+    Args:
+        table_data: Данные таблицы
+        plan: План (см. plan_query)
+        indexes: Словарь {столбец: индекс}, использованный при планировании
+        counters: Словарь, в котором считается число проверенных записей
+            ('checked'); None - без подсчета
+
+    Returns:
+        Генератор позиций записей
+    """
+    candidates = None
+    if plan.get('workers', 1) > 1:
+        candidates = parallel_scan(table_data, plan['expression'], plan['workers'])
+        if candidates is not None:
+            increment('rows_scanned', len(table_data))
+            if counters is not None:
+                counters['checked'] = len(table_data)
+
+    if candidates is None:
+        candidates = _serial_positions(table_data, plan, indexes, counters)
+
+    if plan['order'] == 'sort':
+        # Сортируются только подходящие записи
+        column, descending = plan['order_by']
+        get = table_data.getter(column, MISSING)
+        candidates = sorted(candidates, key=lambda i: _sort_key(get(i)), reverse=descending)
+    yield from candidates
+
+
+def _format_bounds(bounds):
+    """Форматирует границы диапазона, например [20 .. 30)."""
+    low, high, include_low, include_high = bounds
+    left = '(-∞' if low is None else ('[' if include_low else '(') + repr(low)
+    right = '+∞)' if high is None else repr(high) + (']' if include_high else ')')
+    return f"{left} .. {right}"
+
+
+def format_plan(plan):
+    """
+    Форматирует план для вывода командой explain.
+
+    Returns:
+        Список строк
+    """
+    access = ACCESS_NAMES[plan['access']]
+    if plan.get('column') and plan['access'] != 'id_lookup':
+        access += f" по столбцу '{plan['column']}'"
+    if plan.get('index'):
+        access += f" (индекс {plan['index']})"
+    if plan.get('values'):
+        access += f": {', '.join(repr(value) for value in plan['values'])}"
+    if plan.get('bounds'):
+        access += f": {_format_bounds(plan['bounds'])}"
+
+    lines = [f"Доступ: {access}"]
+    if plan.get('workers', 1) > 1:
+        lines.append(f"Параллельно: {plan['workers']} процессов")
+    if 'chunks' in plan:
+        lines.append(f"Фрагменты: просматривается {len(plan['chunks'])} из {plan['table_chunks']} "
+                     f"(остальные исключены картами зон)")
+    if plan['expression'] is not None:
+        lines.append(f"Фильтр: {plan['expression']!r}")
+    if plan['order'] == 'index':
+        lines.append(f"Сортировка: по индексу столбца '{plan['order_by'][0]}'")
+    elif plan['order'] == 'sort':
+        lines.append(f"Сортировка: в памяти по столбцу '{plan['order_by'][0]}'")
+    lines.append(
+        f"Оценка: записей в таблице {plan['table_rows']}, проверяется ~{plan['estimated_candidates']:.0f}, "
+        f"результат ~{plan['estimated_rows']:.0f}, стоимость {plan['cost']:.1f}"
+    )
+    actual = plan.get('actual')
+    if actual:
+        lines.append(
+            f"Факт: проверено {actual['checked']}, результат {actual['rows']}, "
+            f"планирование {actual['planning'] * 1000:.3f} мс, выполнение {actual['execution'] * 1000:.3f} мс"
+        )
+    return lines
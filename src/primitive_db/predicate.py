@@ -0,0 +1,174 @@
+"""
+Компиляция условий WHERE в функции-предикаты.
+
+Условие (словарь равенств или дерево выражения, см. parser.parse_where_clause)
+компилируется один раз для запроса в замыкание predicate(position), которое
+проверяет запись в указанной позиции таблицы. Значения столбцов читаются
+через table_data.getter, поэтому предикат работает и со списком записей,
+и с колоночной таблицей без сборки записей в словари.
+"""
+import operator
+
+# Значение-заглушка для отсутствующего в записи столбца
+MISSING = object()
+
+# Операторы сравнения
+_COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def to_expression(where_clause):
+    """Преобразует словарь равенств в дерево выражения (дерево возвращается как есть)."""
+    if not isinstance(where_clause, dict):
+        return where_clause
+    operands = tuple(('cmp', column, '=', value) for column, value in where_clause.items())
+    return operands[0] if len(operands) == 1 else ('and', operands)
+
+
+def where_columns(where_clause):
+    """Возвращает множество столбцов, используемых в условии."""
+    if isinstance(where_clause, dict):
+        return set(where_clause)
+    kind = where_clause[0]
+    if kind in ('and', 'or'):
+        return set().union(*(where_columns(operand) for operand in where_clause[1]))
+    if kind == 'not':
+        return where_columns(where_clause[1])
+    return {where_clause[1]}
+
+
+def _coerce(value, col_type):
+    """Приводит значение из условия к типу столбца, если это возможно."""
+    if col_type == 'str' and not isinstance(value, str):
+        return str(value).lower() if isinstance(value, bool) else str(value)
+    if col_type == 'int' and isinstance(value, str) and value.removeprefix('-').isdigit():
+        return int(value)
+    if col_type == 'bool' and not isinstance(value, bool):
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        if value in (0, 1):
+            return bool(value)
+    return value
+
+
+def bind_where(where_clause, column_types=None):
+    """
+    Преобразует условие в дерево выражения и приводит значения к типам столбцов.
+
+    Args:
+        where_clause: Словарь равенств или дерево выражения
+        column_types: Словарь {столбец: тип} из схемы таблицы (None - без приведения)
+
+    Returns:
+        Дерево выражения
+    """
+    expression = to_expression(where_clause)
+    if not column_types:
+        return expression
+
+    kind = expression[0]
+    if kind in ('and', 'or'):
+        return (kind, tuple(bind_where(operand, column_types) for operand in expression[1]))
+    if kind == 'not':
+        return ('not', bind_where(expression[1], column_types))
+
+    col_type = column_types.get(expression[1])
+    if kind == 'cmp':
+        return ('cmp', expression[1], expression[2], _coerce(expression[3], col_type))
+    if kind == 'in':
+        return ('in', expression[1], tuple(_coerce(value, col_type) for value in expression[2]))
+    return ('between', expression[1], _coerce(expression[2], col_type), _coerce(expression[3], col_type))
+
+
+def _compile_comparison(get, op, value):
+    """Компилирует сравнение значения столбца с константой."""
+    if op == '=':
+        return lambda position: get(position) == value
+    if op == '!=':
+        return lambda position: (item := get(position)) is not MISSING and item != value
+
+    compare = _COMPARISONS[op]
+
+    def predicate(position):
+        try:
+            return compare(get(position), value)
+        except TypeError:
+            # Значения несравнимых типов (или отсутствующий столбец) не подходят
+            return False
+    return predicate
+
+
+def _compile_between(get, low, high):
+    """Компилирует проверку low <= значение <= high."""
+    def predicate(position):
+        try:
+            return low <= get(position) <= high
+        except TypeError:
+            return False
+    return predicate
+
+
+def _compile_all(predicates):
+    """Компилирует конъюнкцию предикатов."""
+    if len(predicates) == 2:
+        first, second = predicates
+        return lambda position: first(position) and second(position)
+
+    def predicate(position):
+        for check in predicates:
+            if not check(position):
+                return False
+        return True
+    return predicate
+
+
+def _compile_any(predicates):
+    """Компилирует дизъюнкцию предикатов."""
+    if len(predicates) == 2:
+        first, second = predicates
+        return lambda position: first(position) or second(position)
+
+    def predicate(position):
+        for check in predicates:
+            if check(position):
+                return True
+        return False
+    return predicate
+
+
+def compile_where(expression, table_data):
+    """
+    Компилирует дерево выражения в предикат для записей таблицы.
+
+    Args:
+        expression: Дерево выражения (см. bind_where)
+        table_data: Таблица (TableData или ColumnarTable)
+
+    Returns:
+        Функция predicate(position) -> bool
+    """
+    kind = expression[0]
+    if kind in ('and', 'or'):
+        predicates = [compile_where(operand, table_data) for operand in expression[1]]
+        if len(predicates) == 1:
+            return predicates[0]
+        return _compile_all(predicates) if kind == 'and' else _compile_any(predicates)
+    if kind == 'not':
+        inner = compile_where(expression[1], table_data)
+        return lambda position: not inner(position)
+
+    get = table_data.getter(expression[1], MISSING)
+    if kind == 'cmp':
+        return _compile_comparison(get, expression[2], expression[3])
+    if kind == 'in':
+        values = frozenset(expression[2])
+        return lambda position: get(position) in values
+    if kind == 'between':
+        return _compile_between(get, expression[2], expression[3])
+    raise ValueError(f"Неизвестный вид условия '{kind}'")
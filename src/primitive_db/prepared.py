@@ -0,0 +1,304 @@
+"""
+Подготовленные команды и кэш разобранных команд.
+
+Команда select, insert, update или delete со знаками ? на месте значений
+разбирается и проверяется по схеме таблицы один раз (prepare), а при
+выполнении параметры только подставляются в готовое дерево условия:
+
+    prepare by_age as select users where age = ?
+    execute by_age 28
+
+Команды, которые вводятся как обычно, тоже разбираются один раз для каждой
+формы: значения в кавычках и числа заменяются знаком ?, и по полученному
+тексту в StatementCache хранится подготовленная команда. Если команду
+с такой формой подготовить нельзя (например, агрегатный запрос), она
+выполняется обычным разбором.
+"""
+import re
+import shlex
+import threading
+from collections import OrderedDict
+
+from .constants import STATEMENT_CACHE_SIZE
+from .parser import Placeholder, parse_select_args, parse_set_clause, parse_where_clause
+from .predicate import where_columns
+
+# Команды, которые можно подготовить
+STATEMENT_KINDS = ('select', 'insert', 'update', 'delete')
+
+# Значения в тексте команды: строки в кавычках и целые числа вне имен
+_LITERAL_RE = re.compile(r"""'[^']*'|"[^"]*"|(?<![\w.])-?\d+(?![\w.])""")
+
+
+class PreparedStatement:
+    """
+    Разобранная и проверенная по схеме таблицы команда с параметрами.
+
+    Attributes:
+        text: Исходный текст команды
+        kind: 'select', 'insert', 'update' или 'delete'
+        table: Имя таблицы
+        columns: Схема таблицы на момент подготовки (для проверки актуальности)
+        parameters: Список параметров (parser.Placeholder) в порядке следования
+        index_columns: Столбцы, индексы по которым нужны для выполнения
+    """
+
+    def __init__(self, text, kind, table, columns, parts, parameters):
+        self.text = text
+        self.kind = kind
+        self.table = table
+        self.columns = columns
+        self.parameters = parameters
+        self._parts = parts
+        self._types = dict(columns)
+        # Значения insert и SET проверяет и приводит к типам ядро, как в обычных командах
+        unchecked = parts.get('values', []) + list((parts.get('set') or {}).values())
+        self._unchecked = {value.index for value in unchecked if isinstance(value, Placeholder)}
+
+        where_clause = parts.get('where')
+        self.index_columns = where_columns(where_clause) if where_clause else set()
+        order_by = parts.get('order_by')
+        if order_by:
+            self.index_columns.add(order_by[0])
+
+    @property
+    def column_names(self):
+        """Названия столбцов таблицы."""
+        return [column for column, _ in self.columns]
+
+    def bind(self, values):
+        """
+        Подставляет значения параметров.
+
+        Значения условий, LIMIT и OFFSET приводятся к типу столбца параметра,
+        значения insert и SET проверяет ядро при выполнении, как в обычных командах.
+
+        Args:
+            values: Значения параметров в порядке знаков ?
+
+        Returns:
+            Словарь частей команды: 'where', 'order_by', 'limit', 'offset' (select),
+            'values' (insert), 'set' и 'where' (update), 'where' (delete)
+
+        Raises:
+            ValueError: Если число значений не совпадает с числом параметров
+                или значение не приводится к типу столбца
+        """
+        if len(values) != len(self.parameters):
+            raise ValueError(f"Команда ожидает параметров: {len(self.parameters)}, передано: {len(values)}")
+        bound = [self._convert(parameter, value) for parameter, value in zip(self.parameters, values)]
+        return {name: _substitute(part, bound) for name, part in self._parts.items()}
+
+    def _convert(self, parameter, value):
+        """Приводит значение параметра условия, LIMIT или OFFSET к типу его столбца."""
+        if parameter.index in self._unchecked:
+            # Ядро получает значения строками, как из текста команды
+            return value if isinstance(value, str) else str(value)
+        col_type = 'int' if parameter.column in ('limit', 'offset') else self._types.get(parameter.column)
+        converted = _to_type(value, col_type)
+        if converted is None or (parameter.column in ('limit', 'offset') and converted < 0):
+            raise ValueError(f"Параметр {parameter.index + 1} ({parameter.column}): "
+                             f"значение '{value}' не соответствует типу {col_type}")
+        return converted
+
+
+def _to_type(value, col_type):
+    """Приводит значение к типу столбца; возвращает None, если это невозможно."""
+    if col_type == 'int':
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.removeprefix('-').isdigit():
+            return int(value)
+        return None
+    if col_type == 'bool':
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        return None
+    if col_type == 'str':
+        return value if isinstance(value, str) else None
+    return value
+
+
+def _substitute(part, values):
+    """Заменяет параметры в части команды (дереве условия, словаре, списке) значениями."""
+    if isinstance(part, Placeholder):
+        return values[part.index]
+    if isinstance(part, tuple):
+        return tuple(_substitute(item, values) for item in part)
+    if isinstance(part, list):
+        return [_substitute(item, values) for item in part]
+    if isinstance(part, dict):
+        return {key: _substitute(item, values) for key, item in part.items()}
+    return part
+
+
+def _check_columns(columns, names):
+    """
+    Проверяет, что все столбцы names есть в схеме таблицы.
+
+    Raises:
+        ValueError: Если какого-то из столбцов names нет в схеме
+    """
+    known = {column for column, _ in columns}
+    for name in sorted(names):
+        if name not in known:
+            raise ValueError(f"Столбец '{name}' не существует.")
+
+
+def prepare(text, metadata):
+    """
+    Разбирает команду с параметрами и проверяет её по схеме таблицы.
+
+    Args:
+        text: Текст команды, например "select users where age = ?"
+        metadata: Словарь с метаданными базы данных
+
+    Returns:
+        PreparedStatement
+
+    Raises:
+        ValueError: Если команду нельзя подготовить (сообщение для пользователя)
+    """
+    try:
+        lexer = shlex.shlex(text, posix=False)
+        lexer.whitespace_split = True
+        # Кавычки сохраняются, чтобы отличать значение '?' от параметра ?
+        words = list(lexer)
+    except ValueError:
+        raise ValueError("Некорректный ввод.") from None
+    kind = words[0].lower() if words else None
+    if kind not in STATEMENT_KINDS:
+        raise ValueError(f"Подготовить можно только команды {', '.join(STATEMENT_KINDS)}.")
+    if len(words) < 2:
+        raise ValueError("Укажите имя таблицы.")
+    table = words[1]
+    if table not in metadata:
+        raise ValueError(f"Таблица '{table}' не существует.")
+    columns = [tuple(column) for column in metadata[table].get('columns', [])]
+
+    parameters = []
+    if kind == 'select':
+        if any(word.lower() == 'from' for word in words[2:]):
+            raise ValueError("Агрегатные запросы нельзя подготовить.")
+        parts = parse_select_args(words[2:], parameters)
+        if parts is None:
+            raise ValueError("Используйте формат: select <table_name> [where <условие>] [order by <column> "
+                             "[asc|desc]] [limit N] [offset M]")
+        referenced = where_columns(parts['where']) if parts['where'] else set()
+        if parts['order_by']:
+            referenced.add(parts['order_by'][0])
+    elif kind == 'insert':
+        values = []
+        for word in words[2:]:
+            if word == '?':
+                values.append(Placeholder(len(parameters), columns[len(values) + 1][0]
+                                          if len(values) + 1 < len(columns) else None))
+                parameters.append(values[-1])
+            else:
+                values.append(word[1:-1] if len(word) >= 2 and word[0] == word[-1] and word[0] in '\'"' else word)
+        if len(values) != len(columns) - 1:
+            raise ValueError(f"Количество значений ({len(values)}) не соответствует количеству столбцов "
+                             f"({len(columns) - 1}).")
+        parts = {'values': values}
+        referenced = set()
+    elif kind == 'update':
+        if len(words) < 6 or words[2].lower() != 'set' or words[4].lower() != 'where':
+            raise ValueError("Используйте формат: update <table_name> set <column>=<value> where <условие>")
+        set_clause = parse_set_clause(words[3], parameters)
+        where_clause = parse_where_clause(words[5:], parameters)
+        if set_clause is None or where_clause is None:
+            raise ValueError("Некорректный формат условий. Используйте: set column=value where <условие>")
+        parts = {'set': set_clause, 'where': where_clause}
+        referenced = set(set_clause) | where_columns(where_clause)
+    else:
+        if len(words) < 4 or words[2].lower() != 'where':
+            raise ValueError("Используйте формат: delete <table_name> where <условие>")
+        where_clause = parse_where_clause(words[3:], parameters)
+        if where_clause is None:
+            raise ValueError("Некорректный формат условия WHERE. Используйте: where <условие>")
+        parts = {'where': where_clause}
+        referenced = where_columns(where_clause)
+
+    _check_columns(columns, referenced)
+    return PreparedStatement(text, kind, table, columns, parts, parameters)
+
+
+class StatementCache:
+    """
+    Кэш подготовленных команд по форме текста команды (LRU).
+
+    Форма - текст команды, в котором значения в кавычках и числа заменены
+    знаком ?. Для формы, которую нельзя подготовить, запоминается None.
+    Кэш общий для всех сессий процесса, поэтому формы ищутся под блокировкой.
+    """
+
+    def __init__(self, max_entries=STATEMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def match(self, line, metadata):
+        """
+        Находит (или готовит) команду формы line и подставляет в неё значения из line.
+
+        Args:
+            line: Текст команды
+            metadata: Словарь с метаданными базы данных
+
+        Returns:
+            Кортеж (PreparedStatement, части команды со значениями, см. PreparedStatement.bind)
+            или None, если команду нужно выполнить обычным разбором
+        """
+        # Знаки ? и экранирование в тексте не отличить от параметров формы
+        if '?' in line or '\\' in line:
+            return None
+        word = line.split(None, 1)[0].lower() if line.strip() else None
+        if word not in STATEMENT_KINDS:
+            return None
+        literals = _LITERAL_RE.findall(line)
+        shape = _LITERAL_RE.sub('?', line).strip()
+
+        with self._lock:
+            statement = self._entries.get(shape, False)
+            table_info = metadata.get(statement.table) if statement else None
+            if statement is False or (statement is not None and (
+                    table_info is None or [tuple(column) for column in table_info.get('columns', [])]
+                    != statement.columns)):
+                # Новая форма или схема таблицы изменилась
+                self.misses += 1
+                try:
+                    statement = prepare(shape, metadata)
+                except ValueError:
+                    statement = None
+                if statement is not None and len(statement.parameters) != len(literals):
+                    statement = None
+                self._entries[shape] = statement
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self.hits += 1
+                self._entries.move_to_end(shape)
+        if statement is None:
+            return None
+
+        # Значения передаются строками без кавычек, как после shlex.split в обычном разборе
+        values = [literal[1:-1] if literal[0] in '\'"' else literal for literal in literals]
+        try:
+            return statement, statement.bind(values)
+        except ValueError:
+            # Например, строка вместо числа: обычный разбор выдаст привычный результат
+            return None
+
+    def stats(self):
+        """Возвращает статистику кэша для метрик: попадания, промахи, число форм."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
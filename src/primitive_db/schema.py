@@ -0,0 +1,76 @@
+"""
+Изменения схемы таблиц без перезаписи данных.
+
+Команда alter_table только записывает изменение в метаданные таблицы
+(список schema_changes) и увеличивает версию схемы (schema_version):
+записи на диске остаются прежними. Изменения применяются к записям при их
+чтении (upgrade_row), а команда vacuum переписывает данные в актуальной
+схеме и очищает список изменений.
+
+Применение изменений идемпотентно: после upgrade_row запись любой версии
+схемы, в том числе уже приведенная к актуальной, имеет актуальную схему.
+Поэтому записи разных версий могут храниться вместе (например, снимок
+и журнал изменений), а повторное применение после сбоя ничего не портит.
+Для этого имена удаленных и переименованных столбцов нельзя использовать
+снова до vacuum (см. retired_columns): иначе старые значения в записях
+на диске нельзя было бы отличить от новых.
+"""
+
+# Виды изменений схемы
+SCHEMA_CHANGES = ('add', 'drop', 'rename')
+
+
+def check_changes(changes):
+    """
+    Проверяет, что все изменения схемы известного вида (см. SCHEMA_CHANGES).
+
+    Raises:
+        ValueError: Если вид изменения неизвестен (например, метаданные
+            изменены вручную или записаны более новой версией программы)
+    """
+    for change in changes:
+        if change.get('op') not in SCHEMA_CHANGES:
+            raise ValueError(f"Неизвестный вид изменения схемы '{change.get('op')}' "
+                             f"(версия схемы {change.get('version')}). Доступны: {', '.join(SCHEMA_CHANGES)}")
+
+
+def upgrade_row(row, changes):
+    """
+    Приводит запись к актуальной схеме (изменяет словарь на месте).
+
+    Args:
+        row: Запись таблицы
+        changes: Список изменений схемы {'op': 'add', 'column', 'type', 'default'},
+            {'op': 'drop', 'column'} или {'op': 'rename', 'column', 'to'} в порядке выполнения
+
+    Returns:
+        Та же запись
+    """
+    for change in changes:
+        op, column = change['op'], change['column']
+        if op == 'add':
+            if column not in row:
+                row[column] = change['default']
+        elif op == 'drop':
+            row.pop(column, None)
+        elif op == 'rename' and column in row:
+            # Значение под новым именем (например, из журнала изменений) новее
+            row.setdefault(change['to'], row.pop(column))
+    return row
+
+
+def upgrade_rows(rows, changes):
+    """
+    Приводит записи к актуальной схеме (на месте).
+
+    Raises:
+        ValueError: Если среди изменений есть изменение неизвестного вида
+    """
+    check_changes(changes)
+    for row in rows:
+        upgrade_row(row, changes)
+
+
+def retired_columns(changes):
+    """Возвращает имена столбцов, удаленных или переименованных после последнего vacuum."""
+    return {change['column'] for change in changes if change['op'] in ('drop', 'rename')}
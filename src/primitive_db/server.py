@@ -0,0 +1,232 @@
+"""
+Сервер базы данных (database serve).
+
+Сервер asyncio принимает команды на языке базы данных через Unix-сокет
+или TCP (протокол описан в client). У каждого соединения своя сессия,
+поэтому метаданные, таблицы и индексы остаются в памяти между запросами
+соединения, а не загружаются заново для каждой команды.
+
+Команды выполняются в потоках (asyncio.to_thread), чтобы ожидание
+блокировки таблицы или долгая выборка одного соединения не задерживали
+остальные. Сессии соединений изолированы друг от друга блокировками
+таблиц, как сессии разных процессов: пока у соединения открыта
+транзакция, команды других соединений ждут только блокировок нужных им
+таблиц. Вывод команды (print) перехватывается в её потоке и отправляется
+клиенту, а при закрытии соединения незавершенная транзакция отменяется.
+Подготовленные команды (prepare) общие для всех соединений.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from .client import parse_address
+from .decorators import set_confirm_policy
+from .engine import execute
+from .session import Session
+
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Поток вывода, заменяющий sys.stdout на время работы сервера.
+
+    В потоке, где выполняется команда (см. capture), вывод пишется в буфер
+    этой команды, в остальных потоках - в исходный sys.stdout.
+    contextlib.redirect_stdout для этого не подходит: он заменяет sys.stdout
+    для всех потоков сразу.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (self._default if buffer is None else buffer).write(text)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._default.flush()
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Перехватывает вывод текущего потока и возвращает буфер с ним."""
+        self._local.buffer = io.StringIO()
+        try:
+            yield self._local.buffer
+        finally:
+            self._local.buffer = None
+
+
+class _ServerState:
+    """Общее состояние сервера: перехват вывода, подготовленные команды, обработчики соединений и счетчики."""
+
+    def __init__(self, output):
+        self.output = output
+        self.statements = {}  # подготовленные команды, общие для сессий всех соединений
+        self.handlers = set()  # задачи обработчиков открытых соединений
+        self.connections = 0
+        self.commands = 0
+        self.busy_seconds = 0.0
+
+
+def _run_command(session, output, line):
+    """
+    Выполняет команду в сессии соединения и перехватывает её вывод.
+
+    Вызывается в потоке исполнителя (asyncio.to_thread).
+
+    Returns:
+        Кортеж (статус кадра ответа, вывод команды, время выполнения в секундах)
+    """
+    start = time.monotonic()
+    try:
+        with output.capture() as buffer:
+            keep_open = execute(session, line)
+    except Exception as e:  # noqa: BLE001 - ошибка одной команды не должна останавливать сервер
+        return 'ERR', f"{type(e).__name__}: {e}", time.monotonic() - start
+    return ('OK' if keep_open else 'BYE'), buffer.getvalue(), time.monotonic() - start
+
+
+async def _in_thread(func, *args):
+    """
+    Выполняет func(*args) в потоке и дожидается результата.
+
+    Если обработчик соединения отменяют (сервер останавливается), поток
+    все равно доводится до конца: иначе сессию закрыли бы посреди команды.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await task
+        raise
+
+
+async def _handle_connection(state, reader, writer):
+    """Обрабатывает команды одного соединения до его закрытия или команды exit."""
+    state.connections += 1
+    state.handlers.add(asyncio.current_task())
+    session = None
+    try:
+        session = await _in_thread(Session)
+        session.statements = state.statements
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            status, output, elapsed = await _in_thread(
+                _run_command, session, state.output, line.decode('utf-8', errors='replace').rstrip('\r\n'),
+            )
+            state.commands += 1
+            state.busy_seconds += elapsed
+
+            payload = output.encode('utf-8')
+            writer.write(f"{status} {len(payload)}\n".encode('ascii') + payload)
+            await writer.drain()
+            if status == 'BYE':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except asyncio.CancelledError:
+        # Сервер останавливается: соединение закрывается как обычно
+        pass
+    finally:
+        if session is not None:
+            # Незавершенная транзакция соединения отменяется при закрытии сессии;
+            # сессия закрывается, даже если сервер останавливается во время закрытия
+            with contextlib.suppress(asyncio.CancelledError):
+                await _in_thread(session.close)
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+        state.handlers.discard(asyncio.current_task())
+
+
+def _check_unix_socket(path):
+    """
+    Удаляет файл Unix-сокета, оставшийся после прошлого запуска сервера.
+
+    Raises:
+        OSError: Если по этому адресу уже работает сервер
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"Сервер уже работает по адресу unix:{path}")
+
+
+async def _serve(state, address):
+    """Запускает сервер и обслуживает соединения до сигнала остановки."""
+    kind, target = parse_address(address)
+
+    def handler(reader, writer):
+        return _handle_connection(state, reader, writer)
+
+    if kind == 'unix':
+        _check_unix_socket(target)
+        server = await asyncio.start_unix_server(handler, path=target)
+    else:
+        server = await asyncio.start_server(handler, host=target[0], port=target[1])
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(signum, stop.set)
+
+    print(f"Сервер базы данных запущен: {address}", file=sys.stderr)
+    try:
+        await stop.wait()
+    finally:
+        # Обработчики открытых соединений отменяются и закрывают свои сессии
+        # до выхода из цикла событий (выполняемые команды доводятся до конца)
+        server.close()
+        for task in state.handlers:
+            task.cancel()
+        await asyncio.gather(*state.handlers, return_exceptions=True)
+        if kind == 'unix' and os.path.exists(target):
+            os.remove(target)
+
+
+def serve(address, assume_yes=False):
+    """
+    Запускает сервер базы данных и обслуживает соединения до SIGINT или SIGTERM.
+
+    Args:
+        address: 'unix:<путь>' или '<хост>:<порт>' (см. client.parse_address)
+        assume_yes: Автоматически подтверждать drop_table и delete
+            (иначе такие операции отменяются, как в режиме скрипта)
+    """
+    set_confirm_policy('yes' if assume_yes else 'no')
+    # Сессия сервера проверяет файлы после сбоя и, пока сервер работает,
+    # удерживает общую блокировку базы данных (команды выполняются в сессиях соединений)
+    session = Session()
+    for message in session.recover():
+        print(message, file=sys.stderr)
+    stdout = sys.stdout
+    state = _ServerState(_ThreadOutput(stdout))
+    sys.stdout = state.output
+    try:
+        asyncio.run(_serve(state, address))
+    finally:
+        sys.stdout = stdout
+        session.close()
+        set_confirm_policy('ask')
+    print(
+        f"Сервер остановлен. Соединений: {state.connections}, команд: {state.commands} "
+        f"(выполнение: {state.busy_seconds:.3f} секунд).",
+        file=sys.stderr,
+    )
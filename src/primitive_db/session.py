@@ -0,0 +1,484 @@
+"""
+Сессия работы с базой данных.
+
+Сессия держит разобранные метаданные, таблицы и индексы в памяти между
+командами. Перед использованием проверяется, не изменил ли файлы другой
+процесс (по размеру и времени изменения), а накопленные изменения
+записываются на диск в контрольных точках или при фиксации транзакции.
+
+Несколько процессов могут работать с одной базой данных: изменения таблицы
+выполняются под её блокировкой записи (см. locks), а метаданные при записи
+объединяются с изменениями других процессов.
+"""
+import os
+
+from .binary import MmapTable
+from .chunked import ChunkedTable
+from .columnar import ColumnarTable
+from .constants import METADATA_FILE, SESSION_CHECKPOINT_INTERVAL, TABLE_LAYOUT
+from .decorators import report_time
+from .durability import recover, sync_pending
+from .index import build_index, load_index, table_indexes
+from .locks import FileLock, data_lock_path, table_lock_path
+from .metrics import observe
+from .schema import check_changes, upgrade_rows
+from .storage import storage_for
+from .table import TableData
+from .utils import (
+    load_metadata,
+    load_table_data,
+    remove_commit_journal,
+    replay_commit_journal,
+    save_commit_journal,
+    save_metadata,
+    save_table_changes,
+)
+
+
+def _file_stamp(filepath):
+    """Возвращает отпечаток файла (размер, время изменения, inode) или None."""
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class Session:
+    """
+    Буфер метаданных и таблиц, общий для последовательности команд.
+
+    Изменения таблиц накапливаются в виде записей журнала и сбрасываются
+    на диск каждые checkpoint_interval изменяющих команд (см. command_done),
+    по команде checkpoint и при закрытии сессии. При checkpoint_interval=None
+    изменения сохраняются только явно и при закрытии сессии.
+
+    Между begin и commit изменения не записываются на диск: commit сохраняет
+    их все сразу, rollback отбрасывает.
+
+    Изменяемая таблица блокируется (lock_table) до сохранения её изменений,
+    а читаемые таблицы - в общем режиме до конца команды (см. command_done).
+
+    При layout='columnar' таблицы хранятся в памяти как ColumnarTable.
+    """
+
+    def __init__(self, metadata_file=METADATA_FILE, checkpoint_interval=SESSION_CHECKPOINT_INTERVAL,
+                 layout=TABLE_LAYOUT):
+        self.metadata_file = metadata_file
+        self.checkpoint_interval = checkpoint_interval
+        self.layout = layout
+        self._metadata = None
+        self._metadata_stamp = None
+        self._metadata_dirty = False
+        self._tables = {}  # имя таблицы -> TableData или ColumnarTable
+        self._table_stamps = {}  # имя таблицы -> отпечаток файлов таблицы
+        self._pending = {}  # имя таблицы -> несохраненные записи об изменениях
+        self._indexes = {}  # (имя таблицы, столбец) -> HashIndex или SortedIndex
+        self._command_wrote = False
+        self._writes_since_checkpoint = 0
+        self._transaction = None  # имена двоичных таблиц, скопированных в память транзакцией
+        self._write_locks = {}  # имя таблицы -> блокировка записи (до сохранения изменений)
+        self._data_locks = {}  # имя таблицы -> блокировка файлов (до конца команды)
+        self.statements = {}  # имя -> подготовленная команда (prepared.PreparedStatement)
+        self._metadata_lock = FileLock(metadata_file + '.lock')
+        # Общая блокировка, пока сессия открыта: восстановление после сбоя
+        # выполняется, только если с базой данных не работают другие процессы
+        self._session_lock = FileLock(metadata_file + '.session.lock')
+        self._session_lock.acquire()
+
+    @property
+    def in_transaction(self):
+        """Начата ли транзакция."""
+        return self._transaction is not None
+
+    @property
+    def metadata(self):
+        """
+        Метаданные базы данных (перечитываются, если файл изменен извне).
+
+        Записи таблиц, заблокированных этой сессией, при перечитывании
+        сохраняются: их может изменять только эта сессия.
+        """
+        self._load_metadata()
+        return self._metadata
+
+    def _load_metadata(self):
+        """Загружает метаданные или перечитывает их, если файл изменил другой процесс."""
+        stamp = _file_stamp(self.metadata_file)
+        if self._metadata is None:
+            self._metadata = load_metadata(self.metadata_file)
+            self._metadata_stamp = stamp
+        elif stamp != self._metadata_stamp:
+            # Словарь обновляется на месте: на него могут ссылаться выполняемые команды
+            merged = self._merge_metadata(load_metadata(self.metadata_file))
+            self._metadata.clear()
+            self._metadata.update(merged)
+            self._metadata_stamp = stamp
+
+    def lock_table(self, table_name):
+        """
+        Блокирует таблицу для изменения этой сессией.
+
+        Блокировка удерживается, пока изменения таблицы не будут сохранены
+        (до контрольной точки или фиксации транзакции), поэтому другие процессы
+        изменяют таблицу только после этого. После получения блокировки
+        метаданные перечитываются, если их изменил другой процесс.
+
+        Raises:
+            TimeoutError: Если таблица заблокирована другим процессом дольше LOCK_TIMEOUT
+        """
+        if table_name in self._write_locks:
+            return
+        lock = FileLock(table_lock_path(table_name))
+        self._acquire(lock, True, f"таблицы '{table_name}'")
+        self._load_metadata()
+        self._write_locks[table_name] = lock
+
+    def lock_files(self, table_name, exclusive=False):
+        """
+        Блокирует файлы таблицы до конца команды.
+
+        Args:
+            table_name: Имя таблицы
+            exclusive: Файлы будут изменены (иначе - только прочитаны)
+
+        Raises:
+            TimeoutError: Если файлы заблокированы другим процессом дольше LOCK_TIMEOUT
+        """
+        lock = self._data_locks.get(table_name)
+        if lock is None:
+            lock = self._data_locks[table_name] = FileLock(data_lock_path(table_name))
+        if lock.mode != 'exclusive':
+            self._acquire(lock, exclusive, f"таблицы '{table_name}'")
+
+    def table(self, table_name, for_update=False):
+        """
+        Возвращает данные таблицы, загружая их при первом обращении.
+
+        Если таблица не имеет несохраненных изменений, а её файлы изменил
+        другой процесс, данные загружаются заново.
+
+        Args:
+            table_name: Имя таблицы
+            for_update: Данные будут изменены. Изменения двоичной таблицы
+                записываются прямо в отображенный файл, поэтому в транзакции
+                она заменяется копией в памяти
+        """
+        storage = storage_for(table_name)
+        # Изменения двоичной таблицы вне транзакции записываются в файл сразу
+        self.lock_files(table_name, exclusive=for_update and self._transaction is None and storage.name == 'binary')
+        stamp = self._stamp(table_name, storage)
+        table_data = self._tables.get(table_name)
+        if table_data is None or (table_name not in self._pending and stamp != self._table_stamps[table_name]):
+            table_data = self._arrange(table_name, self._upgrade(table_name, load_table_data(table_name)))
+            self._tables[table_name] = table_data
+            self._table_stamps[table_name] = stamp
+            self._forget_indexes(table_name)
+
+        if for_update and self._transaction is not None and isinstance(table_data, MmapTable):
+            mapped = table_data
+            table_data = self._arrange(table_name, TableData(mapped.to_rows()))
+            mapped.close()
+            self._tables[table_name] = table_data
+            self._transaction.add(table_name)
+        return table_data
+
+    def indexes(self, table_name, columns):
+        """
+        Возвращает индексы таблицы для указанных столбцов.
+
+        Args:
+            table_name: Имя таблицы
+            columns: Столбцы, для которых нужны индексы
+
+        Returns:
+            Словарь {столбец: индекс} для проиндексированных столбцов
+        """
+        indexed = table_indexes(self.metadata.get(table_name, {}))
+        result = {}
+        for column in columns:
+            if column not in indexed:
+                continue
+            key = (table_name, column)
+            if key not in self._indexes:
+                table_data = self.table(table_name)
+                if self._transaction is not None and table_name in self._pending:
+                    # Файл индекса не знает об изменениях транзакции - индекс строится в памяти
+                    self._indexes[key] = build_index(table_name, column, table_data, indexed[column], save=False)
+                    continue
+                # Файл индекса актуален только относительно сохраненной таблицы
+                self.flush(table_name)
+                self._indexes[key] = load_index(table_name, column, table_data, indexed[column])
+            result[column] = self._indexes[key]
+        return result
+
+    def save_metadata(self):
+        """Отмечает метаданные измененными (запись - в ближайшей контрольной точке)."""
+        self._metadata_dirty = True
+        self._command_wrote = True
+
+    def save_changes(self, table_name, table_data, changes):
+        """
+        Регистрирует изменения таблицы.
+
+        Args:
+            table_name: Имя таблицы
+            table_data: Актуальные данные таблицы
+            changes: Список записей об изменениях (insert/update/delete)
+        """
+        self._tables[table_name] = table_data
+        self._pending.setdefault(table_name, []).extend(changes)
+        for (indexed_table, _), index in self._indexes.items():
+            if indexed_table == table_name:
+                for record in changes:
+                    index.apply(record)
+        self._command_wrote = True
+
+    def replace_table(self, table_name, table_data):
+        """Заменяет данные таблицы в сессии после операции, выполненной напрямую с файлами."""
+        self._tables[table_name] = self._arrange(table_name, self._upgrade(table_name, table_data))
+        self._table_stamps[table_name] = self._stamp(table_name)
+        self._forget_indexes(table_name)
+
+    def forget_table(self, table_name):
+        """Удаляет таблицу и её индексы из памяти сессии."""
+        self._tables.pop(table_name, None)
+        self._table_stamps.pop(table_name, None)
+        self._pending.pop(table_name, None)
+        self._forget_indexes(table_name)
+
+    def forget_index(self, table_name, column):
+        """Удаляет индекс из памяти сессии."""
+        self._indexes.pop((table_name, column), None)
+
+    def flush(self, table_name):
+        """Записывает на диск несохраненные изменения одной таблицы."""
+        changes = self._pending.pop(table_name, None)
+        if changes:
+            self.lock_files(table_name, exclusive=True)
+            save_table_changes(table_name, self._tables[table_name], changes)
+            self._table_stamps[table_name] = self._stamp(table_name)
+
+    def checkpoint(self):
+        """Записывает на диск все несохраненные изменения таблиц и метаданных."""
+        for table_name in list(self._pending):
+            self.flush(table_name)
+        if self._metadata_dirty:
+            # Файл метаданных общий для всех таблиц: он перечитывается и записывается
+            # под блокировкой, чтобы не потерять изменения других процессов
+            self._acquire(self._metadata_lock, True, "метаданных")
+            try:
+                self._load_metadata()
+                save_metadata(self.metadata_file, self._metadata)
+                self._metadata_stamp = _file_stamp(self.metadata_file)
+            finally:
+                self._metadata_lock.release()
+            self._metadata_dirty = False
+        # Отложенные fsync (уровень надежности 'batched') выполняются один раз на контрольную точку
+        sync_pending()
+        self._writes_since_checkpoint = 0
+
+    def command_done(self):
+        """
+        Завершает обработку команды.
+
+        Если команда изменяла данные, увеличивает счетчик изменяющих команд и
+        делает контрольную точку, когда он достигает checkpoint_interval.
+        Затем снимает блокировки файлов и блокировки записи таблиц,
+        изменения которых сохранены.
+        """
+        if self._command_wrote and self.checkpoint_interval is not None and self._transaction is None:
+            self._writes_since_checkpoint += 1
+            if self._writes_since_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+        self._command_wrote = False
+        self._release_locks()
+
+    def begin(self):
+        """
+        Начинает транзакцию.
+
+        Несохраненные изменения, сделанные до транзакции, сначала записываются
+        на диск, чтобы rollback мог вернуться к сохраненному состоянию.
+
+        Raises:
+            ValueError: Если транзакция уже начата
+        """
+        if self._transaction is not None:
+            raise ValueError("Транзакция уже начата.")
+        self.checkpoint()
+        self._transaction = set()
+
+    def commit(self):
+        """
+        Фиксирует транзакцию: записывает на диск все её изменения за одну контрольную точку.
+
+        Сначала изменения записываются в журнал фиксации, поэтому прерванная
+        запись таблиц будет завершена при следующем запуске (см. recover).
+
+        Returns:
+            Количество записей об изменениях таблиц
+
+        Raises:
+            ValueError: Если транзакция не начата
+        """
+        if self._transaction is None:
+            raise ValueError("Транзакция не начата.")
+        changes = {table_name: records for table_name, records in self._pending.items() if records}
+        journaled = bool(changes) or self._metadata_dirty
+        if journaled:
+            # В журнал попадают только метаданные таблиц, измененных этой сессией
+            entries = {table_name: self._metadata.get(table_name) for table_name in self._write_locks}
+            save_commit_journal(self.metadata_file, entries if self._metadata_dirty else None, changes)
+        copied, self._transaction = self._transaction, None
+        self.checkpoint()
+        if journaled:
+            remove_commit_journal(self.metadata_file)
+        # Двоичные таблицы снова открываются из файла при следующем обращении
+        for table_name in copied:
+            self.forget_table(table_name)
+        return sum(len(records) for records in changes.values())
+
+    def rollback(self):
+        """
+        Отменяет транзакцию, не обращаясь к диску: несохраненные изменения
+        таблиц и метаданных удаляются из памяти сессии.
+
+        Returns:
+            Отсортированный список таблиц, данные или метаданные которых отменены
+
+        Raises:
+            ValueError: Если транзакция не начата
+        """
+        if self._transaction is None:
+            raise ValueError("Транзакция не начата.")
+        discarded = set(self._pending) | self._transaction
+        if self._metadata_dirty:
+            discarded.update(self._metadata)
+        for table_name in discarded:
+            self.forget_table(table_name)
+        self._metadata = None
+        self._metadata_dirty = False
+        self._command_wrote = False
+        self._transaction = None
+        return sorted(discarded)
+
+    def close(self):
+        """Завершает сессию, сохраняя все изменения (незавершенная транзакция отменяется)."""
+        if self._transaction is not None:
+            self.rollback()
+        self.checkpoint()
+        self._release_locks()
+        self._session_lock.release()
+
+    def recover(self):
+        """
+        Проверяет файлы базы данных после возможного сбоя (см. durability.recover).
+
+        Вызывается при запуске, до первого обращения к данным. Если с базой
+        данных уже работают другие процессы, проверка пропускается.
+
+        Returns:
+            Список сообщений о найденных и исправленных проблемах
+        """
+        try:
+            self._session_lock.acquire(exclusive=True, timeout=0)
+        except TimeoutError:
+            # Базой данных пользуются другие процессы: файлы уже проверены при их запуске
+            self._session_lock.acquire()
+            return []
+        try:
+            messages = recover(self.metadata_file)
+            replayed = replay_commit_journal(self.metadata_file)
+        finally:
+            self._session_lock.acquire()
+        if replayed:
+            messages.append(f"Изменения транзакций, зафиксированных перед сбоем, сохранены повторно: {replayed}.")
+        if messages:
+            self._metadata = None
+            self._tables.clear()
+            self._table_stamps.clear()
+            self._indexes.clear()
+        return messages
+
+    def _stamp(self, table_name, storage=None):
+        """
+        Возвращает отпечаток таблицы: отпечаток её файлов и версию схемы.
+
+        Версия схемы входит в отпечаток, поэтому после alter_table в другом
+        процессе таблица загружается заново и приводится к новой схеме.
+        """
+        storage = storage or storage_for(table_name)
+        return storage.stamp(table_name), self.metadata.get(table_name, {}).get('schema_version', 0)
+
+    def _upgrade(self, table_name, table_data):
+        """
+        Приводит записи загруженной таблицы к актуальной схеме (см. schema.upgrade_row).
+
+        Записи в памяти изменяются на месте, у таблицы из фрагментов изменения
+        применяются к каждому фрагменту при его загрузке. Двоичные таблицы
+        переписываются сразу при изменении схемы, поэтому не преобразуются.
+
+        Raises:
+            ValueError: Если среди изменений схемы есть изменение неизвестного вида
+        """
+        changes = list(self.metadata.get(table_name, {}).get('schema_changes', []))
+        if not changes or isinstance(table_data, MmapTable):
+            return table_data
+        # Фрагменты преобразуются позже, при загрузке: ошибка в изменениях выдается сразу
+        check_changes(changes)
+        if isinstance(table_data, ChunkedTable):
+            table_data.transform = lambda rows: upgrade_rows(rows, changes)
+        else:
+            upgrade_rows(table_data, changes)
+        return table_data
+
+    def _arrange(self, table_name, table_data):
+        """
+        Приводит загруженную таблицу к представлению сессии.
+
+        Если записи не укладываются в типы схемы (например, данные старого
+        формата), таблица остается списком словарей. Таблицы в двоичном
+        формате читаются из отображенного файла, а таблицы из фрагментов
+        загружаются по частям, поэтому они не преобразуются.
+        """
+        if self.layout != 'columnar' or isinstance(table_data, (MmapTable, ChunkedTable)):
+            return table_data
+        columns = self.metadata.get(table_name, {}).get('columns')
+        if not columns:
+            return table_data
+        try:
+            return ColumnarTable.from_rows(columns, table_data)
+        except (KeyError, TypeError, OverflowError):
+            return table_data
+
+    def _merge_metadata(self, metadata):
+        """Переносит в метаданные, прочитанные с диска, записи таблиц, заблокированных этой сессией."""
+        for table_name in self._write_locks:
+            if table_name in self._metadata:
+                metadata[table_name] = self._metadata[table_name]
+            else:
+                metadata.pop(table_name, None)
+        return metadata
+
+    def _acquire(self, lock, exclusive, target):
+        """Захватывает блокировку и учитывает время ожидания, если пришлось ждать."""
+        waited = lock.acquire(exclusive)
+        if waited:
+            observe('lock_wait_seconds', waited, lock=target)
+            report_time('lock_wait', waited)
+
+    def _release_locks(self):
+        """Снимает блокировки файлов и блокировки записи таблиц без несохраненных изменений."""
+        for lock in self._data_locks.values():
+            lock.release()
+        self._data_locks.clear()
+        if self._transaction is None and not self._pending and not self._metadata_dirty:
+            for lock in self._write_locks.values():
+                lock.release()
+            self._write_locks.clear()
+
+    def _forget_indexes(self, table_name):
+        """Удаляет из памяти все индексы таблицы."""
+        for key in [key for key in self._indexes if key[0] == table_name]:
+            del self._indexes[key]
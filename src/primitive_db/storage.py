@@ -0,0 +1,284 @@
+"""
+Движки хранения данных таблиц.
+
+Поддерживаются форматы:
+- 'json' - таблица целиком хранится в data/<table>.json и перезаписывается
+  при каждом изменении (исходный формат);
+- 'log' - снимок таблицы хранится в data/<table>.json, а изменения
+  дописываются компактными записями в журнал data/<table>.log.
+  Журнал периодически сворачивается в снимок (уплотнение);
+- 'binary' - записи фиксированной длины с доступом через mmap (см. binary.py).
+  Этот формат выбирается для отдельных таблиц командой convert;
+- 'chunked' - фрагменты по диапазонам ID с картами зон (см. chunked.py).
+  Выбирается для отдельных таблиц командой convert или для всех новых
+  таблиц константой STORAGE_BACKEND.
+"""
+import json
+import os
+
+from .binary import BinaryStorage
+from .chunked import ChunkedStorage
+from .constants import DATA_DIR, LOG_COMPACT_MIN_BYTES, STORAGE_BACKEND
+from .durability import atomic_write, removed, sync_file
+from .metrics import increment
+from .table import TableData, apply_changes
+
+
+def _table_path(table_name, extension):
+    """Возвращает путь к файлу таблицы с указанным расширением."""
+    return f'{DATA_DIR}/{table_name}.{extension}'
+
+
+def _as_rows(data):
+    """Возвращает данные таблицы в виде списка словарей для сериализации."""
+    return data.to_rows() if hasattr(data, 'to_rows') else data
+
+
+def _remove_file(path):
+    """Удаляет файл, если он существует."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    removed(path)
+
+
+def _cut_torn_tail(log_path):
+    """
+    Отрезает оборванную последнюю запись журнала.
+
+    Запись, прерванная на середине, не заканчивается переводом строки.
+    Без обрезки следующая дозапись склеилась бы с ней в одну испорченную строку.
+    """
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - 4096, 0)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+class JsonStorage:
+    """Хранит таблицу в одном JSON-файле и перезаписывает его целиком."""
+
+    name = 'json'
+
+    def load(self, table_name):
+        """Загружает данные таблицы. Если файл не найден, возвращает пустую таблицу."""
+        try:
+            with open(_table_path(table_name, 'json'), 'r', encoding='utf-8') as f:
+                rows = json.load(f)
+                increment('bytes_read', os.fstat(f.fileno()).st_size)
+                return TableData(rows)
+        except FileNotFoundError:
+            return TableData()
+
+    def save(self, table_name, data):
+        """Сохраняет данные таблицы целиком (атомарной заменой файла)."""
+        atomic_write(_table_path(table_name, 'json'),
+                     lambda f: json.dump(_as_rows(data), f, indent=2, ensure_ascii=False))
+
+    def append(self, table_name, data, changes):
+        """
+        Сохраняет изменения таблицы.
+
+        Формат JSON не поддерживает дозапись, поэтому файл перезаписывается.
+        """
+        self.save(table_name, data)
+
+    def compact(self, table_name):
+        """Уплотнение не требуется: файл всегда содержит актуальные данные."""
+        return self.load(table_name)
+
+    def remove(self, table_name):
+        """Удаляет файлы таблицы."""
+        for extension in ('json', 'log'):
+            _remove_file(_table_path(table_name, extension))
+
+    def signature(self, table_name):
+        """
+        Возвращает отпечаток файла снимка [размер, время изменения, inode] или None.
+
+        Снимок заменяется переименованием нового файла, поэтому inode отличает
+        новый снимок того же размера, записанный в пределах точности времени изменения.
+        """
+        try:
+            stat = os.stat(_table_path(table_name, 'json'))
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def stamp(self, table_name):
+        """
+        Возвращает отпечаток всех файлов таблицы.
+
+        Используется, чтобы заметить изменение таблицы другим процессом.
+        """
+        return (self.signature(table_name),)
+
+    def read_changes(self, table_name, offset=0):
+        """
+        Читает записи журнала, сделанные после снимка.
+
+        Args:
+            table_name: Имя таблицы
+            offset: Позиция в журнале (в байтах), с которой начинать чтение
+
+        Returns:
+            Кортеж (список записей, позиция конца прочитанной части журнала)
+        """
+        return [], 0
+
+
+class LogStorage(JsonStorage):
+    """Хранит снимок таблицы и журнал изменений в формате JSON Lines."""
+
+    name = 'log'
+
+    def load(self, table_name):
+        """Загружает снимок таблицы и применяет к нему журнал изменений."""
+        rows = super().load(table_name)
+        records, _ = self.read_changes(table_name)
+        apply_changes(rows, records)
+        return rows
+
+    def save(self, table_name, data):
+        """
+        Записывает новый снимок таблицы и очищает журнал.
+
+        Если процесс прервется после записи снимка, но до удаления журнала,
+        журнал будет применен к новому снимку повторно: записи журнала
+        идемпотентны (повторная вставка существующего ID заменяет запись).
+        """
+        atomic_write(_table_path(table_name, 'json'),
+                     lambda f: json.dump(_as_rows(data), f, ensure_ascii=False, separators=(',', ':')))
+        _remove_file(_table_path(table_name, 'log'))
+
+    def append(self, table_name, data, changes):
+        """
+        Дописывает изменения в журнал таблицы.
+
+        Когда журнал становится больше снимка, он сворачивается в новый снимок,
+        поэтому суммарная стоимость уплотнений остается пропорциональной
+        количеству изменений.
+
+        Args:
+            table_name: Имя таблицы
+            data: Актуальные данные таблицы (используются при уплотнении)
+            changes: Список записей об изменениях
+        """
+        if not changes:
+            return
+        if len(changes) >= len(data):
+            # Изменений не меньше, чем записей (например, массовая загрузка
+            # в пустую таблицу) - дешевле сразу записать новый снимок
+            self.save(table_name, data)
+            return
+
+        log_path = _table_path(table_name, 'log')
+        _cut_torn_tail(log_path)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            start = f.tell()
+            for record in changes:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+                f.write('\n')
+            sync_file(f)
+            log_size = f.tell()
+        increment('bytes_written', log_size - start)
+
+        try:
+            snapshot_size = os.path.getsize(_table_path(table_name, 'json'))
+        except FileNotFoundError:
+            snapshot_size = 0
+        if log_size > max(LOG_COMPACT_MIN_BYTES, snapshot_size):
+            self.save(table_name, data)
+
+    def compact(self, table_name):
+        """Сворачивает журнал в новый снимок и возвращает данные таблицы."""
+        data = self.load(table_name)
+        self.save(table_name, data)
+        return data
+
+    def stamp(self, table_name):
+        """Возвращает отпечаток снимка и журнала таблицы."""
+        try:
+            stat = os.stat(_table_path(table_name, 'log'))
+            log_signature = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            log_signature = None
+        return (self.signature(table_name), log_signature)
+
+    def read_changes(self, table_name, offset=0):
+        """Читает записи журнала, пропуская недописанную последнюю строку."""
+        records = []
+        start = offset
+        try:
+            with open(_table_path(table_name, 'log'), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Запись была прервана на середине - игнорируем её
+                        break
+                    records.append(json.loads(line))
+                    offset += len(line)
+        except FileNotFoundError:
+            return [], 0
+        increment('bytes_read', offset - start)
+        return records, offset
+
+
+_BACKENDS = {
+    JsonStorage.name: JsonStorage(),
+    LogStorage.name: LogStorage(),
+    ChunkedStorage.name: ChunkedStorage(),
+}
+
+
+def get_storage(name=None):
+    """
+    Возвращает движок хранения по имени.
+
+    Args:
+        name: Имя движка ('json', 'log' или 'chunked'), по умолчанию STORAGE_BACKEND
+
+    Returns:
+        Объект движка хранения
+    """
+    name = name or STORAGE_BACKEND
+    if name not in _BACKENDS:
+        raise ValueError(f"Неизвестный движок хранения '{name}'. Доступны: {', '.join(_BACKENDS)}")
+    return _BACKENDS[name]
+
+
+_BINARY = BinaryStorage()
+
+
+def storage_for(table_name):
+    """
+    Возвращает движок хранения таблицы.
+
+    Таблицы, преобразованные в двоичный формат, хранятся движком 'binary',
+    таблицы с оглавлением фрагментов - движком 'chunked', остальные - движком
+    по умолчанию (STORAGE_BACKEND). Если по умолчанию таблицы хранятся
+    фрагментами, таблицы, созданные раньше в формате JSON, читаются движком
+    'log', пока не будут преобразованы командой convert.
+    """
+    if _BINARY.exists(table_name):
+        return _BINARY
+    chunked = _BACKENDS[ChunkedStorage.name]
+    if chunked.exists(table_name):
+        return chunked
+    default = get_storage()
+    if default is chunked and _BACKENDS[LogStorage.name].signature(table_name) is not None:
+        return _BACKENDS[LogStorage.name]
+    return default
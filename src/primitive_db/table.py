@@ -0,0 +1,179 @@
+"""
+Контейнер данных таблицы с первичным индексом по столбцу ID.
+"""
+from array import array
+
+
+def encode_column(values):
+    """
+    Кодирует значения столбца для копирования в разделяемую память.
+
+    Целые числа выгружаются массивом array('q'), остальные значения -
+    массивом кодов и списком различных значений (None - нет значения).
+
+    Returns:
+        Кортеж (способ кодирования 'int' или 'codes', буфер, список значений)
+    """
+    if all(type(value) is int for value in values):
+        try:
+            return 'int', array('q', values), None
+        except OverflowError:
+            pass
+    codes = {}
+    buffer = array('I', [codes.setdefault(value, len(codes)) for value in values])
+    return 'codes', buffer, list(codes)
+
+
+class TableData(list):
+    """
+    Список записей таблицы с отображением ID -> позиция записи в списке.
+
+    Совместим с обычным списком словарей, но позволяет находить и добавлять
+    записи по ID за O(1). Удаленная запись заменяется пустым местом (None),
+    поэтому удаление не сдвигает следующие записи и не зависит от размера
+    таблицы, а записи остаются в порядке вставки. Позиция записи - индекс
+    в списке вместе с пустыми местами; len и перебор учитывают только записи.
+    Пустые места вычищаются (compact), когда их становится больше, чем записей,
+    и перед сохранением снимка таблицы (to_rows).
+    """
+
+    def __init__(self, rows=()):
+        self._dead = 0  # число пустых мест удаленных записей
+        super().__init__(rows)
+        self._positions = None
+        self.version = 0  # увеличивается при каждом изменении записей
+
+    def __len__(self):
+        return list.__len__(self) - self._dead
+
+    def __iter__(self):
+        if not self._dead:
+            return list.__iter__(self)
+        return (row for row in list.__iter__(self) if row is not None)
+
+    @property
+    def positions(self):
+        """Словарь ID -> позиция записи (строится при первом обращении)."""
+        if self._positions is None or len(self._positions) != list.__len__(self) - self._dead:
+            self._positions = {row['ID']: i for i, row in enumerate(list.__iter__(self)) if row is not None}
+        return self._positions
+
+    def position_of(self, row_id):
+        """Возвращает позицию записи с указанным ID или None."""
+        return self.positions.get(row_id)
+
+    def row_positions(self):
+        """Возвращает позиции всех записей по порядку (без пустых мест)."""
+        if not self._dead:
+            return range(list.__len__(self))
+        return (i for i, row in enumerate(list.__iter__(self)) if row is not None)
+
+    def value(self, position, column, default=None):
+        """Возвращает значение столбца записи в указанной позиции."""
+        return self[position].get(column, default)
+
+    def getter(self, column, default=None):
+        """Возвращает функцию position -> значение столбца (для скомпилированных условий)."""
+        return lambda position: self[position].get(column, default)
+
+    def export_column(self, column):
+        """
+        Кодирует столбец для копирования в разделяемую память (см. encode_column).
+
+        Пустые места вычищаются, чтобы позиции в буфере совпадали с позициями записей.
+        """
+        self.compact()
+        return encode_column([row.get(column) for row in self])
+
+    def update_row(self, position, values):
+        """Обновляет поля записи в указанной позиции."""
+        self.version += 1
+        self[position].update(values)
+
+    def to_rows(self):
+        """Возвращает записи таблицы в виде списка словарей (пустые места вычищаются)."""
+        self.compact()
+        return self
+
+    def append_row(self, row):
+        """Добавляет запись в конец таблицы."""
+        self.version += 1
+        positions = self.positions
+        positions[row['ID']] = list.__len__(self)
+        self.append(row)
+
+    def remove_positions(self, positions):
+        """
+        Удаляет записи по позициям, оставляя на их месте пустые места.
+
+        Следующие записи не сдвигаются, поэтому удаление стоит O(1) на запись
+        (с учетом вычищения пустых мест, когда их становится больше, чем записей).
+
+        Args:
+            positions: Итерируемый объект с позициями удаляемых записей
+        """
+        removed = set(positions)
+        if not removed:
+            return
+        self.version += 1
+        id_positions = self.positions
+        for i in removed:
+            del id_positions[self[i]['ID']]
+            self[i] = None
+        self._dead += len(removed)
+        if self._dead > len(self):
+            self.compact()
+
+    def compact(self):
+        """Вычищает пустые места удаленных записей (позиции следующих записей меняются)."""
+        if not self._dead:
+            return
+        self[:] = [row for row in list.__iter__(self) if row is not None]
+        self._dead = 0
+        self._positions = None
+
+    def apply_change(self, record):
+        """Применяет запись журнала изменений (insert/update/delete)."""
+        op = record['op']
+        if op == 'insert':
+            position = self.position_of(record['row']['ID'])
+            if position is None:
+                self.append_row(record['row'])
+            else:
+                # Повторное применение журнала (например, после сбоя при уплотнении)
+                self.update_row(position, record['row'])
+        elif op == 'update':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.update_row(position, record['set'])
+        elif op == 'delete':
+            position = self.position_of(record['id'])
+            if position is not None:
+                self.remove_positions([position])
+
+
+def apply_changes(table_data, records):
+    """
+    Применяет записи журнала изменений к таблице (см. apply_change).
+
+    Подряд идущие удаления выполняются одним вызовом remove_positions:
+    у двоичных таблиц удаление сдвигает следующие записи, и по одной
+    записи журнал из многих удалений применялся бы за O(n) на каждое.
+
+    Args:
+        table_data: Данные таблицы (TableData, ColumnarTable, MmapTable или ChunkedTable)
+        records: Записи журнала изменений (insert/update/delete)
+    """
+    deleted = []
+    for record in records:
+        if record['op'] == 'delete':
+            position = table_data.position_of(record['id'])
+            if position is not None:
+                deleted.append(position)
+            continue
+        if deleted:
+            table_data.remove_positions(deleted)
+            deleted = []
+        table_data.apply_change(record)
+    if deleted:
+        table_data.remove_positions(deleted)
@@ -1,6 +1,11 @@
 import json
 import os
 from .constants import DATA_DIR
+from .durability import atomic_write, removed
+from .binary import BinaryStorage, MmapTable
+from .schema import upgrade_rows
+from .storage import get_storage, storage_for
+from .table import apply_changes
 
 
 def load_metadata(filepath):
@@ -13,30 +18,215 @@ def load_metadata(filepath):
 
 
 def save_metadata(filepath, data):
-    """Сохраняет переданные данные в JSON-файл."""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    """
+    Сохраняет переданные данные в JSON-файл.
+    
+    Файл заменяется атомарно, а предыдущая версия остается в <filepath>.bak
+    для восстановления при запуске (см. durability.recover).
+    """
+    atomic_write(filepath, lambda f: json.dump(data, f, indent=2, ensure_ascii=False), backup=True)
 
 
-def load_table_data(table_name):
-    """Загружает данные таблицы из JSON-файла. Если файл не найден, возвращает пустой список."""
-    # Создаем директорию data, если её нет
-    os.makedirs(DATA_DIR, exist_ok=True)
+def commit_journal_path(metadata_file, pid=None):
+    """
+    Возвращает путь к журналу фиксации транзакции процесса (рядом с файлом метаданных).
+    
+    У каждого процесса свой журнал, поэтому транзакции разных процессов
+    фиксируются независимо.
+    """
+    return f"{metadata_file}.{os.getpid() if pid is None else pid}.txn"
+
+
+def _commit_journals(metadata_file):
+    """Возвращает пути ко всем оставшимся журналам фиксации."""
+    directory = os.path.dirname(metadata_file) or '.'
+    prefix = os.path.basename(metadata_file) + '.'
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(prefix) and name.endswith('.txn')
+    )
+
+
+def save_commit_journal(metadata_file, metadata, changes):
+    """
+    Записывает журнал фиксации транзакции перед сохранением её изменений.
     
-    filepath = f'{DATA_DIR}/{table_name}.json'
+    Пока журнал существует, транзакция считается зафиксированной, даже если
+    процесс прервался посреди записи таблиц: при запуске изменения будут
+    применены повторно (см. replay_commit_journal).
+    
+    Args:
+        metadata_file: Путь к файлу метаданных
+        metadata: Записи метаданных измененных таблиц {имя таблицы: запись
+            или None для удаленной таблицы} или None, если метаданные не менялись
+        changes: Словарь {имя таблицы: список записей об изменениях}
+    """
+    payload = {'metadata': metadata, 'tables': changes}
+    atomic_write(commit_journal_path(metadata_file),
+                 lambda f: json.dump(payload, f, ensure_ascii=False, separators=(',', ':')))
+
+
+def remove_commit_journal(metadata_file, path=None):
+    """Удаляет журнал фиксации после того, как изменения транзакции сохранены."""
+    path = path or commit_journal_path(metadata_file)
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        os.remove(path)
     except FileNotFoundError:
-        return []
+        return
+    removed(path)
+
+
+def replay_commit_journal(metadata_file):
+    """
+    Повторно применяет изменения транзакций из оставшихся журналов фиксации.
+    
+    Записи об изменениях идемпотентны, поэтому изменения, которые успели
+    сохраниться до сбоя, при повторном применении не дублируются.
+    
+    Returns:
+        Количество примененных журналов
+    """
+    journals = _commit_journals(metadata_file)
+    for path in journals:
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        
+        os.makedirs(DATA_DIR, exist_ok=True)
+        for table_name, changes in payload['tables'].items():
+            table_data = storage_for(table_name).load(table_name)
+            try:
+                apply_changes(table_data, changes)
+                storage_for(table_name).append(table_name, table_data, changes)
+            finally:
+                if isinstance(table_data, MmapTable):
+                    table_data.close()
+        if payload['metadata'] is not None:
+            metadata = load_metadata(metadata_file)
+            for table_name, entry in payload['metadata'].items():
+                if entry is None:
+                    metadata.pop(table_name, None)
+                else:
+                    metadata[table_name] = entry
+            save_metadata(metadata_file, metadata)
+        remove_commit_journal(metadata_file, path)
+    return len(journals)
+
+
+def load_table_data(table_name):
+    """Загружает данные таблицы (TableData) через текущий движок хранения. Если данных нет, возвращает пустую таблицу."""
+    # Создаем директорию data, если её нет
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return storage_for(table_name).load(table_name)
 
 
 def save_table_data(table_name, data):
-    """Сохраняет данные таблицы в JSON-файл."""
+    """Сохраняет данные таблицы целиком (новый снимок)."""
     # Создаем директорию data, если её нет
     os.makedirs(DATA_DIR, exist_ok=True)
+    storage_for(table_name).save(table_name, data)
+
+
+def save_table_changes(table_name, data, changes):
+    """
+    Сохраняет изменения таблицы.
+    
+    Движок 'log' дописывает только записи об изменениях, движок 'json'
+    перезаписывает файл таблицы целиком, а в двоичном формате изменения
+    уже находятся в отображенном файле и только сбрасываются на диск.
     
-    filepath = f'{DATA_DIR}/{table_name}.json'
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    Args:
+        table_name: Имя таблицы
+        data: Актуальные данные таблицы
+        changes: Список записей об изменениях (insert/update/delete)
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    storage_for(table_name).append(table_name, data, changes)
+
+
+def compact_table_data(table_name):
+    """Сворачивает журнал изменений таблицы в снимок и возвращает данные таблицы."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return storage_for(table_name).compact(table_name)
+
+
+def remove_table_data(table_name):
+    """Удаляет файлы данных таблицы в любом формате."""
+    storage_for(table_name).remove(table_name)
+    get_storage().remove(table_name)
+
+
+def _upgraded_rows(table_data, changes):
+    """Возвращает записи таблицы, приведенные к актуальной схеме (см. schema.upgrade_row)."""
+    rows = table_data.to_rows()
+    if changes:
+        upgrade_rows(rows, changes)
+    return rows
+
 
+def vacuum_table_data(table_name, columns, changes):
+    """
+    Переписывает данные таблицы в актуальной схеме, не меняя формат хранения.
+    
+    Args:
+        table_name: Имя таблицы
+        columns: Актуальная схема таблицы [('ID', 'int'), ('name', 'str'), ...]
+        changes: Изменения схемы, еще не примененные к записям на диске
+    
+    Returns:
+        Данные таблицы после перезаписи
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    storage = storage_for(table_name)
+    table_data = storage.load(table_name)
+    rows = _upgraded_rows(table_data, changes)
+    if isinstance(table_data, MmapTable):
+        # Схема двоичной таблицы записана в заголовке файла: файл создается заново
+        table_data.close()
+        return MmapTable.create(table_name, columns, rows)
+    storage.save(table_name, rows)
+    return storage.load(table_name)
+
+
+def convert_table_data(table_name, columns, target, changes=None):
+    """
+    Переводит таблицу между форматами хранения.
+    
+    Args:
+        table_name: Имя таблицы
+        columns: Схема таблицы [('ID', 'int'), ('name', 'str'), ...]
+        target: Формат 'binary' (записи фиксированной длины с mmap), 'chunked'
+            (фрагменты по диапазонам ID) или 'json' (снимок и журнал)
+        changes: Изменения схемы, еще не примененные к записям на диске
+            (при переводе записи приводятся к актуальной схеме)
+    
+    Returns:
+        Данные таблицы в новом формате
+    
+    Raises:
+        ValueError: Если формат неизвестен
+    """
+    if target not in ('binary', 'chunked', 'json'):
+        raise ValueError(f"Неизвестный формат '{target}'. Доступны: binary, chunked, json")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    source = storage_for(table_name)
+    if target == 'binary':
+        destination = BinaryStorage()
+    elif target == 'chunked':
+        destination = get_storage('chunked')
+    else:
+        # Формат JSON - движок по умолчанию, если он хранит таблицу в JSON-файле
+        destination = get_storage() if get_storage().name in ('json', 'log') else get_storage('log')
+    if source.name == destination.name or (target == 'json' and source.name in ('json', 'log')):
+        return source.load(table_name)
+    
+    table_data = source.load(table_name)
+    try:
+        if target == 'binary':
+            MmapTable.create(table_name, columns, _upgraded_rows(table_data, changes)).close()
+        else:
+            destination.save(table_name, _upgraded_rows(table_data, changes))
+    finally:
+        if isinstance(table_data, MmapTable):
+            table_data.close()
+    source.remove(table_name)
+    return destination.load(table_name)